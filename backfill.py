@@ -0,0 +1,285 @@
+"""
+Historical Carrefour ticket backfill
+
+Walks the purchase list of a date range page by page (``BACKFILL_PAGE_SIZE``
+tickets per page, following the list's offset parameters), skips the tickets
+already in carrefour_purchase, fetches the missing details concurrently
+(``BACKFILL_CONCURRENCY`` at a time, at most ``BACKFILL_RPM`` Carrefour
+requests per minute) and inserts them ``BACKFILL_CHUNK_SIZE`` tickets per
+transaction. Their health scores and categories are queued for the
+enrichment workers (enrichment.py) in the same transaction.
+
+The offsets of the next page are checkpointed in ``carrefour_backfills``
+after every page, so a failed or interrupted run resumes where it stopped. A
+finished range starts over from the first page on the next run, which only
+costs the list pages since saved tickets are skipped.
+
+Runs from ``POST /carrefour/backfill`` or by hand::
+
+    python backfill.py --from 2024-01-01T00:00:00.000Z --to 2026-01-01T00:00:00.000Z
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import func
+
+import enrichment
+import rollups
+from categorization import RateLimiter
+from database import SessionLocal
+from models.backfill_checkpoint import BackfillCheckpoint
+from models.carrefour_client import CarrefourClient
+from models.product import Product
+from models.purchase import Purchase
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "50"))
+CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+RPM = float(os.getenv("BACKFILL_RPM", "120"))
+CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "100"))
+
+FROM_DATE = "2024-01-01T00:00:00.000Z"
+TO_DATE = "2030-12-31T23:59:59.000Z"
+
+
+def next_offsets(offsets: dict, listing: dict, listed: int) -> dict:
+    """
+    Paging parameters of the page after ``listing``.
+
+    The offsets returned with the page are used when present; otherwise the
+    ticket offset moves forward by the number of tickets listed.
+    """
+    returned = {f: str(listing[f]) for f in CarrefourClient.OFFSET_FIELDS if listing.get(f) is not None}
+    if returned:
+        return {**offsets, **returned}
+    moved = int(offsets.get("ticketOffset", 0)) + listed
+    return {**offsets, "ticketOffset": str(moved), "currentTickets": str(moved)}
+
+
+def _row(obj) -> dict:
+    """Column attributes of an unsaved ORM object, without its autoincrement id."""
+    return {attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs if attr.key != "id"}
+
+
+class BackfillJob:
+    """Save every ticket of a date range that is not saved yet."""
+
+    def __init__(self, from_date: str = FROM_DATE, to_date: str = TO_DATE, page_size: int = PAGE_SIZE,
+                 concurrency: int = CONCURRENCY, rpm: float = RPM, chunk_size: int = CHUNK_SIZE,
+                 client_factory: Callable[[], CarrefourClient] = CarrefourClient):
+        self.from_date = from_date
+        self.to_date = to_date
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.chunk_size = chunk_size
+        self.client_factory = client_factory
+        self._task: Optional[asyncio.Task] = None
+        self._reset()
+
+    @property
+    def key(self) -> str:
+        return f"{self.from_date}|{self.to_date}"
+
+    def _reset(self):
+        self.status = "idle"
+        self.pages = 0
+        self.listed = 0
+        self.skipped = 0
+        self.saved = 0
+        self.failed = 0
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, from_date: Optional[str] = None, to_date: Optional[str] = None) -> bool:
+        """Start a run (over a new date range, if given) in the background. Returns False if one is already running."""
+        if self.running:
+            return False
+        self.from_date = from_date or self.from_date
+        self.to_date = to_date or self.to_date
+        self._reset()
+        self.status = "running"
+        self.started_at = datetime.now()
+        self._task = asyncio.create_task(self.run())
+        return True
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "from": self.from_date,
+            "to": self.to_date,
+            "pages": self.pages,
+            "listed": self.listed,
+            "skipped": self.skipped,
+            "saved": self.saved,
+            "failed": self.failed,
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+        }
+
+    async def run(self):
+        try:
+            client = self.client_factory()
+            checkpoint = await asyncio.to_thread(self.load_checkpoint)
+            offsets = {}
+            if checkpoint and not checkpoint.finished_at:
+                offsets = dict(checkpoint.offsets or {})
+                logger.info(f"Resuming backfill of {self.key} after {checkpoint.pages} pages")
+            limiter = RateLimiter(self.rpm)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            while True:
+                await limiter.acquire()
+                listing = await asyncio.to_thread(
+                    client.get_purchases, self.from_date, self.to_date, self.page_size, offsets
+                )
+                ids = [p["purchaseId"] for p in listing.get("purchases", []) if p.get("purchaseId")]
+                if not ids:
+                    await asyncio.to_thread(self.save_checkpoint, offsets, True)
+                    break
+                self.pages += 1
+                self.listed += len(ids)
+                await self._backfill_page(client, ids, limiter, semaphore)
+                offsets = next_offsets(offsets, listing, len(ids))
+                last = len(ids) < self.page_size
+                await asyncio.to_thread(self.save_checkpoint, offsets, last)
+                if last:
+                    break
+            self.status = "done"
+            logger.info(
+                f"Backfilled {self.saved} Carrefour tickets from {self.pages} pages"
+                f" ({self.skipped} already saved, {self.failed} failed)"
+            )
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Carrefour backfill failed. Error: {e}")
+        finally:
+            self.finished_at = datetime.now()
+
+    async def _backfill_page(self, client: CarrefourClient, ids: list[str], limiter: RateLimiter,
+                             semaphore: asyncio.Semaphore):
+        missing = await asyncio.to_thread(self.unsaved, ids)
+        self.skipped += len(ids) - len(missing)
+        purchases = [p for p in await asyncio.gather(*(self._fetch(client, i, limiter, semaphore) for i in missing)) if p]
+        for i in range(0, len(purchases), self.chunk_size):
+            self.saved += await asyncio.to_thread(self.save, purchases[i:i + self.chunk_size])
+
+    async def _fetch(self, client: CarrefourClient, purchase_id: str, limiter: RateLimiter,
+                     semaphore: asyncio.Semaphore) -> Optional[Purchase]:
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                return await asyncio.to_thread(client.get_purchase, purchase_id)
+            except Exception as e:
+                logger.warning(f"Failed to fetch Carrefour ticket {purchase_id}. Error: {e}")
+                self.failed += 1
+                return None
+
+    def unsaved(self, purchase_ids: list[str]) -> list[str]:
+        db = SessionLocal()
+        try:
+            known = set(db.execute(select(Purchase.ticket_id).where(Purchase.ticket_id.in_(purchase_ids))).scalars())
+        finally:
+            db.close()
+        return [i for i in purchase_ids if i not in known]
+
+    def save(self, purchases: list[Purchase]) -> int:
+        """Bulk insert tickets, their products and enrichment jobs in one transaction. Returns how many tickets were new."""
+        db = SessionLocal()
+        try:
+            # Tickets saved meanwhile (e.g. by the ticket watcher) are left alone
+            inserted = set(db.execute(
+                pg_insert(Purchase).on_conflict_do_nothing(index_elements=[Purchase.ticket_id]).returning(Purchase.ticket_id),
+                [_row(p) for p in purchases],
+            ).scalars())
+            products = [_row(item) for p in purchases if p.ticket_id in inserted for item in p.products]
+            if products:
+                db.execute(insert(Product), products)
+            rollups.refresh_purchases(db, inserted)
+            enrichment.enqueue(db, inserted)
+            db.commit()
+            return len(inserted)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def load_checkpoint(self) -> Optional[BackfillCheckpoint]:
+        db = SessionLocal()
+        try:
+            checkpoint = db.get(BackfillCheckpoint, self.key)
+            if checkpoint and not checkpoint.finished_at:
+                self.pages, self.saved = checkpoint.pages, checkpoint.saved
+            return checkpoint
+        finally:
+            db.close()
+
+    def save_checkpoint(self, offsets: dict, finished: bool):
+        db = SessionLocal()
+        try:
+            values = {"offsets": offsets, "pages": self.pages, "saved": self.saved,
+                      "finished_at": datetime.now() if finished else None}
+            stmt = pg_insert(BackfillCheckpoint).values(key=self.key, **values)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[BackfillCheckpoint.key],
+                set_={**values, "updated_at": func.now()},
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+backfill_job = BackfillJob()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Save every Carrefour ticket of a date range that is not saved yet")
+    parser.add_argument("--from", dest="from_date", default=FROM_DATE)
+    parser.add_argument("--to", dest="to_date", default=TO_DATE)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=RPM)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    async def backfill():
+        job = BackfillJob(args.from_date, args.to_date, args.page_size, args.concurrency, args.rpm, args.chunk_size)
+        await job.run()
+        if job.status != "done":
+            raise SystemExit(f"Backfill {job.status}: {job.error}")
+
+    asyncio.run(backfill())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark: precompiled ExpenseClassifier vs one re.search per pattern
+
+Run from the repository root:
+    python benchmarks/bench_expense_classifier.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense_classifier import EXPENSE_PATTERNS, detect_expense_type  # noqa: E402
+
+# Notification shapes used in tests/test_api.py and tests/test_expense_classifier.py
+NOTIFICATIONS = [
+    ("Payment confirmed", "Paid €25.00 at Mercadona 🛒"),
+    ("Pizza Hut delivery", None),
+    ("Mercadona", "weekly shop"),
+    ("Repsol gasolinera", None),
+    ("TMB metro Barcelona", None),
+    ("Cinema ticket", "Cine Verdi"),
+    ("Vueling flight BCN-MAD", None),
+    ("Endesa electricidad", None),
+    ("Random thing", "no clue"),
+    ("Payment confirmed", "Paid €10.00 at Shop\nCard ending 1234"),
+]
+
+
+def detect_expense_type_per_pattern(title, text=None):
+    """Previous implementation: lowercase, then one re.search per pattern."""
+    content = (title or "").lower()
+    if text:
+        content += " " + text.lower()
+    matches = {}
+    for expense_type, patterns in EXPENSE_PATTERNS.items():
+        match_count = 0
+        for pattern in patterns:
+            if re.search(pattern, content, re.IGNORECASE):
+                match_count += 1
+        if match_count > 0:
+            matches[expense_type] = match_count
+    if matches:
+        return max(matches, key=matches.get)
+    return None
+
+
+def _bench(fn, number):
+    best = min(timeit.repeat(lambda: [fn(t, x) for t, x in NOTIFICATIONS], number=number, repeat=5))
+    return best / (number * len(NOTIFICATIONS)) * 1e6
+
+
+def main(number: int = 2000):
+    for title, text in NOTIFICATIONS:
+        assert detect_expense_type(title, text) == detect_expense_type_per_pattern(title, text)
+
+    before = _bench(detect_expense_type_per_pattern, number)
+    after = _bench(detect_expense_type, number)
+    print(f"re.search per pattern : {before:8.2f} µs/notification")
+    print(f"ExpenseClassifier     : {after:8.2f} µs/notification")
+    print(f"speedup               : {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
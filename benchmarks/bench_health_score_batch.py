@@ -0,0 +1,61 @@
+"""
+Benchmark: score_products_batch vs one score_product call per product
+
+Run from the repository root:
+    python benchmarks/bench_health_score_batch.py [N]
+"""
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.health_score import score_product  # noqa: E402
+from models.health_score_batch import score_products_batch, score_rows_batch  # noqa: E402
+
+
+def _product(rng, n):
+    return {
+        "_id": str(8400000000000 + n),
+        "product_name": f"Product {n}",
+        "brands": "Brand",
+        "nova_group": rng.choice([1, 2, 3, 4]),
+        "nutriscore_grade": rng.choice("abcde"),
+        "categories_tags": rng.sample(["en:snacks", "en:dairies", "en:beverages", "en:teas", "en:biscuits"], 2),
+        "additives_tags": rng.sample(["en:e330", "en:e407", "en:e102", "en:e250", "en:e471"], rng.randint(0, 3)),
+        "labels_tags": rng.sample(["en:organic", "en:vegan", "en:no-gluten"], rng.randint(0, 1)),
+        "nutriments": {
+            "energy-kcal_100g": rng.uniform(0, 600),
+            "sugars_100g": rng.uniform(0, 60),
+            "saturated-fat_100g": rng.uniform(0, 20),
+            "salt_100g": rng.uniform(0, 3),
+            "fiber_100g": rng.uniform(0, 10),
+            "proteins_100g": rng.uniform(0, 30),
+            "fruits-vegetables-nuts_100g": rng.uniform(0, 100),
+        },
+    }
+
+
+def _time(fn, products):
+    products = copy.deepcopy(products)
+    start = time.perf_counter()
+    fn(products)
+    return time.perf_counter() - start
+
+
+def main(n: int = 100_000):
+    rng = random.Random(0)
+    products = [_product(rng, i) for i in range(n)]
+
+    scalar = _time(lambda ps: [score_product(p) for p in ps], products)
+    batch = _time(score_products_batch, products)
+    rows = _time(score_rows_batch, products)
+    print(f"score_product loop   : {scalar:6.2f} s for {n} products")
+    print(f"score_products_batch : {batch:6.2f} s  ({scalar / batch:.1f}x)")
+    print(f"score_rows_batch     : {rows:6.2f} s  ({scalar / rows:.1f}x, no ORM instances)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
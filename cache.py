@@ -0,0 +1,136 @@
+"""
+In-process caches
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Returned by TTLCache.get when the key is absent, so that None can be cached
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a time-to-live."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class Flight:
+    """One in-flight call; followers wait for the leader's result or error."""
+
+    def __init__(self):
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._callbacks: list = []
+        self._lock = threading.Lock()
+
+    def _finish(self, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self.result, self.error = result, error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """Block the calling thread until the leader finishes."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for in-flight call")
+        return self._outcome()
+
+    async def wait_async(self, timeout: Optional[float] = None) -> Any:
+        """Wait without holding a thread, so leaders running in the executor are never starved."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            done = self._done.is_set()
+            if not done:
+                self._callbacks.append(notify)
+        if not done:
+            await asyncio.wait_for(future, timeout)
+        return self._outcome()
+
+
+class SingleFlight:
+    """Registry of in-flight calls so concurrent callers for one key share a single execution."""
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable) -> tuple[Flight, bool]:
+        """Return the flight for ``key`` and whether the caller is its leader."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def resolve(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        """Finish the flight for ``key`` (leader only) and wake its followers."""
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight._finish(result, error)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Run ``fn`` once for concurrent callers with the same key; all get its result or error."""
+        flight, leader = self.acquire(key)
+        if not leader:
+            return flight.wait(timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, result)
+        return result
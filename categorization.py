@@ -0,0 +1,272 @@
+"""
+Batched Gemini categorization of Carrefour products
+
+Uncategorized products are packed ``CATEGORY_BATCH_SIZE`` per prompt, and the
+batches are sent ``CATEGORY_CONCURRENCY`` at a time through the shared Gemini
+client, spaced by a rate limiter (``GEMINI_RPM`` requests per minute). Every
+answered batch is written back with one bulk UPDATE. Products of failed
+batches stay uncategorized and are picked up by the next run.
+
+Products already seen (same barcode, or same normalized description and
+sub-family) are answered from the category cache first, then by the local
+rules of product_classifier.py when they are confident; of the rest only one
+product per identity is sent to the model.
+
+The job runs in the background of the API process; ``categorization_job``
+exposes its progress.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from google.genai import types
+from sqlalchemy import select, update
+
+import gemini
+import rollups
+from database import SessionLocal
+from models.category_cache import category_cache
+from models.health_score import HealthScore
+from models.product import Product
+from product_classifier import classify_product
+from prompts import product_categories
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("CATEGORY_BATCH_SIZE", "25"))
+CONCURRENCY = int(os.getenv("CATEGORY_CONCURRENCY", "3"))
+RPM = float(os.getenv("GEMINI_RPM", "15"))
+
+_CATEGORIES = {c.casefold(): c for c in product_categories.CATEGORIES}
+
+
+class RateLimiter:
+    """Space calls evenly so that at most ``rate`` start per ``period`` seconds."""
+
+    def __init__(self, rate: float, period: float = 60.0):
+        self.interval = period / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def parse_categories(text: str, ids: set[int]) -> dict[int, str]:
+    """product id -> category from a batch answer; unknown ids and categories are dropped."""
+    try:
+        items = json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        logger.warning("Gemini returned invalid JSON for a category batch")
+        return {}
+    if isinstance(items, dict):
+        items = items.get("products") or items.get("items") or [items]
+    result = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            product_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        category = _CATEGORIES.get(str(item.get("category", "")).strip().casefold())
+        if product_id in ids and category:
+            result[product_id] = category
+    return result
+
+
+class CategorizationJob:
+    """Categorize every product without a category, in concurrent rate-limited batches."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY, rpm: float = RPM,
+                 ticket_ids: Optional[list[str]] = None, limiter: Optional[RateLimiter] = None):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rpm = rpm
+        # Only these tickets, and a limiter shared with other jobs (enrichment.py)
+        self.ticket_ids = ticket_ids
+        self.limiter = limiter
+        self._task: Optional[asyncio.Task] = None
+        self._reset()
+
+    def _reset(self):
+        self.status = "idle"
+        self.total = 0
+        self.processed = 0
+        self.categorized = 0
+        self.failed = 0
+        self.cached = 0
+        self.by_rules = 0
+        self.llm_calls = 0
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> bool:
+        """Start a run in the background. Returns False if one is already running."""
+        if self.running:
+            return False
+        self._reset()
+        self.status = "running"
+        self.started_at = datetime.now()
+        self._task = asyncio.create_task(self.run())
+        return True
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "categorized": self.categorized,
+            "failed": self.failed,
+            "cached": self.cached,
+            "byRules": self.by_rules,
+            "llmCalls": self.llm_calls,
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+        }
+
+    async def run(self):
+        try:
+            products = await asyncio.to_thread(self.pending_products)
+            self.total = len(products)
+            keys = {p["id"]: category_cache.keys(p.get("code"), p.get("description"), p.get("subFamily")) for p in products}
+
+            cached = await asyncio.to_thread(category_cache.lookup, keys)
+            if cached:
+                await asyncio.to_thread(self.save, cached, "cache")
+            self.processed = self.categorized = self.cached = len(cached)
+
+            by_rules = {}
+            for p in products:
+                if p["id"] not in cached:
+                    guess = classify_product(p.get("description"), p.get("subFamily"))
+                    if guess.confident:
+                        by_rules[p["id"]] = guess.category
+            if by_rules:
+                await asyncio.to_thread(self.save, by_rules, "rules")
+            self.by_rules = len(by_rules)
+            self.processed += self.by_rules
+            self.categorized += self.by_rules
+
+            # Only one product per identity goes to the model; its duplicates get the same answer
+            groups: dict[str, list[dict]] = {}
+            for p in products:
+                if p["id"] not in cached and p["id"] not in by_rules:
+                    groups.setdefault(keys[p["id"]][0] if keys[p["id"]] else f"id:{p['id']}", []).append(p)
+            representatives = [group[0] for group in groups.values()]
+            members = {group[0]["id"]: group for group in groups.values()}
+
+            limiter = self.limiter or RateLimiter(self.rpm)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            batches = [representatives[i:i + self.batch_size] for i in range(0, len(representatives), self.batch_size)]
+            await asyncio.gather(*(self._run_batch(batch, members, keys, limiter, semaphore) for batch in batches))
+            self.status = "done"
+            logger.info(
+                f"Categorized {self.categorized} of {self.total} products"
+                f" ({self.cached} from cache, {self.by_rules} by rules, {self.llm_calls} model calls, {self.failed} failed)"
+            )
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Product categorization failed. Error: {e}")
+        finally:
+            self.finished_at = datetime.now()
+
+    async def _run_batch(self, batch: list[dict], members: dict[int, list[dict]], keys: dict[int, list[str]],
+                         limiter: RateLimiter, semaphore: asyncio.Semaphore):
+        size = sum(len(members[p["id"]]) for p in batch)
+        async with semaphore:
+            await limiter.acquire()
+            self.llm_calls += 1
+            try:
+                answers = await self.categorize(batch)
+                categories = {m["id"]: c for rep_id, c in answers.items() for m in members[rep_id]}
+                if categories:
+                    await asyncio.to_thread(self.save, categories, "llm")
+                    await asyncio.to_thread(category_cache.remember, [(keys[i], c) for i, c in answers.items()])
+            except Exception as e:
+                logger.error(f"Failed to categorize a batch of {len(batch)} products. Error: {e}")
+                categories = {}
+        self.processed += size
+        self.categorized += len(categories)
+        self.failed += size - len(categories)
+
+    async def categorize(self, batch: list[dict]) -> dict[int, str]:
+        response = await gemini.get_client().aio.models.generate_content(
+            model=gemini.MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction=product_categories.SYSTEM_PROMPT,
+                response_mime_type="application/json",
+            ),
+            contents=product_categories.BATCH_USER_PROMPT.format(
+                PRODUCTS_JSON=json.dumps(batch, ensure_ascii=False)
+            ),
+        )
+        return parse_categories(response.text, {p["id"] for p in batch})
+
+    def pending_products(self) -> list[dict]:
+        """Uncategorized products, with the Open Food Facts name and brand when known."""
+        db = SessionLocal()
+        try:
+            stmt = (
+                select(Product.id, Product.code, Product.description, Product.sub_family,
+                       HealthScore.product_name, HealthScore.brand)
+                .outerjoin(HealthScore, HealthScore.barcode == Product.code)
+                .where(Product.category.is_(None))
+                .order_by(Product.id)
+            )
+            if self.ticket_ids is not None:
+                stmt = stmt.where(Product.ticket_id.in_(self.ticket_ids))
+            return [
+                {k: v for k, v in {
+                    "id": id_, "code": code, "description": description, "subFamily": sub_family,
+                    "productName": name, "brand": brand,
+                }.items() if v is not None}
+                for id_, code, description, sub_family, name, brand in db.execute(stmt)
+            ]
+        finally:
+            db.close()
+
+    def save(self, categories: dict[int, str], source: str):
+        """Store product id -> category answers, and where they came from (see Product.category_source)."""
+        db = SessionLocal()
+        try:
+            db.execute(update(Product), [
+                {"id": i, "category": c, "category_source": source} for i, c in categories.items()
+            ])
+            rollups.refresh_purchases(db, rollups.tickets_with(db, product_ids=categories))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+categorization_job = CategorizationJob()
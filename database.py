@@ -1,29 +1,88 @@
 import os
+from typing import Optional
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 load_dotenv(".env")
 
-DATABASE_URL = (
-    f"postgresql+psycopg2://"
+_CREDENTIALS = (
     f"{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
     f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', '5432')}"
     f"/{os.getenv('DB_NAME', 'expenses')}"
 )
+DATABASE_URL = f"postgresql+psycopg2://{_CREDENTIALS}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{_CREDENTIALS}"
+
+# Connection pool, shared by the sync and the async engine (each gets its own pool)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Seconds after which a connection is replaced, before a proxy or the server drops it
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Milliseconds per statement of an API request session; 0 lets them run as long as the server
+# allows. Scripts and background jobs (imports, rebuilds) are never limited.
+STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "30000"))
 
-engine = create_engine(DATABASE_URL)
+POOL_OPTIONS = {
+    "pool_size": POOL_SIZE,
+    "max_overflow": MAX_OVERFLOW,
+    "pool_timeout": POOL_TIMEOUT,
+    "pool_pre_ping": POOL_PRE_PING,
+    "pool_recycle": POOL_RECYCLE,
+}
+
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+_async_engine: Optional[AsyncEngine] = None
+
 
 class Base(DeclarativeBase):
     pass
 
 
+def get_async_engine() -> AsyncEngine:
+    """The asyncpg engine, created on first use so the sync-only scripts do not need asyncpg."""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+    return _async_engine
+
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+def _limit_statements(session, transaction, connection):
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT}")
+
+
+def _request_session(session):
+    """Apply STATEMENT_TIMEOUT to every transaction of a request session (sync, or an AsyncSession's)."""
+    if STATEMENT_TIMEOUT:
+        event.listen(session, "after_begin", _limit_statements)
+    return session
+
+
 def get_db():
     """FastAPI dependency that provides a SQLAlchemy session."""
-    db = SessionLocal()
+    db = _request_session(SessionLocal())
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """FastAPI dependency that provides an asyncio SQLAlchemy session, for ``async def`` routes."""
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        _request_session(db.sync_session)
+        yield db
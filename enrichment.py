@@ -0,0 +1,300 @@
+"""
+Durable enrichment queue for saved Carrefour tickets
+
+Saving a ticket only inserts it; the slow work is queued in
+``enrichment_jobs`` in the same transaction, one row per ticket and stage:
+
+- ``score``: fetch the health scores of the ticket's barcodes from Open Food
+  Facts and refresh its rollup
+- ``categorize``: categorize its products (cache, rules, then Gemini)
+
+Workers of the API process claim the jobs with ``FOR UPDATE SKIP LOCKED``, so
+several processes can share the queue without taking the same job, and run at
+most ``ENRICH_SCORE_CONCURRENCY`` / ``ENRICH_CATEGORIZE_CONCURRENCY`` jobs of
+each stage at a time. A failed job is retried after ``ENRICH_RETRY_DELAY``
+seconds, doubling, and marked failed after ``ENRICH_MAX_ATTEMPTS`` attempts.
+Jobs left running by a dead process are taken over once their lease
+(``ENRICH_LEASE`` seconds) expires. Queueing a ticket that already has a
+pending or running job of a stage does nothing.
+
+The queue depth is served by ``GET /carrefour/enrichment``. Pending jobs can
+also be drained by hand::
+
+    python enrichment.py [--stage score]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+import categorization
+import rollups
+from categorization import CategorizationJob, RateLimiter
+from database import SessionLocal
+from models.enrichment_job import EnrichmentJob
+from models.open_food_facts import OpenFoodFacts
+from models.product import Product
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("score", "categorize")
+CONCURRENCY = {
+    "score": int(os.getenv("ENRICH_SCORE_CONCURRENCY", "2")),
+    "categorize": int(os.getenv("ENRICH_CATEGORIZE_CONCURRENCY", "1")),
+}
+MAX_ATTEMPTS = int(os.getenv("ENRICH_MAX_ATTEMPTS", "5"))
+RETRY_DELAY = float(os.getenv("ENRICH_RETRY_DELAY", "30"))
+LEASE = float(os.getenv("ENRICH_LEASE", "600"))
+POLL_INTERVAL = float(os.getenv("ENRICH_POLL_INTERVAL", "2"))
+
+
+def enqueue(db, ticket_ids: Iterable[str], stages: Iterable[str] = STAGES) -> None:
+    """
+    Queue the stages of the given tickets in the caller's transaction.
+
+    Jobs already pending or running are left alone; finished and failed ones
+    are queued again from scratch.
+    """
+    rows = [{"ticket_id": t, "stage": s} for t in dict.fromkeys(ticket_ids) for s in stages]
+    if not rows:
+        return
+    stmt = insert(EnrichmentJob)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[EnrichmentJob.ticket_id, EnrichmentJob.stage],
+        set_={"status": "pending", "attempts": 0, "run_after": func.now(), "locked_at": None,
+              "last_error": None, "updated_at": func.now()},
+        where=EnrichmentJob.status.in_(("done", "failed")),
+    ), rows)
+
+
+def retry_delay(attempts: int, first: float = RETRY_DELAY) -> float:
+    """Seconds before the next attempt after ``attempts`` failed ones: first, 2 * first, 4 * first, ..."""
+    return first * 2 ** (attempts - 1)
+
+
+class EnrichmentQueue:
+    """Workers running the queued enrichment jobs, ``concurrency[stage]`` at a time per stage."""
+
+    def __init__(self, concurrency: Optional[dict[str, int]] = None, max_attempts: int = MAX_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY, lease: float = LEASE, poll_interval: float = POLL_INTERVAL):
+        self.concurrency = concurrency or CONCURRENCY
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.done = dict.fromkeys(STAGES, 0)
+        self.retried = dict.fromkeys(STAGES, 0)
+        self.failed = dict.fromkeys(STAGES, 0)
+        self._tasks: list[asyncio.Task] = []
+        self._limiter: Optional[RateLimiter] = None
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    def start(self) -> bool:
+        """Start the workers in the background. Returns False if they are already running."""
+        if self.running:
+            return False
+        self._start()
+        self._tasks = [
+            asyncio.create_task(self._worker(stage))
+            for stage, workers in self.concurrency.items() for _ in range(workers)
+        ]
+        return True
+
+    def _start(self):
+        # One Gemini budget for every categorize worker
+        self._limiter = RateLimiter(categorization.RPM)
+
+    async def stop(self):
+        """Cancel the workers; the jobs they were running go back to pending."""
+        tasks = [t for t in self._tasks if not t.done()]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def drain(self, stages: Iterable[str] = STAGES):
+        """Run the jobs that are due until none is left."""
+        self._start()
+        await asyncio.gather(*(
+            self._worker(stage, drain=True)
+            for stage in stages for _ in range(self.concurrency.get(stage, 1))
+        ))
+
+    async def _worker(self, stage: str, drain: bool = False):
+        while True:
+            try:
+                claimed = await asyncio.to_thread(self.claim, stage)
+            except Exception as e:
+                logger.error(f"Failed to claim a {stage} enrichment job. Error: {e}")
+                claimed = None
+                if drain:
+                    return
+            if claimed:
+                await self.process(stage, *claimed)
+            elif drain:
+                return
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, stage: str, job_id: int, ticket_id: str, attempts: int):
+        try:
+            await getattr(self, stage)(ticket_id)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.release, job_id)
+            raise
+        except Exception as e:
+            logger.warning(f"Enrichment {stage} of ticket {ticket_id} failed (attempt {attempts}). Error: {e}")
+            await asyncio.to_thread(self.fail, job_id, attempts, str(e))
+            if attempts >= self.max_attempts:
+                self.failed[stage] += 1
+            else:
+                self.retried[stage] += 1
+        else:
+            await asyncio.to_thread(self.complete, job_id)
+            self.done[stage] += 1
+
+    async def score(self, ticket_id: str):
+        """Fetch the missing health scores of a ticket, then refresh its rollup."""
+        codes = await asyncio.to_thread(self.ticket_codes, ticket_id)
+        failed = set()
+        if codes:
+            _, failed = await OpenFoodFacts().resolve_products(codes)
+        await asyncio.to_thread(self.refresh_rollup, ticket_id)
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(codes)} products could not be fetched from Open Food Facts")
+
+    async def categorize(self, ticket_id: str):
+        """Categorize the uncategorized products of a ticket."""
+        job = CategorizationJob(ticket_ids=[ticket_id], limiter=self._limiter)
+        await job.run()
+        if job.status != "done":
+            raise RuntimeError(job.error or f"categorization {job.status}")
+        if job.failed:
+            raise RuntimeError(f"{job.failed} of {job.total} products left uncategorized")
+
+    def claim(self, stage: str) -> Optional[tuple[int, str, int]]:
+        """Lock the next due job of a stage for this worker. Returns (id, ticket id, attempt number)."""
+        db = SessionLocal()
+        try:
+            stmt = (
+                select(EnrichmentJob)
+                .where(EnrichmentJob.stage == stage, or_(
+                    and_(EnrichmentJob.status == "pending", EnrichmentJob.run_after <= func.now()),
+                    and_(EnrichmentJob.status == "running",
+                         EnrichmentJob.locked_at < func.now() - timedelta(seconds=self.lease)),
+                ))
+                .order_by(EnrichmentJob.run_after, EnrichmentJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = db.execute(stmt).scalars().first()
+            if job is None:
+                return None
+            claimed = (job.id, job.ticket_id, job.attempts + 1)
+            job.status = "running"
+            job.attempts = claimed[2]
+            job.locked_at = func.now()
+            db.commit()
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def complete(self, job_id: int):
+        self._update(job_id, status="done", locked_at=None, last_error=None)
+
+    def fail(self, job_id: int, attempts: int, error: str):
+        if attempts >= self.max_attempts:
+            self._update(job_id, status="failed", locked_at=None, last_error=error)
+        else:
+            run_after = func.now() + timedelta(seconds=retry_delay(attempts, self.retry_delay))
+            self._update(job_id, status="pending", run_after=run_after, locked_at=None, last_error=error)
+
+    def release(self, job_id: int):
+        """Give back an interrupted job without counting the attempt."""
+        self._update(job_id, status="pending", attempts=EnrichmentJob.attempts - 1, locked_at=None)
+
+    def _update(self, job_id: int, **values):
+        db = SessionLocal()
+        try:
+            db.execute(update(EnrichmentJob).where(EnrichmentJob.id == job_id).values(**values, updated_at=func.now()))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # The lease brings the job back if its state could not be stored
+            logger.error(f"Failed to update enrichment job {job_id}. Error: {e}")
+        finally:
+            db.close()
+
+    def ticket_codes(self, ticket_id: str) -> list[str]:
+        db = SessionLocal()
+        try:
+            return list(db.execute(
+                select(Product.code).where(Product.ticket_id == ticket_id, Product.code.is_not(None)).distinct()
+            ).scalars())
+        finally:
+            db.close()
+
+    def refresh_rollup(self, ticket_id: str):
+        db = SessionLocal()
+        try:
+            rollups.refresh_purchases(db, [ticket_id])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def depth(self) -> dict[str, dict[str, int]]:
+        """Number of jobs per stage and status."""
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(EnrichmentJob.stage, EnrichmentJob.status, func.count())
+                .group_by(EnrichmentJob.stage, EnrichmentJob.status)
+            ).all()
+        finally:
+            db.close()
+        result = {stage: dict.fromkeys(("pending", "running", "done", "failed"), 0) for stage in STAGES}
+        for stage, status, count in rows:
+            result.setdefault(stage, {})[status] = count
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "processed": {stage: {"done": self.done[stage], "retried": self.retried[stage], "failed": self.failed[stage]}
+                          for stage in STAGES},
+        }
+
+
+enrichment_queue = EnrichmentQueue()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the pending enrichment jobs of saved Carrefour tickets")
+    parser.add_argument("--stage", choices=STAGES, action="append", help="only this stage (repeatable)")
+    args = parser.parse_args(argv)
+    queue = EnrichmentQueue()
+    asyncio.run(queue.drain(args.stage or STAGES))
+    logger.info(f"Enrichment done: {queue.to_dict()['processed']}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,223 @@
+"""
+Event broadcaster for the Server-Sent Events stream
+
+Routes publish events (new expenses, saved Carrefour tickets) and every open
+``GET /expenses/stream`` connection receives them through its own bounded
+queue. The transport between publishers and subscribers is pluggable and is
+selected with the ``EVENTS_BACKEND`` environment variable:
+
+- ``memory``   (default) fan-out inside this process only
+- ``postgres`` ``NOTIFY``/``LISTEN`` so that several uvicorn workers share events
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+
+class MemoryBackend:
+    """Deliver published messages straight to the subscribers of this process."""
+
+    def __init__(self, deliver: Callable[[str], None]):
+        self._deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, message: str):
+        self._deliver(message)
+
+
+class PostgresBackend:
+    """Share events between processes with Postgres NOTIFY/LISTEN."""
+
+    CHANNEL = "expense_events"
+    RECONNECT_FIRST_DELAY = 1.0
+    RECONNECT_MAX_DELAY = 30.0
+
+    def __init__(self, deliver: Callable[[str], None]):
+        self._deliver = deliver
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self._listen()
+        logger.info(f"Listening for events on Postgres channel {self.CHANNEL}")
+
+    async def stop(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reconnect_task
+            self._reconnect_task = None
+        self._close()
+        self._loop = None
+
+    def _connect(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+        from database import engine
+
+        # Dedicated connection: a LISTEN session must not go back to the pool
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        conn = psycopg2.connect(dsn)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.CHANNEL}")
+        return conn
+
+    async def _listen(self):
+        self._conn = await asyncio.to_thread(self._connect)
+        self._loop.add_reader(self._conn.fileno(), self._on_readable)
+
+    def _close(self):
+        if self._conn is None:
+            return
+        with contextlib.suppress(Exception):
+            self._loop.remove_reader(self._conn.fileno())
+        with contextlib.suppress(Exception):
+            self._conn.close()
+        self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.error(f"Lost the Postgres LISTEN connection, reconnecting. Error: {e}")
+            self._close()
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+            return
+        while self._conn.notifies:
+            self._deliver(self._conn.notifies.pop(0).payload)
+
+    async def _reconnect(self):
+        delay = self.RECONNECT_FIRST_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._listen()
+            except Exception as e:
+                logger.warning(f"Failed to reconnect to Postgres channel {self.CHANNEL}. Error: {e}")
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+            else:
+                logger.info(f"Listening for events on Postgres channel {self.CHANNEL} again")
+                return
+
+    def publish(self, message: str):
+        if self._loop is None:
+            # Not listening (e.g. lifespan not started): keep local subscribers working
+            self._deliver(message)
+            return
+        if self._conn is None:
+            # Reconnecting: this process would not hear its own notification
+            self._deliver(message)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            # Called from an async route: the NOTIFY round trip must not block the loop
+            self._loop.run_in_executor(None, self._notify, message).add_done_callback(self._notified)
+        else:
+            self._notify(message)
+
+    def _notify(self, message: str):
+        from database import engine
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.CHANNEL, "payload": message})
+            conn.commit()
+
+    @staticmethod
+    def _notified(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.error(f"Failed to publish an event. Error: {future.exception()}")
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "postgres": PostgresBackend,
+}
+
+
+class Broadcaster:
+    """Fan out published events to every subscriber queue."""
+
+    def __init__(self, backend: str = "memory"):
+        self.backend = BACKENDS[backend](self._deliver)
+        self._subscribers: set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def publish(self, event: str, data: dict):
+        """Publish an event. Safe to call from any thread; never raises."""
+        try:
+            self.backend.publish(json.dumps({"event": event, "data": data}, default=str))
+        except Exception as e:
+            logger.error(f"Failed to publish {event} event: {e}")
+
+    def _deliver(self, message: str):
+        if not self._subscribers or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._fan_out(message)
+        else:
+            self._loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message: str):
+        payload = json.loads(message)
+        frame = f"event: {payload['event']}\ndata: {json.dumps(payload['data'])}\n\n"
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                logger.warning("Dropping event for slow SSE subscriber")
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self) -> AsyncIterator[asyncio.Queue]:
+        """Register a queue that receives formatted SSE frames until the block exits."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    async def stream(self, is_disconnected: Callable) -> AsyncIterator[str]:
+        """SSE body: event frames, plus a keepalive comment when idle."""
+        async with self.subscribe() as queue:
+            yield ": connected\n\n"
+            while not await is_disconnected():
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+
+
+broadcaster = Broadcaster(os.getenv("EVENTS_BACKEND", "memory"))
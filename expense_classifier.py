@@ -116,6 +116,157 @@ EXPENSE_PATTERNS = {
 }
 
 
+_WORD_RE = re.compile(r"\w+")
+_BOUNDED_GROUP_RE = re.compile(r"^\\b\((?P<body>.*)\)\\b$")
+_REGEX_META = set("()*+?{}.^$|")
+
+
+def _expand_alternative(alt: str) -> Optional[list[str]]:
+    """
+    Expand one regex alternative into the plain strings it matches
+
+    Only literal characters, escaped punctuation (``\\.``) and simple
+    character classes (``[oó]``) are supported.
+
+    Returns:
+        list of strings, or None if the alternative uses any other regex syntax
+    """
+    variants = [""]
+    i = 0
+    while i < len(alt):
+        c = alt[i]
+        if c == "\\":
+            chars = alt[i + 1:i + 2]
+            if not chars or chars.isalnum():
+                return None
+            i += 2
+        elif c == "[":
+            j = alt.find("]", i)
+            chars = alt[i + 1:j] if j > i else ""
+            if not chars or any(ch in "\\^-[" for ch in chars):
+                return None
+            i = j + 1
+        elif c in _REGEX_META:
+            return None
+        else:
+            chars = c
+            i += 1
+        variants = [v + ch for v in variants for ch in chars]
+    return variants if all(variants) else None
+
+
+def _is_word_char(c: str) -> bool:
+    return bool(_WORD_RE.fullmatch(c))
+
+
+class ExpenseClassifier:
+    """
+    Precompiled classifier over a pattern table shaped like EXPENSE_PATTERNS
+
+    The table is compiled once and every category is scored in a single pass
+    over the words of the text, instead of one ``re.search`` per pattern:
+
+    - word-bounded alternations (``\\b(foo|bar baz)\\b``) are indexed by their
+      first word and verified with a precompiled regex on the candidate span
+    - unbounded literals without letters (emojis) become substring checks
+    - any other pattern falls back to its own precompiled regex
+
+    Results are identical to running ``re.search(pattern, content, re.IGNORECASE)``
+    for every pattern and picking the category with most matching patterns.
+    """
+
+    def __init__(self, patterns: dict[str, list[str]]):
+        self.categories = list(patterns)
+        self._pattern_category: list[int] = []
+        self._by_first_word: dict[str, list[tuple[re.Pattern, int, int]]] = {}
+        self._substrings: list[tuple[str, int]] = []
+        self._residual: list[tuple[re.Pattern, int]] = []
+
+        for category_idx, category_patterns in enumerate(patterns.values()):
+            for pattern in category_patterns:
+                pattern_id = len(self._pattern_category)
+                self._pattern_category.append(category_idx)
+                if not self._index_pattern(pattern, pattern_id):
+                    self._residual.append((re.compile(pattern, re.IGNORECASE), pattern_id))
+
+    def _index_pattern(self, pattern: str, pattern_id: int) -> bool:
+        """Add the literals of a pattern to the lookup tables. Returns False if it is not a literal pattern."""
+        match = _BOUNDED_GROUP_RE.match(pattern)
+        body = match.group("body") if match else pattern
+        if "\\|" in body:
+            return False
+
+        literals = []
+        for alt in body.split("|"):
+            expanded = _expand_alternative(alt)
+            if expanded is None:
+                return False
+            literals.extend(expanded)
+
+        if match:
+            if not all(_is_word_char(lit[0]) and _is_word_char(lit[-1]) for lit in literals):
+                return False
+            for lit in literals:
+                words = _WORD_RE.findall(lit)
+                regex = re.compile(rf"\b{re.escape(lit)}\b", re.IGNORECASE)
+                self._by_first_word.setdefault(words[0].casefold(), []).append((regex, len(words), pattern_id))
+        else:
+            # Substring checks are only equivalent to IGNORECASE for caseless text
+            if any(lit.lower() != lit.upper() for lit in literals):
+                return False
+            self._substrings.extend((lit, pattern_id) for lit in literals)
+        return True
+
+    def score(self, content: str) -> dict[str, int]:
+        """
+        Count matching patterns per category in already lowercased content
+
+        Returns:
+            dict of category -> match count, only for categories with matches,
+            in pattern table order
+        """
+        matched: set[int] = set()
+
+        spans = [m.span() for m in _WORD_RE.finditer(content)]
+        for k, (start, end) in enumerate(spans):
+            candidates = self._by_first_word.get(content[start:end].casefold())
+            if not candidates:
+                continue
+            for regex, n_words, pattern_id in candidates:
+                last = k + n_words - 1
+                if pattern_id in matched or last >= len(spans):
+                    continue
+                if regex.fullmatch(content, start, spans[last][1]):
+                    matched.add(pattern_id)
+
+        for literal, pattern_id in self._substrings:
+            if pattern_id not in matched and literal in content:
+                matched.add(pattern_id)
+
+        for regex, pattern_id in self._residual:
+            if regex.search(content):
+                matched.add(pattern_id)
+
+        counts = [0] * len(self.categories)
+        for pattern_id in matched:
+            counts[self._pattern_category[pattern_id]] += 1
+        return {c: n for c, n in zip(self.categories, counts) if n}
+
+    def classify(self, title: str, text: str = None) -> Optional[str]:
+        """Return the category with most matching patterns, or None"""
+        content = (title or "").lower()
+        if text:
+            content += " " + text.lower()
+
+        matches = self.score(content)
+        if matches:
+            return max(matches, key=matches.get)
+        return None
+
+
+_classifier = ExpenseClassifier(EXPENSE_PATTERNS)
+
+
 def detect_expense_type(title: str, text: str = None) -> Optional[str]:
     """
     Detect expense type based on merchant name and transaction text
@@ -127,29 +278,7 @@ def detect_expense_type(title: str, text: str = None) -> Optional[str]:
     Returns:
         expense_type string or None if cannot be determined
     """
-    # Combine title and text for analysis
-    content = (title or "").lower()
-    if text:
-        content += " " + text.lower()
-    
-    # Track matches per category
-    matches = {}
-    
-    for expense_type, patterns in EXPENSE_PATTERNS.items():
-        match_count = 0
-        for pattern in patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                match_count += 1
-        
-        if match_count > 0:
-            matches[expense_type] = match_count
-    
-    # Return the category with most matches
-    if matches:
-        return max(matches, key=matches.get)
-    
-    # Default to None if no clear match
-    return None
+    return _classifier.classify(title, text)
 
 
 def classify_by_emoji(text: str) -> Optional[str]:
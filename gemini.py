@@ -0,0 +1,25 @@
+"""
+Shared Gemini client
+
+One ``genai.Client`` per process, so every categorization call reuses its
+HTTP connection pool instead of building a new client per product.
+"""
+
+import os
+import threading
+
+from google import genai
+
+MODEL = os.getenv("GEMINI_MODEL", "gemini-3.1-flash-lite-preview")
+
+_client: genai.Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> genai.Client:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    return _client
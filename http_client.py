@@ -0,0 +1,102 @@
+"""
+Shared outbound HTTP layer
+
+One pooled keep-alive ``requests.Session`` per upstream host, so consecutive
+calls to Carrefour or Open Food Facts reuse the TCP+TLS connection. Sessions
+keep no cookies: calls stay as independent as one-shot requests. Every
+request gets connect/read timeouts, and idempotent requests (GET/HEAD) are
+retried with exponential backoff on connection errors and 429/5xx answers.
+
+Tuned with environment variables:
+
+- ``HTTP_POOL_CONNECTIONS`` / ``HTTP_POOL_MAXSIZE``  connection pool size per host
+- ``HTTP_CONNECT_TIMEOUT`` / ``HTTP_READ_TIMEOUT``   seconds
+- ``HTTP_RETRIES`` / ``HTTP_BACKOFF``                retry count and backoff factor
+"""
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from curl_cffi import requests as creq
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+# Browser-impersonating curl_cffi sessions, one per thread id
+_impersonated: dict[int, creq.Session] = {}
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # Shared by unrelated calls: never store a Set-Cookie
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Pooled session for the host of ``url``."""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.setdefault(host, _new_session())
+    return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def get_impersonated(url: str, impersonate: str = "chrome120", **kwargs):
+    """GET through a browser-impersonating curl_cffi session (one per thread, kept alive)."""
+    thread = threading.get_ident()
+    session = _impersonated.get(thread)
+    if session is None:
+        with _sessions_lock:
+            session = _impersonated[thread] = creq.Session(impersonate=impersonate)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    try:
+        return session.get(url, impersonate=impersonate, **kwargs)
+    finally:
+        session.cookies.clear()
+
+
+def close_all():
+    """Close every pooled and impersonating session (application shutdown)."""
+    with _sessions_lock:
+        for session in [*_sessions.values(), *_impersonated.values()]:
+            session.close()
+        _sessions.clear()
+        _impersonated.clear()
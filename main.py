@@ -1,19 +1,56 @@
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 import os
 import logging
-from database import get_db
+import http_client
+import rescore
+from backfill import backfill_job
+from categorization import categorization_job
+from database import dispose_async_engine, get_async_db
+from enrichment import enrichment_queue
+from events import broadcaster
 from routes.expenses import router as expenses_router
+from routes.expense_stats import router as expense_stats_router
+from routes.expense_geo import router as expense_geo_router
 from routes.carrefour import router as carrefour_router
 from routes.open_food import router as open_food_router
 from routes.product import router as product_router
+from ticket_watcher import ticket_watcher
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Notifications API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await broadcaster.start()
+    await ticket_watcher.start()
+    enrichment_queue.start()
+    rescore_job = rescore.RescoreJob()
+    rescore_task = asyncio.create_task(rescore_job.run_in_background()) if rescore.ON_STARTUP else None
+    yield
+    if rescore_task:
+        # The running chunk still commits in its thread; the task itself is not left pending
+        rescore_job.stop()
+        rescore_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await rescore_task
+    await backfill_job.stop()
+    await categorization_job.stop()
+    await ticket_watcher.stop()
+    await enrichment_queue.stop()
+    await broadcaster.stop()
+    http_client.close_all()
+    await dispose_async_engine()
+
+
+app = FastAPI(title="Notifications API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,15 +69,17 @@ async def root():
 
 
 @app.get("/health")
-async def health(db: Session = Depends(get_db)):
+async def health(db: AsyncSession = Depends(get_async_db)):
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": f"disconnected: {str(e)}"}
 
 
 app.include_router(expenses_router)
+app.include_router(expense_stats_router)
+app.include_router(expense_geo_router)
 app.include_router(carrefour_router)
 app.include_router(open_food_router)
 app.include_router(product_router)
@@ -2,4 +2,11 @@ from .notification import MessageData, MediaInfo, NotificationRequest
 from .purchase import Purchase
 from .expense import Expense
 from .product import Product
-from .health_score import HealthScore
\ No newline at end of file
+from .health_score import HealthScore
+from .off_miss import OffMiss
+from .off_product import OffProduct
+from .category_cache import ProductCategory
+from .rollup import MonthlyRollup, PurchaseRollup
+from .ticket_watch import TicketWatch
+from .backfill_checkpoint import BackfillCheckpoint
+from .enrichment_job import EnrichmentJob
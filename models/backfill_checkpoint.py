@@ -0,0 +1,17 @@
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class BackfillCheckpoint(Base):
+    """Progress of a Carrefour ticket backfill over one date range (see backfill.py)."""
+    __tablename__ = "carrefour_backfills"
+
+    key = Column(String(100), primary_key=True)
+    offsets = Column(JSONB, nullable=False, default=dict)
+    pages = Column(Integer, nullable=False, default=0)
+    saved = Column(Integer, nullable=False, default=0)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
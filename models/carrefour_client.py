@@ -1,20 +1,63 @@
-import asyncio
 import os
+import threading
 import time
-from datetime import datetime, timedelta
+from typing import Callable
 from urllib.parse import quote
 from fastapi import HTTPException
 from dotenv import load_dotenv
 import requests
-from curl_cffi import requests as creq
 import logging
+import http_client
 from models import Purchase
-from models.open_food_facts import OpenFoodFacts
+from models.category_cache import category_cache
+from product_classifier import apply_rules
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# ---------------------------------------------------------------------------
+# Authentication token cache
+# ---------------------------------------------------------------------------
+
+class TokenCache:
+    """
+    Process-wide cache for the Carrefour id_token.
+
+    The token is reused until ``refresh_margin`` seconds before it expires.
+    Refreshes are serialised with a lock so concurrent requests that find an
+    expired token log in once instead of once each.
+    """
+
+    def __init__(self, ttl: float, refresh_margin: float):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def get(self, fetch: Callable[[], str]) -> str:
+        if self._valid():
+            return self._token
+        with self._lock:
+            if not self._valid():
+                fetched_at = time.monotonic()
+                self._token = fetch()
+                self._expires_at = fetched_at + self.ttl
+                logger.info("Refreshed Carrefour id_token")
+            return self._token
+
+    def invalidate(self, token: str | None = None):
+        """Drop the cached token (only if it is still ``token``, when given)."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+
 # ---------------------------------------------------------------------------
 # Carrefour HTTP client
 # ---------------------------------------------------------------------------
@@ -29,11 +72,24 @@ class CarrefourClient:
 
     FROM_DATE = "2026-01-01T00:00:00.000Z"
 
+    # Paging parameters of the purchase list
+    OFFSET_FIELDS = ("atgfOffset", "atgnfOffset", "currentAtgfOrders", "currentAtgnfOrders", "currentTickets", "ticketOffset")
+
+    # Lifetime requested from get_jwt, and how early the cached token is refreshed
+    JWT_EXPIRATION = 1800
+    JWT_REFRESH_MARGIN = int(os.getenv("CARREFOUR_JWT_REFRESH_MARGIN", "120"))
+
+    token_cache = TokenCache(JWT_EXPIRATION, JWT_REFRESH_MARGIN)
+
     def __init__(self):
         self.email = os.getenv("CARREFOUR_EMAIL", "")
         self.password = os.getenv("CARREFOUR_PASSWORD", "")
         self.api_key = self.API_KEY
-        self.id_token = self.authenticate()
+
+    @property
+    def id_token(self) -> str:
+        """Cached JWT, shared by every client in the process."""
+        return self.token_cache.get(self.authenticate)
 
     def login(self) -> dict:
         payload = (
@@ -46,7 +102,7 @@ class CarrefourClient:
             "authMode=cookie&pageURL=https%3A%2F%2Fwww.carrefour.es%2Faccess&"
             "sdkBuild=18585&format=json"
         )
-        response = requests.post(
+        response = http_client.post(
             self.LOGIN_URL,
             data=payload,
             headers={
@@ -60,12 +116,12 @@ class CarrefourClient:
     def get_jwt(self, login_token: str) -> dict:
         payload = (
             "fields=data.GR%2Cprofile.email%2Cdata.DQ%2Cdata.acceptedCustomerPolicies%2Cdata.ID_ATG&"
-            "expiration=1800&"
+            f"expiration={self.JWT_EXPIRATION}&"
             f"APIKey={self.api_key}&sdk=js_latest&"
             f"login_token={login_token}&authMode=cookie&"
             "pageURL=https%3A%2F%2Fwww.carrefour.es%2Faccess&sdkBuild=18585&format=json"
         )
-        response = requests.post(
+        response = http_client.post(
             self.GET_JWT_URL,
             data=payload,
             headers={
@@ -92,23 +148,17 @@ class CarrefourClient:
         from_date: str = FROM_DATE,
         to_date: str = "2030-12-31T23:59:59.000Z",
         count: int = 10,
+        offsets: dict | None = None,
     ) -> dict:
+        """One page of the purchase list; ``offsets`` overrides the paging parameters (see OFFSET_FIELDS)."""
         params = {
             "from": from_date,
             "to": to_date,
-            "atgfOffset": "0",
-            "atgnfOffset": "0",
-            "currentAtgfOrders": "0",
-            "currentAtgnfOrders": "0",
-            "currentTickets": "0",
-            "ticketOffset": "0",
+            **{field: "0" for field in self.OFFSET_FIELDS},
+            **{field: str(value) for field, value in (offsets or {}).items() if field in self.OFFSET_FIELDS},
             "count": str(count),
         }
-        response = requests.get(
-            self.PURCHASE_LIST_URL,
-            headers=self._auth_headers(self.id_token),
-            params=params,
-        )
+        response = self._authorized_get(self.PURCHASE_LIST_URL, params=params)
         response.raise_for_status()
         return response.json()
 
@@ -123,30 +173,14 @@ class CarrefourClient:
         return self.get_purchase(purchase_id)
 
     def get_purchase(self, purchase_id: str) -> Purchase:
-        response = requests.get(
-            f"{self.PURCHASE_DETAIL_URL}/{purchase_id}",
-            headers=self._auth_headers(self.id_token),
-        )
+        """Ticket detail. Saved tickets are enriched by the enrichment queue (enrichment.py)."""
+        response = self._authorized_get(f"{self.PURCHASE_DETAIL_URL}/{purchase_id}")
         response.raise_for_status()
         data = response.json()
         purchase = Purchase.from_api_data(data)
-        asyncio.create_task(self.fetch_extra_data(purchase))
-        return purchase
-
-    async def fetch_extra_data(self, purchase):
-        for p in purchase.products:
-            p.get_category()
-        await self.calc_mean_score(purchase)
-
-    async def calc_mean_score(self, purchase):
-        score = 0
-        count = 0
-        for p in purchase.products:
-            off_item = OpenFoodFacts().get_product(p.code)
-            if off_item:
-                score += off_item.total_score
-                count += 1
-        purchase.health_score = score / count
+        # Seen products get their category with one lookup and obvious ones from the rules, no LLM call
+        category_cache.apply(purchase.products)
+        apply_rules(purchase.products)
         return purchase
 
     def search_product(self, query: str, store: str = "004015", page: int = 1) -> list:
@@ -161,19 +195,18 @@ class CarrefourClient:
             "query": query,
             "page": str(page),
         }
-        response = creq.get(self.SEARCH_URL, params=params, impersonate="chrome120")
+        response = http_client.get_impersonated(self.SEARCH_URL, params=params, impersonate="chrome120")
         response.raise_for_status()
         return response.json().get("content", {}).get("docs", [])
 
-    def find_last_purchase(self) -> Purchase | None:
-        from_date = (datetime.now() - timedelta(minutes=1000)).isoformat()
-        for i in range(60):
-            logger.info(f"Looking for ticket {i} - {from_date}")
-            data = self.get_last_purchase(from_date=from_date)
-            if data:
-                return data
-            time.sleep(5)
-        return None
+    def _authorized_get(self, url: str, params: dict | None = None) -> requests.Response:
+        """GET with the cached token; on 401 the token is refreshed and the call retried once."""
+        token = self.id_token
+        response = http_client.get(url, headers=self._auth_headers(token), params=params)
+        if response.status_code == 401:
+            self.token_cache.invalidate(token)
+            response = http_client.get(url, headers=self._auth_headers(self.id_token), params=params)
+        return response
 
     @staticmethod
     def _auth_headers(id_token: str) -> dict:
@@ -182,24 +215,3 @@ class CarrefourClient:
             "content-type": "application/json",
             "requestorigin": "MYA",
         }
-
-    @staticmethod
-    async def save_last_ticket():
-        from database import SessionLocal
-        try:
-            client = CarrefourClient()
-            purchase = client.find_last_purchase()
-            if not purchase:
-                return None
-            db = SessionLocal()
-            try:
-                db.add(purchase)
-                db.commit()
-                logger.info(f"Saved Carrefour ticket {purchase.ticket_id} with {len(purchase.products)} products")
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
-        except Exception as e:
-            logger.error(f"Carrefour background fetch failed: {e}")
\ No newline at end of file
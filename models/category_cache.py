@@ -0,0 +1,101 @@
+import logging
+import re
+import unicodedata
+from typing import Hashable, Iterable, Optional
+
+from sqlalchemy import Column, DateTime, String, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from database import Base, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class ProductCategory(Base):
+    """Category already assigned to a product identity (see CategoryCache.keys)."""
+    __tablename__ = "product_categories"
+
+    key = Column(String, primary_key=True)
+    category = Column(String(50), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+def normalize_description(description: Optional[str]) -> str:
+    """Case, accent, punctuation and spacing insensitive form of a ticket description."""
+    text = unicodedata.normalize("NFKD", description or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+class CategoryCache:
+    """
+    Persistent product -> category memo.
+
+    The same item shows up on many tickets as separate carrefour_item rows;
+    once one of them is categorized, the others are answered from here
+    without asking the model again. The barcode is the primary key, and the
+    normalized description plus sub-family is the fallback for items
+    without one (or whose code changed).
+    """
+
+    @staticmethod
+    def keys(code: Optional[str], description: Optional[str], sub_family: Optional[str]) -> list[str]:
+        keys = []
+        if code:
+            keys.append(f"code:{code}")
+        normalized = normalize_description(description)
+        if normalized:
+            keys.append(f"desc:{normalized}|{sub_family or ''}")
+        return keys
+
+    def lookup(self, items: dict[Hashable, list[str]]) -> dict[Hashable, str]:
+        """item -> category for every item with a known key (first key wins), in one query."""
+        wanted = {key for keys in items.values() for key in keys}
+        if not wanted:
+            return {}
+        db = SessionLocal()
+        try:
+            stmt = select(ProductCategory.key, ProductCategory.category).where(ProductCategory.key.in_(wanted))
+            known = dict(db.execute(stmt).all())
+        except Exception as e:
+            logger.error(f"Failed to look up cached categories for {len(items)} products. Error: {e}")
+            return {}
+        finally:
+            db.close()
+        result = {}
+        for item, keys in items.items():
+            category = next((known[k] for k in keys if k in known), None)
+            if category:
+                result[item] = category
+        return result
+
+    def remember(self, entries: Iterable[tuple[list[str], str]]):
+        """Store (keys, category) pairs, overwriting older categories."""
+        rows = {key: category for keys, category in entries if category for key in keys}
+        if not rows:
+            return
+        db = SessionLocal()
+        try:
+            stmt = insert(ProductCategory).values([{"key": k, "category": c} for k, c in rows.items()])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[ProductCategory.key],
+                set_={"category": stmt.excluded.category, "updated_at": func.now()},
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to cache {len(rows)} product categories. Error: {e}")
+        finally:
+            db.close()
+
+    def apply(self, products) -> int:
+        """Set the category of uncategorized Product objects from the cache. Returns how many were set."""
+        pending = {p: self.keys(p.code, p.description, p.sub_family) for p in products if not p.category}
+        found = self.lookup(pending)
+        for product, category in found.items():
+            product.category, product.category_source = category, "cache"
+        return len(found)
+
+
+category_cache = CategoryCache()
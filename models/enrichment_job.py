@@ -0,0 +1,25 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class EnrichmentJob(Base):
+    """One enrichment stage of a saved Carrefour ticket, queued for the workers of enrichment.py."""
+    __tablename__ = "enrichment_jobs"
+    __table_args__ = (
+        UniqueConstraint("ticketId", "stage", name="uq_enrichment_jobs_ticket_stage"),
+        Index("ix_enrichment_jobs_claim", "stage", "status", "run_after"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ticket_id = Column("ticketId", String(50), ForeignKey("carrefour_purchase.ticketId", ondelete="CASCADE"), nullable=False)
+    stage = Column(String(20), nullable=False)
+    # pending -> running -> done, or back to pending with a later run_after, or failed after the last attempt
+    status = Column(String(10), nullable=False, default="pending", server_default="pending")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    run_after = Column(DateTime, nullable=False, server_default=func.now())
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric
+from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -15,4 +15,33 @@ class Expense(Base):
     amount = Column(Numeric(10, 2))
     currency = Column(String)
     shop_name = Column(String)
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    # Idempotency key of the notification (routes/expenses.py), unique among new rows
+    dedup_key = Column(String(255))
+    # Idempotency-Key header of the POST that stored it, if any
+    idempotency_key = Column(String(255))
+    created_at = Column(DateTime, server_default=func.now())
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "text": self.text,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "postTime": self.post_time.isoformat() if self.post_time else None,
+            "category": self.category,
+            "amount": float(self.amount) if self.amount is not None else None,
+            "currency": self.currency,
+            "shopName": self.shop_name,
+            "createdAt": self.created_at.isoformat() if self.created_at else None,
+        }
+
+    __table_args__ = (
+        # Keyset pagination on (post_time, id) for GET /expenses
+        Index("ix_expenses_post_time_id", "post_time", "id"),
+        # ON CONFLICT target of POST /expenses and /expenses/batch
+        Index("ux_expenses_dedup_key", "dedup_key", unique=True),
+        # Retries of POST /expenses carrying the same Idempotency-Key
+        Index("ux_expenses_idempotency_key", "idempotency_key", unique=True),
+        # Bounding-box queries for GET /expenses/geo
+        Index("ix_expenses_location", func.point(longitude, latitude), postgresql_using="gist"),
+    )
@@ -2,9 +2,22 @@ import dataclasses
 from dataclasses import dataclass
 from typing import Optional
 from sqlalchemy import Boolean, Column, Float, Integer, JSON, String, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB
 from database import Base
 
 
+# Bump whenever the scoring model changes (tables, thresholds or weights below):
+# rows stamped with an older version are rescored in the background by rescore.py
+SCORING_VERSION = 1
+
+# Product fields score_product reads; stored with each score so it can be recomputed
+SCORING_FIELDS = (
+    "_id", "product_name", "brands", "nova_group", "nutriscore_grade", "nutrition_grade_fr",
+    "additives_tags", "categories_tags", "_keywords", "labels_tags",
+    "nutrition_data_per", "image_front_url",
+)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Additive risk database  (EFSA · ANSES · IARC · independent studies)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -165,6 +178,8 @@ class HealthScore(Base):
     total_score       = Column(Float, default=0.0)
     rating            = Column(String, default="")
     image_url         = Column(String, default="")
+    scoring_version   = Column(Integer, nullable=False, default=SCORING_VERSION, server_default="0", index=True)
+    source            = Column(JSONB, nullable=True)  # scoring_inputs() of the scored product
 
     def to_dict(self) -> dict:
         return {
@@ -451,8 +466,17 @@ def _rating(score: float) -> str:
 # Public API
 # ─────────────────────────────────────────────────────────────────────────────
 
+def scoring_inputs(product: dict) -> dict:
+    """The part of an Open Food Facts product dict that score_product depends on."""
+    inputs = {k: list(v) if isinstance(v, list) else v for k, v in product.items() if k in SCORING_FIELDS}
+    nutriments = product.get("nutriments") or {}
+    inputs["nutriments"] = {k: v for k, v in nutriments.items() if k.endswith("_100g")}
+    return inputs
+
+
 def score_product(product: dict) -> HealthScore:
     """Score a product dict (from Open Food Facts) and return a HealthScore ORM instance."""
+    source = scoring_inputs(product)
     is_dry_infusion = _detect_dry_infusion(product)
     is_beverage     = _detect_beverage(product)
     nova_group      = product.get("nova_group")
@@ -520,4 +544,6 @@ def score_product(product: dict) -> HealthScore:
         total_score       = total,
         rating            = _rating(total),
         image_url         = product.get("image_front_url", ""),
+        scoring_version   = SCORING_VERSION,
+        source            = source,
     )
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Vectorized health scoring for bulk jobs (dump imports, full rescoring)
+
+``score_products_batch`` returns, for every product, the same HealthScore as
+``score_product``. The nutrient threshold ladders and the weighted sums are
+evaluated for the whole batch at once with NumPy; the text-based parts
+(category detection, additives, labels) stay per product but skip the
+intermediate dataclasses.
+"""
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+from models.health_score import (
+    ADDITIVE_RISK,
+    NOVA_ADD_CAP,
+    RISK_PENALTY,
+    SCORING_VERSION,
+    _BEVERAGE_KEYWORDS,
+    _BREW_DILUTION,
+    _DRY_INFUSION_KEYWORDS,
+    HealthScore,
+    _fruits_pct,
+    _get_float,
+    _is_organic,
+    _nutrient_label,
+    _rating,
+    scoring_inputs,
+)
+
+# Lower is better: (upper bounds, points for each bound, points above the last bound).
+# Mirrors _score_energy, _score_sugar, _score_satfat and _score_salt.
+ENERGY_BEVERAGE = ([20, 35, 50, 70], [100, 65, 35, 15, 0])
+ENERGY_FOOD = ([80, 160, 270, 400], [100, 75, 50, 25, 0])
+SUGAR_BEVERAGE = ([1, 3, 5, 8], [100, 70, 45, 20, 0])
+SUGAR_FOOD = ([5, 12, 22.5, 30, 45], [100, 70, 35, 15, 5, 0])
+SATFAT = ([1, 2.5, 5, 10], [100, 75, 50, 20, 0])
+SALT = ([0.3, 0.75, 1.5, 2.3], [100, 75, 50, 20, 0])
+
+# Higher is better: (lower bounds, points below the first bound, points for each bound).
+# Mirrors _score_fibre, _score_protein and _score_fruits (80 cap for beverages).
+FIBRE = ([0.5, 1.5, 3, 5], [0, 25, 50, 75, 100])
+PROTEIN = ([1, 2.5, 5, 8], [0, 25, 50, 75, 100])
+FRUITS_BEVERAGE = ([20, 40, 60, 80], [0, int(80 * 0.25), int(80 * 0.50), int(80 * 0.75), 80])
+FRUITS_FOOD = ([20, 40, 60, 80], [0, int(100 * 0.25), int(100 * 0.50), int(100 * 0.75), 100])
+
+_ADDITIVE_ORDER = {"high": 0, "moderate": 1, "limited": 2, "risk-free": 3}
+
+# (name, unit) of the nutrient_details entries, in score_product order
+_DETAILS = [
+    ("Energy", "kcal"),
+    ("Sugar", "g"),
+    ("Saturated fat", "g"),
+    ("Salt", "g"),
+    ("Protein", "g"),
+    ("Fibre", "g"),
+]
+
+
+def _at_most(x: np.ndarray, ladder) -> np.ndarray:
+    """Points of the first upper bound ``x`` does not exceed (NaN gets the last points, as in the ifs)."""
+    bounds, points = ladder
+    return np.asarray(points)[np.digitize(x, bounds, right=True)]
+
+
+def _at_least(x: np.ndarray, ladder) -> np.ndarray:
+    """Points of the highest lower bound ``x`` reaches (NaN reaches none)."""
+    bounds, points = ladder
+    points = np.asarray(points)
+    return np.where(np.isnan(x), points[0], points[np.digitize(x, bounds)])
+
+
+def _categories(product: dict) -> str:
+    tags = list(product.get("categories_tags", []))
+    tags.extend(f"es:{k}" for k in product.get("_keywords", []))
+    return " ".join(tags).lower()
+
+
+def _additives(product: dict) -> tuple[list[dict], float]:
+    """Additive dicts sorted by risk, and the raw additives score."""
+    results, seen = [], set()
+    for tag in product.get("additives_tags", []):
+        tag = tag.lower()
+        if tag in seen:
+            continue
+        seen.add(tag)
+        results.append({"code": tag, "name": tag.replace("en:", "").upper(), "risk": ADDITIVE_RISK.get(tag, "risk-free")})
+    results.sort(key=lambda a: _ADDITIVE_ORDER.get(a["risk"], 4))
+    penalty = sum(RISK_PENALTY.get(a["risk"], 0) for a in results)
+    return results, max(0.0, 100.0 - penalty)
+
+
+def _nova_group(product: dict) -> Optional[int]:
+    nova_group = product.get("nova_group")
+    try:
+        return int(nova_group) if nova_group is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _inputs(product: dict) -> dict:
+    """Per-product values score_product derives before scoring nutrients."""
+    categories = _categories(product)
+    is_dry_infusion = any(k in categories for k in _DRY_INFUSION_KEYWORDS)
+    is_beverage = not is_dry_infusion and (
+        any(k in categories for k in _BEVERAGE_KEYWORDS)
+        or product.get("nutrition_data_per", "100g") == "100ml"
+    )
+
+    energy = _get_float(product, "energy-kcal_100g")
+    if energy is None:
+        kj = _get_float(product, "energy_100g")
+        energy = round(kj / 4.184, 1) if kj else None
+    sugar = _get_float(product, "sugars_100g")
+    sat_fat = _get_float(product, "saturated-fat_100g")
+    salt = _get_float(product, "salt_100g")
+    if salt is None:
+        sodium = _get_float(product, "sodium_100g")
+        salt = round(sodium * 2.5, 3) if sodium is not None else None
+    fibre = _get_float(product, "fiber_100g", "fibers_100g")
+    protein = _get_float(product, "proteins_100g", "protein_100g")
+    fruits = _fruits_pct(product)
+    nutriscore_grade = product.get("nutriscore_grade") or product.get("nutrition_grade_fr")
+
+    if is_dry_infusion:
+        d = _BREW_DILUTION
+        energy = round((energy or 0) * d, 2)
+        sugar = round((sugar or 0) * d, 4)
+        sat_fat = round((sat_fat or 0) * d, 4)
+        salt = round((salt or 0) * d, 4)
+        fibre = protein = fruits = None
+        nutriscore_grade = "a" if nutriscore_grade == "unknown" else nutriscore_grade
+
+    return {
+        "is_dry_infusion": is_dry_infusion,
+        "is_beverage": is_beverage,
+        "values": (energy, sugar, sat_fat, salt, protein, fibre),
+        "fruits": fruits or 0.0,
+        "nutriscore_grade": nutriscore_grade,
+    }
+
+
+def _column(values: Iterable[Optional[float]]) -> np.ndarray:
+    # Same as the `value or 0` of _nutrition_score (NaN stays NaN)
+    return np.array([0.0 if v is None else v for v in values], dtype=float)
+
+
+def score_rows_batch(products: list[dict]) -> list[dict]:
+    """Score many OFF product dicts at once; returns HealthScore column dicts."""
+    if not products:
+        return []
+    inputs = [_inputs(p) for p in products]
+    additives = [_additives(p) for p in products]
+    nova_groups = [_nova_group(p) for p in products]
+    organic = [_is_organic(p) for p in products]
+
+    dry = np.array([i["is_dry_infusion"] for i in inputs])
+    # Dry infusions are scored as the brewed beverage
+    bev = np.array([i["is_beverage"] for i in inputs]) | dry
+    energy, sugar, sat_fat, salt, protein, fibre = (
+        _column(i["values"][k] for i in inputs) for k in range(6)
+    )
+    fruits = np.array([i["fruits"] for i in inputs], dtype=float)
+
+    e_s = np.where(bev, _at_most(energy, ENERGY_BEVERAGE), _at_most(energy, ENERGY_FOOD))
+    effective_sugar = sugar * (1.0 - np.minimum(fruits / 100.0, 1.0) * 0.50)
+    su_s = np.where(bev, _at_most(effective_sugar, SUGAR_BEVERAGE), _at_most(sugar, SUGAR_FOOD))
+    sf_s = _at_most(sat_fat, SATFAT)
+    sa_s = _at_most(salt, SALT)
+    fi_s = _at_least(fibre, FIBRE)
+    pr_s = _at_least(protein, PROTEIN)
+    fr_s = np.where(bev, _at_least(fruits, FRUITS_BEVERAGE), _at_least(fruits, FRUITS_FOOD))
+
+    neg = np.where(
+        bev,
+        su_s * 0.50 + e_s * 0.30 + sf_s * 0.12 + sa_s * 0.08,
+        su_s * 0.30 + e_s * 0.25 + sf_s * 0.25 + sa_s * 0.20,
+    )
+    pos = pr_s * 0.50 + fr_s * 0.35 + fi_s * 0.15
+    # Python's round (correctly rounded) rather than np.round, to match score_product
+    nutrition = [100.0 if d else round(v, 1) for d, v in zip(dry.tolist(), (neg * 0.60 + pos * 0.40).tolist())]
+
+    raw_add = np.array([raw for _, raw in additives], dtype=float)
+    nova_cap = np.array([NOVA_ADD_CAP.get(n, 100) if n else 100 for n in nova_groups], dtype=float)
+    add_pts = np.where(dry, raw_add, np.minimum(raw_add, nova_cap))
+    org_pts = np.where(organic, 100.0, 0.0)
+    totals = (np.array(nutrition) * 0.60 + add_pts * 0.30 + org_pts * 0.10).tolist()
+
+    scores = np.stack([e_s, su_s, sf_s, sa_s, pr_s, fi_s], axis=1).tolist()
+    positive = np.stack([e_s >= 50, su_s >= 50, sf_s >= 80, sa_s >= 80, np.ones_like(dry), np.ones_like(dry)], axis=1).tolist()
+    fruit_scores = fr_s.tolist()
+
+    rows = []
+    for n, product in enumerate(products):
+        i = inputs[n]
+        details = [
+            {
+                "name": name,
+                "value": f"{value:.1f}" if value is not None else "?",
+                "unit": unit,
+                "score": score,
+                "label": _nutrient_label(score, is_pos),
+                "is_positive": is_pos,
+            }
+            for (name, unit), value, score, is_pos in zip(_DETAILS, i["values"], scores[n], positive[n])
+        ]
+        if i["fruits"] > 0:
+            details.append({
+                "name": "Fruits / veg / nuts",
+                "value": f"{i['fruits']:.1f}",
+                "unit": "%",
+                "score": fruit_scores[n],
+                "label": _nutrient_label(fruit_scores[n], True),
+                "is_positive": True,
+            })
+        total = round(totals[n], 1)
+        rows.append({
+            "barcode": product.get("_id"),
+            "product_name": product.get("product_name", "Unknown"),
+            "brand": product.get("brands", "Unknown"),
+            "is_beverage": i["is_beverage"] or i["is_dry_infusion"],
+            "nova_group": nova_groups[n],
+            "nutriscore_grade": i["nutriscore_grade"],
+            "nutriscore_points": nutrition[n],
+            "nutrient_details": details,
+            "additives": additives[n][0],
+            "additives_points": float(add_pts[n]),
+            "is_organic": organic[n],
+            "organic_points": float(org_pts[n]),
+            "total_score": total,
+            "rating": _rating(total),
+            "image_url": product.get("image_front_url", ""),
+            "scoring_version": SCORING_VERSION,
+            "source": scoring_inputs(product),
+        })
+    return rows
+
+
+def score_products_batch(products: list[dict]) -> list[HealthScore]:
+    """Vectorized ``score_product`` over many OFF product dicts."""
+    return [HealthScore(**row) for row in score_rows_batch(products)]
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, String
+from sqlalchemy.sql import func
+from database import Base
+
+
+class OffMiss(Base):
+    """Barcode unknown to Open Food Facts, and when it may be looked up again."""
+    __tablename__ = "off_misses"
+
+    barcode = Column(String, primary_key=True)
+    checked_at = Column(DateTime, server_default=func.now(), nullable=False)
+    retry_after = Column(DateTime, nullable=False)
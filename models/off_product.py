@@ -0,0 +1,13 @@
+from sqlalchemy import Column, DateTime, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from database import Base
+
+
+class OffProduct(Base):
+    """Open Food Facts product imported from an offline dump (see off_import.py)."""
+    __tablename__ = "off_products"
+
+    barcode = Column(String, primary_key=True)
+    product = Column(JSONB, nullable=False)   # only the fields score_product reads
+    imported_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -1,15 +1,38 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
 import requests
 import logging
+import http_client
+import rollups
 
 from sqlalchemy import select, and_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
+from cache import MISSING, SingleFlight, TTLCache
 from database import SessionLocal
 from models.health_score import HealthScore, score_product
+from models.off_miss import OffMiss
+from models.off_product import OffProduct
 
 logger = logging.getLogger(__name__)
 
 class OpenFoodFacts:
     URL = "https://world.openfoodfacts.net/api/v2/product"
+    # Maximum concurrent upstream fetches in get_products
+    CONCURRENCY = int(os.getenv("OFF_CONCURRENCY", "8"))
+    # Barcodes unknown to OFF are not asked again before this delay
+    MISS_RETRY = timedelta(hours=float(os.getenv("OFF_MISS_RETRY_HOURS", "168")))
+
+    # Process-wide cache: barcode -> HealthScore, or None for a known miss
+    cache = TTLCache(
+        maxsize=int(os.getenv("OFF_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("OFF_CACHE_TTL", "3600")),
+    )
+    # Barcodes being resolved right now: concurrent callers share one fetch and insert
+    in_flight = SingleFlight()
+    # Seconds a caller waits for another caller's lookup of the same barcode
+    FLIGHT_TIMEOUT = float(os.getenv("OFF_FLIGHT_TIMEOUT", "60"))
     NUTRISCORE_POINTS = {"a": 25, "b": 20, "c": 12, "d": 5, "e": 0}
     NOVA_POINTS = {1: 20, 2: 14, 3: 7, 4: 0}
 
@@ -32,24 +55,163 @@ class OpenFoodFacts:
         self,
         product_code
     ) -> dict:
-        response = requests.get(
+        response = http_client.get(
             f"{self.URL}/{product_code}"
         )
         response.raise_for_status()
         return response.json()
 
     def get_product(self, code) -> HealthScore | None:
+        cached = self.cache.get(code)
+        if cached is not MISSING:
+            return cached
         try:
-            health_score = self.get(code)
-            if health_score:
-                return health_score
-            data = self.fetch_product(code)
-            hs = self.get_product_health_score(data, code)
-            if hs:
-                self.save(hs)
+            return self.in_flight.do(code, lambda: self._load_product(code), self.FLIGHT_TIMEOUT)
+        except (requests.RequestException, TimeoutError) as e:
+            logger.warning(f"Failed to fetch product {code} from Open Food Facts. Error: {e}")
+            return None
+
+    def _load_product(self, code) -> HealthScore | None:
+        health_score = self.get(code)
+        if health_score:
+            self.cache.set(code, health_score)
+            return health_score
+        local = self.get_local([code])
+        if code in local:
+            hs = self.save(score_product(local[code]))
+            self.cache.set(code, hs)
             return hs
-        except requests.RequestException as e:
+        misses = self.get_misses([code])
+        if code in misses:
+            self._cache_miss(code, misses[code])
             return None
+        data = self.fetch_product(code)
+        hs = self.get_product_health_score(data, code)
+        if hs:
+            self.save(hs)
+            self.cache.set(code, hs)
+        else:
+            self._cache_miss(code, self.save_misses([code]))
+        return hs
+
+    async def get_products(self, codes, concurrency: int | None = None) -> dict[str, HealthScore | None]:
+        """
+        Resolve many barcodes at once.
+
+        Codes are deduplicated and served from the in-process cache when
+        possible. The rest are loaded with one ``IN`` query each for scores,
+        the offline dump index and known misses, the remaining codes are
+        fetched concurrently (at most ``concurrency`` at a time) and the new
+        scores and misses are stored with one bulk insert each. Codes another
+        caller is already resolving are not fetched again; their result is
+        awaited instead.
+
+        Codes that could not be fetched map to None like unknown ones; use
+        ``resolve_products`` to tell them apart.
+        """
+        scores, _ = await self.resolve_products(codes, concurrency)
+        return scores
+
+    async def resolve_products(
+        self, codes, concurrency: int | None = None
+    ) -> tuple[dict[str, HealthScore | None], set[str]]:
+        """``get_products``, plus the codes Open Food Facts could not be reached for."""
+        unique = list(dict.fromkeys(c for c in codes if c))
+        result = {}
+        for code in unique:
+            cached = self.cache.get(code)
+            if cached is not MISSING:
+                result[code] = cached
+
+        leading, following = [], {}
+        for code in unique:
+            if code not in result:
+                flight, leader = self.in_flight.acquire(code)
+                if leader:
+                    leading.append(code)
+                else:
+                    following[code] = flight
+        errors = {}
+        try:
+            if leading:
+                loaded, errors = await self._load_products(leading, concurrency)
+                result.update(loaded)
+        finally:
+            for code in leading:
+                self.in_flight.resolve(code, result.get(code), errors.get(code))
+
+        async def wait(code, flight):
+            try:
+                return code, await flight.wait_async(self.FLIGHT_TIMEOUT), True
+            except (requests.RequestException, asyncio.TimeoutError):
+                return code, None, False
+
+        waited = await asyncio.gather(*(wait(c, f) for c, f in following.items()))
+        result.update((code, hs) for code, hs, _ in waited)
+        failed = set(errors) | {code for code, _, answered in waited if not answered}
+        return {c: result.get(c) for c in unique}, failed
+
+    async def _load_products(self, pending, concurrency: int | None) -> tuple[dict[str, HealthScore | None], dict]:
+        """Scores of codes nobody else is resolving, and the fetch error of each code that failed."""
+        result = {}
+        found = await asyncio.to_thread(self.get_many, pending)
+        for code, hs in found.items():
+            self.cache.set(code, hs)
+        result.update(found)
+        pending = [c for c in pending if c not in found]
+
+        local = await asyncio.to_thread(self.get_local, pending) if pending else {}
+        local_scores = [score_product(product) for product in local.values()]
+        if local_scores:
+            await asyncio.to_thread(self.save_many, local_scores)
+        for hs in local_scores:
+            self.cache.set(hs.barcode, hs)
+            result[hs.barcode] = hs
+        pending = [c for c in pending if c not in local]
+
+        misses = await asyncio.to_thread(self.get_misses, pending) if pending else {}
+        for code, retry_after in misses.items():
+            self._cache_miss(code, retry_after)
+            result[code] = None
+        pending = [c for c in pending if c not in misses]
+
+        semaphore = asyncio.Semaphore(concurrency or self.CONCURRENCY)
+
+        async def fetch(code):
+            async with semaphore:
+                try:
+                    data = await asyncio.to_thread(self.fetch_product, code)
+                except requests.RequestException as e:
+                    logger.warning(f"Failed to fetch product {code} from Open Food Facts. Error: {e}")
+                    return code, None, e
+            return code, self.get_product_health_score(data, code), None
+
+        fetched = await asyncio.gather(*(fetch(c) for c in pending))
+        new_scores = [hs for _, hs, _ in fetched if hs]
+        not_found = [code for code, hs, error in fetched if not error and not hs]
+        if new_scores:
+            await asyncio.to_thread(self.save_many, new_scores)
+        if not_found:
+            retry_after = await asyncio.to_thread(self.save_misses, not_found)
+            for code in not_found:
+                self._cache_miss(code, retry_after)
+        for code, hs, _ in fetched:
+            if hs:
+                self.cache.set(code, hs)
+            result[code] = hs
+        return result, {code: error for code, _, error in fetched if error}
+
+    @classmethod
+    def forget(cls, codes):
+        """Drop cached entries of barcodes whose stored score or product was just rewritten."""
+        for code in codes:
+            cls.cache.delete(code)
+
+    def _cache_miss(self, code, retry_after: datetime):
+        """Cache a negative entry, never beyond the persisted retry time."""
+        remaining = (retry_after - datetime.now()).total_seconds()
+        if remaining > 0:
+            self.cache.set(code, None, min(self.cache.ttl, remaining))
 
     def _get_best_product_name(self, p: dict) -> str:
         """Return the most complete product name available."""
@@ -235,12 +397,91 @@ class OpenFoodFacts:
         finally:
             db.close()
 
+    def get_many(self, codes) -> dict[str, HealthScore]:
+        db = SessionLocal()
+        try:
+            stmt = select(HealthScore).where(HealthScore.barcode.in_(list(codes)))
+            return {hs.barcode: hs for hs in db.execute(stmt).scalars()}
+        except Exception as e:
+            logger.error(f"Failed to get health scores for {len(codes)} barcodes. Error: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def get_local(self, codes) -> dict[str, dict]:
+        """Products from the offline dump index (off_import.py): barcode -> product dict."""
+        db = SessionLocal()
+        try:
+            stmt = select(OffProduct.barcode, OffProduct.product).where(OffProduct.barcode.in_(list(codes)))
+            return {barcode: product for barcode, product in db.execute(stmt)}
+        except Exception as e:
+            logger.error(f"Failed to get local Open Food Facts products for {len(codes)} barcodes. Error: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def get_misses(self, codes) -> dict[str, datetime]:
+        """Known misses whose retry time has not passed yet: barcode -> retry_after."""
+        db = SessionLocal()
+        try:
+            stmt = select(OffMiss).where(OffMiss.barcode.in_(list(codes)), OffMiss.retry_after > datetime.now())
+            return {m.barcode: m.retry_after for m in db.execute(stmt).scalars()}
+        except Exception as e:
+            logger.error(f"Failed to get Open Food Facts misses for {len(codes)} barcodes. Error: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def save_misses(self, codes) -> datetime:
+        """Record barcodes unknown to OFF. Returns the time they may be fetched again."""
+        now = datetime.now()
+        retry_after = now + self.MISS_RETRY
+        db = SessionLocal()
+        try:
+            stmt = insert(OffMiss).values([
+                {"barcode": code, "checked_at": now, "retry_after": retry_after} for code in dict.fromkeys(codes)
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[OffMiss.barcode],
+                set_={"checked_at": stmt.excluded.checked_at, "retry_after": stmt.excluded.retry_after},
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to save Open Food Facts misses for {len(codes)} barcodes. Error: {e}")
+        finally:
+            db.close()
+        return retry_after
+
+    def save_many(self, scores):
+        """Bulk insert health scores, skipping barcodes that already exist."""
+        columns = [c.key for c in HealthScore.__table__.columns]
+        rows = {hs.barcode: {c: getattr(hs, c) for c in columns} for hs in scores if hs.barcode}
+        if not rows:
+            return scores
+        db = SessionLocal()
+        try:
+            db.execute(
+                insert(HealthScore).on_conflict_do_nothing(index_elements=[HealthScore.barcode]),
+                list(rows.values()),
+            )
+            db.commit()
+            logger.info(f"Saved {len(rows)} health scores")
+            rollups.refresh(barcodes=rows)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to save {len(rows)} health scores. Error: {e}")
+        finally:
+            db.close()
+        return scores
+
     def save(self, hs):
         db = SessionLocal()
         try:
             db.add(hs)
             db.commit()
             logger.info(f"Saved health score of {hs.total_score} for product {hs.product_name}")
+            rollups.refresh(barcodes=[hs.barcode])
         except IntegrityError as e:
             db.rollback()
             if "duplicate key" in str(e.orig):
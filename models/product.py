@@ -1,12 +1,11 @@
 import json
-import os
 from google.genai import types
 from google.genai.errors import ClientError
 from sqlalchemy import Column, Integer, String, Numeric, Text, ForeignKey
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
-from google import genai
+import gemini
 from prompts import product_categories
 import logging
 
@@ -26,6 +25,8 @@ class Product(Base):
     description = Column(Text)
     auxiliary_data = Column("auxiliaryData", JSONB)
     category = Column(String(50))
+    # Who set the category: "llm", "user", "cache" (an earlier answer for the same item) or "rules"
+    category_source = Column("categorySource", String(10))
     health_score = relationship("HealthScore", lazy="joined", uselist=False)
 
     purchase = relationship("Purchase", back_populates="products")
@@ -48,10 +49,22 @@ class Product(Base):
     def get_category(self):
         if self.category:
             return True
+        from models.category_cache import category_cache
+        keys = category_cache.keys(self.code, self.description, self.sub_family)
+        cached = category_cache.lookup({self: keys}).get(self)
+        if cached:
+            self.category, self.category_source = cached, "cache"
+            self.update()
+            return True
+        from product_classifier import classify_product
+        guess = classify_product(self.description, self.sub_family)
+        if guess.confident:
+            self.category, self.category_source = guess.category, "rules"
+            self.update()
+            return True
         try:
-            client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-            response = client.models.generate_content(
-                model="gemini-3.1-flash-lite-preview",
+            response = gemini.get_client().models.generate_content(
+                model=gemini.MODEL,
                 config=types.GenerateContentConfig(
                     system_instruction=product_categories.SYSTEM_PROMPT,
                     response_mime_type="application/json"  # forces JSON output
@@ -59,8 +72,9 @@ class Product(Base):
                 contents=product_categories.USER_PROMPT.format(PRODUCT_JSON=self.to_dict())
             )
             result = json.loads(response.text)
-            self.category = result["category"]
+            self.category, self.category_source = result["category"], "llm"
             self.update()
+            category_cache.remember([(keys, self.category)])
             return True
         except ClientError as cex:
             logger.error(f"Client error when fetching gemini API: {cex}")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Numeric
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -17,7 +17,13 @@ class Purchase(Base):
 
     products = relationship("Product", back_populates="purchase", cascade="all, delete-orphan")
 
-    def to_dict(self) -> dict:
+    __table_args__ = (
+        # Keyset pagination on (date, id) for GET /carrefour/purchases
+        Index("ix_carrefour_purchase_date_id", "date", "id"),
+    )
+
+    def to_header_dict(self) -> dict:
+        """Ticket fields without the products (no relationship load)."""
         return {
             "id": self.id,
             "ticketId": self.ticket_id,
@@ -26,6 +32,11 @@ class Purchase(Base):
             "netAmount": float(str(self.net_amount)) if self.net_amount is not None else None,
             "numberItems": self.number_items,
             "healthScore": float(str(self.health_score)) if self.health_score is not None else None,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.to_header_dict(),
             "products": [p.to_dict() for p in self.products],
         }
 
@@ -0,0 +1,63 @@
+from sqlalchemy import Column, Date, DateTime, Float, ForeignKey, Integer, Numeric, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+def _money(value) -> float:
+    return float(str(value)) if value is not None else 0.0
+
+
+class PurchaseRollup(Base):
+    """Spend-weighted health score and spend splits of one ticket (see rollups.py)."""
+    __tablename__ = "purchase_rollups"
+
+    ticket_id = Column("ticketId", String(50), ForeignKey("carrefour_purchase.ticketId", ondelete="CASCADE"), primary_key=True)
+    month = Column(Date, nullable=False, index=True)
+    spend = Column(Numeric(10, 2), nullable=False, default=0)
+    scored_spend = Column(Numeric(10, 2), nullable=False, default=0)
+    health_score = Column(Float)
+    category_spend = Column(JSONB, nullable=False, default=dict)
+    nova_spend = Column(JSONB, nullable=False, default=dict)
+    nutriscore_spend = Column(JSONB, nullable=False, default=dict)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "ticketId": self.ticket_id,
+            "month": self.month.isoformat() if self.month else None,
+            "spend": _money(self.spend),
+            "scoredSpend": _money(self.scored_spend),
+            "healthScore": self.health_score,
+            "categorySpend": self.category_spend,
+            "novaSpend": self.nova_spend,
+            "nutriscoreSpend": self.nutriscore_spend,
+        }
+
+
+class MonthlyRollup(Base):
+    """Sum of the purchase rollups of one calendar month."""
+    __tablename__ = "monthly_rollups"
+
+    month = Column(Date, primary_key=True)
+    purchases = Column(Integer, nullable=False, default=0)
+    spend = Column(Numeric(12, 2), nullable=False, default=0)
+    scored_spend = Column(Numeric(12, 2), nullable=False, default=0)
+    health_score = Column(Float)
+    category_spend = Column(JSONB, nullable=False, default=dict)
+    nova_spend = Column(JSONB, nullable=False, default=dict)
+    nutriscore_spend = Column(JSONB, nullable=False, default=dict)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "month": self.month.isoformat() if self.month else None,
+            "purchases": self.purchases,
+            "spend": _money(self.spend),
+            "scoredSpend": _money(self.scored_spend),
+            "healthScore": self.health_score,
+            "categorySpend": self.category_spend,
+            "novaSpend": self.nova_spend,
+            "nutriscoreSpend": self.nutriscore_spend,
+        }
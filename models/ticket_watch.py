@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class TicketWatch(Base):
+    """Pending wait for a new Carrefour ticket of one account (see ticket_watcher.py)."""
+    __tablename__ = "carrefour_ticket_watches"
+
+    account = Column(String(255), primary_key=True)
+    since = Column(DateTime, nullable=False)
+    deadline = Column(DateTime, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
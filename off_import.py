@@ -0,0 +1,219 @@
+"""
+Offline Open Food Facts dump importer
+
+Streams an OFF JSONL dump (optionally gzipped) line by line, so memory stays
+constant whatever the dump size, and keeps only the products we care about:
+the barcodes bought at Carrefour (or listed in ``--barcodes``), plus every
+Spanish product with ``--spain``.
+
+Kept products are bulk loaded with ``COPY`` into ``off_products``, the local
+index ``OpenFoodFacts.get_product`` checks before the network. Products whose
+barcode was bought are also scored (``score_rows_batch``) and copied into
+``health_scores``, so scoring a ticket needs no network at all.
+
+Usage::
+
+    python off_import.py openfoodfacts-products.jsonl.gz [--spain] [--barcodes FILE] [--rescore]
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+from typing import IO, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+
+import rollups
+from database import SessionLocal, engine
+from models.health_score import HealthScore, scoring_inputs
+from models.health_score_batch import score_rows_batch
+from models.open_food_facts import OpenFoodFacts
+from models.product import Product
+
+logger = logging.getLogger(__name__)
+
+SPAIN_TAG = "en:spain"
+CHUNK_SIZE = 5000
+PROGRESS_EVERY = 100_000
+
+# COPY ... (FORMAT csv, NULL '\N') so that empty strings and NULLs stay distinct
+COPY_NULL = "\\N"
+
+
+def open_dump(path: str) -> IO[str]:
+    """Open a JSONL dump, transparently decompressing gzip."""
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_products(lines: Iterable[str]) -> Iterator[dict]:
+    """Parse JSONL lines one at a time, skipping blank and malformed lines."""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            product = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed line {number}")
+            continue
+        if number % PROGRESS_EVERY == 0:
+            logger.info(f"Read {number} lines")
+        if isinstance(product, dict):
+            yield product
+
+
+def barcode_of(product: dict) -> Optional[str]:
+    code = product.get("code") or product.get("_id")
+    return str(code) if code else None
+
+
+def is_spanish(product: dict) -> bool:
+    return SPAIN_TAG in (product.get("countries_tags") or [])
+
+
+def slim(product: dict) -> dict:
+    """Keep only what score_product needs (the full dump entries are huge)."""
+    return {**scoring_inputs(product), "_id": barcode_of(product)}
+
+
+def select_products(products: Iterable[dict], wanted: set[str], spain: bool) -> Iterator[dict]:
+    """Slim products whose barcode is wanted, or that are sold in Spain when ``spain`` is set."""
+    for product in products:
+        code = barcode_of(product)
+        if code and (code in wanted or (spain and is_spanish(product))):
+            yield slim(product)
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def to_csv(rows: Iterable[dict], columns: list[str]) -> io.StringIO:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_copy_value(row.get(c)) for c in columns])
+    buf.seek(0)
+    return buf
+
+
+def copy_upsert(conn, table: str, columns: list[str], rows: list[dict], on_conflict: str, where: str = ""):
+    """COPY rows into a temp staging table, then merge them into ``table`` with one INSERT."""
+    cols = ", ".join(f'"{c}"' for c in columns)
+    stage = f"_stage_{table}"
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        cur.copy_expert(
+            f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            to_csv(rows, columns),
+        )
+        cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage} {where} {on_conflict}")
+    conn.commit()
+
+
+def _do_update(columns: list[str], key: str) -> str:
+    updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in columns if c != key)
+    return f'ON CONFLICT ("{key}") DO UPDATE SET {updates}'
+
+
+class Importer:
+    """Load a dump chunk by chunk into off_products and health_scores."""
+
+    def __init__(self, conn, wanted: set[str], rescore: bool = False, chunk_size: int = CHUNK_SIZE):
+        self.conn = conn
+        self.wanted = wanted
+        self.rescore = rescore
+        self.chunk_size = chunk_size
+        self.score_columns = [c.key for c in HealthScore.__table__.columns]
+        self.imported = 0
+        self.scored = 0
+
+    def run(self, products: Iterable[dict]):
+        chunk = []
+        for product in products:
+            chunk.append(product)
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        logger.info(f"Imported {self.imported} products, scored {self.scored}")
+
+    def flush(self, products: list[dict]):
+        # ON CONFLICT DO UPDATE cannot touch a row twice: keep the last copy of a repeated barcode
+        products = list({p["_id"]: p for p in products}.values())
+        copy_upsert(
+            self.conn, "off_products", ["barcode", "product"],
+            [{"barcode": p["_id"], "product": p} for p in products],
+            "ON CONFLICT (barcode) DO UPDATE SET product = EXCLUDED.product, imported_at = now()",
+        )
+        self.imported += len(products)
+
+        scores = score_rows_batch([p for p in products if p["_id"] in self.wanted])
+        if scores:
+            copy_upsert(
+                self.conn, "health_scores", self.score_columns, scores,
+                _do_update(self.score_columns, "barcode") if self.rescore else "ON CONFLICT (barcode) DO NOTHING",
+                # health_scores.barcode references carrefour_item.code
+                where="WHERE barcode IN (SELECT code FROM carrefour_item)",
+            )
+            self.scored += len(scores)
+        # Cached scores and misses of these barcodes are now out of date
+        OpenFoodFacts.forget(p["_id"] for p in products)
+        logger.info(f"Imported {self.imported} products so far")
+
+
+def bought_barcodes() -> set[str]:
+    db = SessionLocal()
+    try:
+        return {code for code in db.execute(select(Product.code).distinct()).scalars() if code}
+    finally:
+        db.close()
+
+
+def read_barcodes(path: str) -> set[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Import an Open Food Facts JSONL dump into the local index")
+    parser.add_argument("dump", help="Path to the OFF JSONL dump (.jsonl or .jsonl.gz)")
+    parser.add_argument("--spain", action="store_true", help="Also keep every product sold in Spain")
+    parser.add_argument("--barcodes", help="File with one barcode per line (default: every barcode bought)")
+    parser.add_argument("--rescore", action="store_true", help="Overwrite existing health scores")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    wanted = read_barcodes(args.barcodes) if args.barcodes else bought_barcodes()
+    logger.info(f"Importing {args.dump} for {len(wanted)} barcodes{' and all Spanish products' if args.spain else ''}")
+
+    conn = engine.raw_connection()
+    try:
+        with open_dump(args.dump) as lines:
+            importer = Importer(conn, wanted, rescore=args.rescore, chunk_size=args.chunk_size)
+            importer.run(select_products(iter_products(lines), wanted, args.spain))
+    finally:
+        conn.close()
+    if importer.scored:
+        rollups.rebuild()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,56 @@
+"""
+Keyset (cursor) pagination helpers
+
+Pages are keyed on a ``(timestamp, id)`` pair ordered descending, so fetching
+page N costs the same index range scan as page 1 instead of scanning and
+discarding ``OFFSET`` rows. Rows without a timestamp come first, as in a
+backward scan of the ``(timestamp, id)`` index. The cursor handed to clients
+is opaque.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, tuple_
+
+
+def encode_cursor(sort_value: Optional[datetime], row_id: int) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    raw = json.dumps([sort_value.isoformat() if sort_value is not None else None, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[Optional[datetime], int]:
+    """Decode a cursor produced by encode_cursor. Raises HTTP 400 if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value) if sort_value is not None else None, int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_order(sort_column, id_column) -> tuple:
+    """ORDER BY clauses of a keyset-paged listing: (sort DESC NULLS FIRST, id DESC)."""
+    return sort_column.desc().nulls_first(), id_column.desc()
+
+
+def after_cursor(sort_column, id_column, cursor: str):
+    """SQL condition selecting the rows that follow the cursor in keyset_order."""
+    sort_value, row_id = decode_cursor(cursor)
+    if sort_value is None:
+        return or_(sort_column.is_not(None), and_(sort_column.is_(None), id_column < row_id))
+    # A NULL sort value compares as unknown, so the rows without one (already paged) drop out
+    return tuple_(sort_column, id_column) < tuple_(sort_value, row_id)
+
+
+def next_cursor(rows: list, limit: int, sort_attr: str) -> Optional[str]:
+    """Cursor for the page after ``rows``, or None when this was the last page."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, sort_attr), last.id)
@@ -0,0 +1,290 @@
+"""
+Product Category Classifier
+Deterministic pre-pass before the LLM: assigns one of the 10 product
+categories from ticket description keywords and the Carrefour sub-family,
+with a confidence score. Only products below MIN_CONFIDENCE go to Gemini.
+
+Sub-family codes are opaque, so their table is learned from products the LLM
+(or a user) already categorized (see ``python product_classifier.py --help``) and loaded
+from SUB_FAMILIES_PATH when present.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from expense_classifier import ExpenseClassifier
+from models.category_cache import normalize_description
+
+logger = logging.getLogger(__name__)
+
+MIN_CONFIDENCE = float(os.getenv("CATEGORY_RULES_MIN_CONFIDENCE", "0.7"))
+SUB_FAMILIES_PATH = os.getenv(
+    "PRODUCT_SUB_FAMILIES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "product_sub_families.json")
+)
+
+# Confidence of an unambiguous keyword match, and the bonus for several matching patterns
+KEYWORD_CONFIDENCE = 0.85
+MULTI_MATCH_BONUS = 0.1
+# A sub-family is only learned when this many categorized products agree this much
+LEARN_MIN_SUPPORT = 5
+LEARN_MIN_PURITY = 0.9
+# Category sources the rules are learned from and evaluated against; never their own output
+LABEL_SOURCES = ("llm", "user")
+
+# Keywords for each category, matched against the normalized (lowercase, accentless) description
+PRODUCT_PATTERNS = {
+    "Fresh Food": [
+        # Fruit
+        r"\b(fruta|frutas|platano|platanos|banana|bananas|manzana|manzanas|naranja|naranjas|mandarina|mandarinas|limon|limones|pera|peras|uva|uvas|fresa|fresas|melon|sandia|kiwi|kiwis|aguacate|aguacates|pina|melocoton|melocotones|nectarina|nectarinas|cereza|cerezas|arandanos|frambuesas|mango)\b",
+        # Vegetables
+        r"\b(verdura|verduras|tomate|tomates|lechuga|cebolla|cebollas|patata|patatas|zanahoria|zanahorias|pimiento|pimientos|calabacin|pepino|pepinos|brocoli|coliflor|espinacas|ajo|ajos|puerro|puerros|champinon|champinones|berenjena|calabaza|judias verdes|ensalada|canonigos|rucula)\b",
+        # Meat
+        r"\b(pollo|pechuga|pechugas|muslo|muslos|ternera|cerdo|lomo|cordero|carne|picada|filete|filetes|solomillo|costilla|costillas|chuleta|chuletas|secreto iberico)\b",
+        # Fish and seafood
+        r"\b(pescado|merluza|salmon|bacalao|dorada|lubina|gamba|gambas|langostino|langostinos|calamar|calamares|sepia|pulpo|boqueron|boquerones|rape)\b",
+        # Deli
+        r"\b(jamon|chorizo|salchichon|fuet|pavo|embutido|mortadela|lomo embuchado|salchichas|sobrasada)\b",
+    ],
+    "Packaged & Processed Food": [
+        # Pantry staples
+        r"\b(arroz|pasta|macarrones|espaguetis|spaghetti|fideos|tallarines|harina|azucar|sal|aceite|vinagre|cereales|muesli|copos)\b",
+        # Legumes and canned goods
+        r"\b(lentejas|garbanzos|alubias|legumbres|conserva|atun|sardinas|mejillones|berberechos|aceitunas|maiz dulce|tomate frito|tomate triturado)\b",
+        # Sauces and condiments
+        r"\b(salsa|ketchup|mayonesa|mostaza|especias|pimienta|oregano|caldo|sopa|pure)\b",
+        # Ready meals, frozen and snacks
+        r"\b(pizza|lasana|croquetas|congelado|congelados|precocinado|patatas fritas|snack|snacks|nachos|frutos secos|almendras|cacahuetes|pistachos|nueces|palomitas)\b",
+        # Spreads
+        r"\b(mermelada|miel|crema de cacao|crema de cacahuete)\b",
+    ],
+    "Dairy & Eggs": [
+        r"\b(leche|leches|semidesnatada|desnatada|entera)\b",
+        r"\b(yogur|yogures|yog|griego|kefir|cuajada|bifidus)\b",
+        r"\b(queso|quesos|mozzarella|rallado|manchego|lonchas de queso|requeson)\b",
+        r"\b(mantequilla|margarina|nata|huevo|huevos)\b",
+    ],
+    "Bakery & Sweets": [
+        r"\b(pan|panes|barra|baguette|chapata|hogaza|molde|tostadas|picos|regananas)\b",
+        r"\b(bolleria|croissant|croissants|magdalena|magdalenas|bizcocho|donut|donuts|ensaimada|palmera|napolitana)\b",
+        r"\b(galleta|galletas|chocolate|chocolates|bombones|caramelo|caramelos|chicle|chicles|gominolas|golosinas|turron|polvorones)\b",
+        r"\b(helado|helados|tarta|tartas|flan|natillas|postre|postres)\b",
+    ],
+    "Beverages": [
+        r"\b(agua|aguas|refresco|refrescos|cola|tonica|gaseosa|isotonica|energetica|limonada|horchata)\b",
+        r"\b(zumo|zumos|nectar|smoothie|bebida|bebidas)\b",
+        r"\b(cerveza|cervezas|vino|vinos|cava|sidra|whisky|ron|ginebra|vodka|licor|vermut)\b",
+        r"\b(cafe|capsulas|te|infusion|infusiones|manzanilla|poleo)\b",
+    ],
+    "Health & Nutrition": [
+        r"\b(vitamina|vitaminas|suplemento|suplementos|multivitaminico|complemento alimenticio|proteina|proteinas|colageno)\b",
+        r"\b(potito|potitos|papilla|papillas|leche infantil|leche de continuacion|leche de crecimiento)\b",
+    ],
+    "Household & Cleaning": [
+        r"\b(detergente|deterg|suavizante|suaviz|lejia|lavavajillas|friegasuelos|limpiador|limpiahogar|amoniaco|quitagrasas|quitamanchas|abrillantador)\b",
+        r"\b(papel higienico|servilletas|rollo de cocina|papel de cocina|bolsas de basura|bolsa basura|papel aluminio|papel film)\b",
+        r"\b(ambientador|estropajo|bayeta|bayetas|fregona|insecticida|pilas|bombilla|velas)\b",
+    ],
+    "Personal Care & Hygiene": [
+        r"\b(champu|acondicionador|gel|jabon|desodorante|colonia|perfume|laca|tinte|espuma de afeitar)\b",
+        r"\b(pasta dental|pasta de dientes|dentifrico|cepillo dental|cepillo de dientes|colutorio|enjuague bucal|seda dental)\b",
+        r"\b(crema|locion|protector solar|maquillaje|desmaquillante|toallitas|panales|compresas|tampones|salvaslip|maquinilla|cuchillas)\b",
+    ],
+    "Pet Care": [
+        r"\b(perro|perros|gato|gatos|pienso|mascota|mascotas|arena para gatos|snack para perros)\b",
+    ],
+}
+
+
+@dataclass
+class CategoryGuess:
+    category: Optional[str]
+    confidence: float
+    source: str  # "keywords", "sub_family", "both" or "none"
+
+    @property
+    def confident(self) -> bool:
+        return self.category is not None and self.confidence >= MIN_CONFIDENCE
+
+
+NO_GUESS = CategoryGuess(None, 0.0, "none")
+
+
+def load_sub_families(path: str = SUB_FAMILIES_PATH) -> dict[str, dict]:
+    """sub_family -> {"category", "purity", "support"}, or {} when no table was learned yet."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to load sub-family categories from {path}. Error: {e}")
+        return {}
+
+
+class ProductClassifier:
+    """Keyword and sub-family rules with a confidence score."""
+
+    def __init__(self, patterns: dict[str, list[str]] = PRODUCT_PATTERNS, sub_families: Optional[dict] = None):
+        self._keywords = ExpenseClassifier(patterns)
+        self.sub_families = load_sub_families() if sub_families is None else sub_families
+
+    def _keyword_guess(self, description: Optional[str]) -> CategoryGuess:
+        counts = self._keywords.score(normalize_description(description))
+        if not counts:
+            return NO_GUESS
+        category = max(counts, key=counts.get)
+        best = counts[category]
+        confidence = KEYWORD_CONFIDENCE * best / sum(counts.values())
+        if best >= 2:
+            confidence += MULTI_MATCH_BONUS
+        return CategoryGuess(category, round(min(confidence, 0.95), 3), "keywords")
+
+    def _sub_family_guess(self, sub_family: Optional[str]) -> CategoryGuess:
+        learned = self.sub_families.get(sub_family or "")
+        if not learned:
+            return NO_GUESS
+        return CategoryGuess(learned["category"], float(learned["purity"]), "sub_family")
+
+    def classify(self, description: Optional[str], sub_family: Optional[str] = None) -> CategoryGuess:
+        by_keywords = self._keyword_guess(description)
+        by_sub_family = self._sub_family_guess(sub_family)
+        if by_keywords.category is None or by_sub_family.category is None:
+            return by_keywords if by_keywords.category else by_sub_family
+        if by_keywords.category == by_sub_family.category:
+            # Independent evidence for the same answer
+            confidence = 1 - (1 - by_keywords.confidence) * (1 - by_sub_family.confidence)
+            return CategoryGuess(by_keywords.category, round(confidence, 3), "both")
+        best, other = sorted((by_keywords, by_sub_family), key=lambda g: g.confidence, reverse=True)
+        return CategoryGuess(best.category, round(best.confidence * (1 - other.confidence), 3), best.source)
+
+
+_classifier: Optional[ProductClassifier] = None
+
+
+def get_classifier() -> ProductClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = ProductClassifier()
+    return _classifier
+
+
+def classify_product(description: Optional[str], sub_family: Optional[str] = None) -> CategoryGuess:
+    """
+    Guess the category of a ticket item
+
+    Args:
+        description: Ticket description (e.g. "LECHE SEMIDESNATADA 1L")
+        sub_family: Carrefour sub-family code
+
+    Returns:
+        CategoryGuess; use ``.confident`` to decide whether the LLM is needed
+    """
+    return get_classifier().classify(description, sub_family)
+
+
+def apply_rules(products) -> int:
+    """Set the category of uncategorized Product objects the rules are confident about."""
+    applied = 0
+    for product in products:
+        if product.category:
+            continue
+        guess = classify_product(product.description, product.sub_family)
+        if guess.confident:
+            product.category, product.category_source = guess.category, "rules"
+            applied += 1
+    return applied
+
+
+# ─── Learning and evaluation against LLM-categorized rows ────────────────────
+
+def learn_sub_families(rows: Iterable[tuple[Optional[str], Optional[str], str]]) -> dict[str, dict]:
+    """Majority category per sub-family over (description, sub_family, category) rows, when pure enough."""
+    by_sub_family: dict[str, Counter] = defaultdict(Counter)
+    for _, sub_family, category in rows:
+        if sub_family and category:
+            by_sub_family[sub_family][category] += 1
+    learned = {}
+    for sub_family, counts in sorted(by_sub_family.items()):
+        category, n = counts.most_common(1)[0]
+        support = sum(counts.values())
+        purity = n / support
+        if support >= LEARN_MIN_SUPPORT and purity >= LEARN_MIN_PURITY:
+            learned[sub_family] = {"category": category, "purity": round(purity, 3), "support": support}
+    return learned
+
+
+def evaluate(classifier: ProductClassifier, rows: list[tuple[Optional[str], Optional[str], str]]) -> dict:
+    """
+    Compare confident guesses with the LLM categories
+
+    hit_rate is the share of rows answered confidently and correctly, i.e.
+    the LLM calls the pre-pass saves without changing the result.
+    """
+    answered = correct = 0
+    for description, sub_family, category in rows:
+        guess = classifier.classify(description, sub_family)
+        if guess.confident:
+            answered += 1
+            correct += guess.category == category
+    total = len(rows)
+    return {
+        "rows": total,
+        "answered": answered,
+        "correct": correct,
+        "coverage": round(answered / total, 3) if total else 0.0,
+        "precision": round(correct / answered, 3) if answered else 0.0,
+        "hit_rate": round(correct / total, 3) if total else 0.0,
+    }
+
+
+def categorized_rows() -> list[tuple[Optional[str], Optional[str], str]]:
+    """One (description, sub_family, category) row per product code categorized by the LLM or a user."""
+    from sqlalchemy import select
+    from database import SessionLocal
+    from models.product import Product
+
+    db = SessionLocal()
+    try:
+        stmt = (
+            select(Product.description, Product.sub_family, Product.category)
+            .where(Product.category.isnot(None), Product.category_source.in_(LABEL_SOURCES))
+            .distinct(Product.code)
+            .order_by(Product.code, Product.id.desc())
+        )
+        return [tuple(row) for row in db.execute(stmt)]
+    finally:
+        db.close()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluate the product rules against LLM-categorized products")
+    parser.add_argument("--write", action="store_true", help=f"Learn the sub-family table from all rows into {SUB_FAMILIES_PATH}")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of rows kept out of sub-family learning")
+    args = parser.parse_args(argv)
+
+    rows = categorized_rows()
+    random.Random(0).shuffle(rows)
+    split = int(len(rows) * (1 - args.holdout))
+    train, test = rows[:split], rows[split:]
+
+    keywords_only = evaluate(ProductClassifier(sub_families={}), test)
+    with_sub_families = evaluate(ProductClassifier(sub_families=learn_sub_families(train)), test)
+    print(f"Evaluated on {len(test)} held-out products (sub-families learned from {len(train)})")
+    print(f"keywords only        : {json.dumps(keywords_only)}")
+    print(f"keywords + sub-family: {json.dumps(with_sub_families)}")
+
+    if args.write:
+        learned = learn_sub_families(rows)
+        with open(SUB_FAMILIES_PATH, "w", encoding="utf-8") as f:
+            json.dump(learned, f, indent=2, ensure_ascii=False, sort_keys=True)
+        print(f"Wrote {len(learned)} sub-families to {SUB_FAMILIES_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,19 @@
 
 
+# The 10 categories of SYSTEM_PROMPT, as stored in carrefour_item.category
+CATEGORIES = [
+    "Fresh Food",
+    "Packaged & Processed Food",
+    "Dairy & Eggs",
+    "Bakery & Sweets",
+    "Beverages",
+    "Health & Nutrition",
+    "Household & Cleaning",
+    "Personal Care & Hygiene",
+    "Pet Care",
+    "Other",
+]
+
 SYSTEM_PROMPT = """
 You are a product categorization assistant. Your task is to analyze product data and assign it to exactly one category from the fixed list below.
 
@@ -39,4 +53,20 @@ Return this exact JSON structure:
   "confidence": "<high | medium | low>",
   "reasoning": "<one sentence explaining why this category was chosen>"
 }}
-"""
\ No newline at end of file
+"""
+
+BATCH_USER_PROMPT = """
+Analyze each of the following products and assign each one a category.
+
+Products (JSON array, every product has an "id"):
+{PRODUCTS_JSON}
+
+Return a JSON array with exactly one object per product, using the same "id":
+[
+  {{
+    "id": <product id, unchanged>,
+    "category": "<one of the 10 categories>",
+    "confidence": "<high | medium | low>"
+  }}
+]
+"""
@@ -0,0 +1,116 @@
+"""
+Background rescoring of stale health scores
+
+Rows stamped with an older ``SCORING_VERSION``, or stored without their
+source inputs, are rescored, in chunks, from those inputs, or, for rows that
+lack them, from the offline dump index (``off_products``). Open Food Facts is
+never refetched. Every chunk commits on its own, so the job can stop at any
+point and the next run simply picks up the rows that are still stale;
+concurrent runners skip each other's rows.
+
+Runs at application startup (``RESCORE_ON_STARTUP=0`` disables it) or by hand::
+
+    python rescore.py [--chunk-size N]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import func, or_, select, update
+
+import rollups
+from database import SessionLocal
+from models.health_score import SCORING_VERSION, HealthScore
+from models.health_score_batch import score_rows_batch
+from models.off_product import OffProduct
+from models.open_food_facts import OpenFoodFacts
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "500"))
+ON_STARTUP = os.getenv("RESCORE_ON_STARTUP", "1") == "1"
+
+
+class RescoreJob:
+    """Rescore health_scores rows whose scoring_version is older than ``version``."""
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, version: int = SCORING_VERSION):
+        self.chunk_size = chunk_size
+        self.version = version
+        self.rescored = 0
+        self.skipped = 0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Finish the current chunk, then return."""
+        self._stopped.set()
+
+    def fetch_chunk(self, db, after: str) -> list[tuple[str, Optional[dict]]]:
+        """Next stale (barcode, source) pairs after ``after``, locked for this runner."""
+        stmt = (
+            select(HealthScore.barcode, func.coalesce(HealthScore.source, OffProduct.product))
+            .outerjoin(OffProduct, OffProduct.barcode == HealthScore.barcode)
+            # Rows without stored inputs are stale whatever their version: they get them from off_products
+            .where(or_(HealthScore.scoring_version < self.version, HealthScore.source.is_(None)),
+                   HealthScore.barcode > after)
+            .order_by(HealthScore.barcode)
+            .limit(self.chunk_size)
+            .with_for_update(of=HealthScore, skip_locked=True)
+        )
+        return [tuple(row) for row in db.execute(stmt)]
+
+    def run_chunk(self, after: str = "") -> Optional[str]:
+        """Rescore one chunk. Returns the last barcode seen, or None when nothing is left."""
+        db = SessionLocal()
+        try:
+            rows = self.fetch_chunk(db, after)
+            if not rows:
+                return None
+            # Rows without any stored inputs stay stale until their product is imported
+            scores = score_rows_batch([{**source, "_id": barcode} for barcode, source in rows if source])
+            if scores:
+                db.execute(update(HealthScore), scores)
+                rollups.refresh_purchases(db, rollups.tickets_with(db, barcodes=[s["barcode"] for s in scores]))
+            db.commit()
+            OpenFoodFacts.forget(s["barcode"] for s in scores)
+            self.rescored += len(scores)
+            self.skipped += len(rows) - len(scores)
+            return rows[-1][0]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def run(self):
+        after = ""
+        while not self._stopped.is_set():
+            after = self.run_chunk(after)
+            if after is None:
+                break
+        logger.info(
+            f"Rescored {self.rescored} health scores to version {self.version}"
+            f" ({self.skipped} without stored inputs skipped)"
+        )
+
+    async def run_in_background(self):
+        try:
+            await asyncio.to_thread(self.run)
+        except Exception as e:
+            logger.error(f"Health score rescoring failed. Error: {e}")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Rescore health scores computed by an older scoring model")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    RescoreJob(chunk_size=args.chunk_size).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,236 @@
+"""
+Per-purchase and monthly health and spend rollups
+
+For every ticket, ``purchase_rollups`` holds its spend, the spend-weighted
+health score of its products (each product weighs its net amount; products
+without a health score are left out of the weights), and its spend split by
+category, NOVA group and Nutri-Score grade. ``monthly_rollups`` sums the
+tickets of each calendar month.
+
+Rollups are refreshed incrementally: writing a purchase refreshes that ticket,
+and writing health scores refreshes the tickets containing those barcodes.
+Either way only the touched tickets and their months are recomputed.
+Rebuild everything by hand with::
+
+    python rollups.py [--chunk-size N]
+"""
+
+import argparse
+import logging
+import os
+from collections import defaultdict
+from datetime import date
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal
+from models.health_score import HealthScore
+from models.product import Product
+from models.purchase import Purchase
+from models.rollup import MonthlyRollup, PurchaseRollup
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("ROLLUP_CHUNK_SIZE", "500"))
+
+# First key of the transaction-level advisory locks serializing refreshes of one month
+MONTH_LOCK = 7301
+
+UNKNOWN = "unknown"
+SPLITS = ("category_spend", "nova_spend", "nutriscore_spend")
+
+
+def weighted_score(items: Iterable[tuple]) -> tuple[float, Optional[float]]:
+    """
+    (scored spend, spend-weighted mean score) of (net amount, score) pairs.
+
+    Unscored items and non-positive amounts (discounts, returns) carry no
+    weight; the score is None when nothing was scored.
+    """
+    weight = total = 0.0
+    for amount, score in items:
+        amount = float(amount or 0)
+        if score is None or amount <= 0:
+            continue
+        weight += amount
+        total += amount * score
+    return weight, (round(total / weight, 2) if weight else None)
+
+
+def _add(split: dict, key, amount: float):
+    key = str(key) if key is not None else UNKNOWN
+    split[key] = split.get(key, 0.0) + amount
+
+
+def _rounded(split: dict) -> dict:
+    return {k: round(v, 2) for k, v in sorted(split.items())}
+
+
+def purchase_rollup(ticket_id: str, purchased_at, lines: Iterable[tuple]) -> dict:
+    """purchase_rollups row of one ticket from its (net amount, category, score, NOVA group, Nutri-Score) lines."""
+    lines = list(lines)
+    splits = {name: {} for name in SPLITS}
+    spend = 0.0
+    for amount, category, _, nova_group, grade in lines:
+        amount = float(amount or 0)
+        spend += amount
+        _add(splits["category_spend"], category, amount)
+        _add(splits["nova_spend"], nova_group, amount)
+        _add(splits["nutriscore_spend"], grade.lower() if grade else None, amount)
+    scored_spend, score = weighted_score((amount, score) for amount, _, score, _, _ in lines)
+    return {
+        "ticketId": ticket_id,
+        "month": month_of(purchased_at),
+        "spend": round(spend, 2),
+        "scored_spend": round(scored_spend, 2),
+        "health_score": score,
+        **{name: _rounded(split) for name, split in splits.items()},
+    }
+
+
+def monthly_rollup(month: date, purchases: Iterable[dict]) -> dict:
+    """monthly_rollups row of a month from the rollup rows of its tickets."""
+    purchases = list(purchases)
+    splits = {name: defaultdict(float) for name in SPLITS}
+    for p in purchases:
+        for name in SPLITS:
+            for key, amount in (p[name] or {}).items():
+                splits[name][key] += amount
+    scored_spend, score = weighted_score((p["scored_spend"], p["health_score"]) for p in purchases)
+    return {
+        "month": month,
+        "purchases": len(purchases),
+        "spend": round(sum(float(p["spend"] or 0) for p in purchases), 2),
+        "scored_spend": round(scored_spend, 2),
+        "health_score": score,
+        **{name: _rounded(split) for name, split in splits.items()},
+    }
+
+
+def month_of(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _upsert(db, model, key: str, rows: list[dict]):
+    stmt = insert(model).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={**{c: stmt.excluded[c] for c in rows[0] if c != key}, "updated_at": func.now()},
+    ))
+
+
+def refresh_purchases(db, ticket_ids: Iterable[str]) -> int:
+    """Recompute the rollups of these tickets and of their months. The caller commits."""
+    ticket_ids = set(ticket_ids)
+    if not ticket_ids:
+        return 0
+    purchases = db.execute(
+        select(Purchase.id, Purchase.ticket_id, Purchase.date).where(Purchase.ticket_id.in_(ticket_ids))
+    ).all()
+    lines = defaultdict(list)
+    stmt = (
+        select(Product.ticket_id, Product.net_amount, Product.category,
+               HealthScore.total_score, HealthScore.nova_group, HealthScore.nutriscore_grade)
+        .outerjoin(HealthScore, HealthScore.barcode == Product.code)
+        .where(Product.ticket_id.in_(ticket_ids))
+    )
+    for ticket_id, *line in db.execute(stmt):
+        lines[ticket_id].append(tuple(line))
+
+    # Months a ticket used to belong to are refreshed too, in case its date changed
+    months = set(db.execute(select(PurchaseRollup.month).where(PurchaseRollup.ticket_id.in_(ticket_ids))).scalars())
+    rows = {id_: purchase_rollup(ticket_id, purchased_at, lines[ticket_id]) for id_, ticket_id, purchased_at in purchases}
+    if rows:
+        _upsert(db, PurchaseRollup, "ticketId", list(rows.values()))
+        # Keep carrefour_purchase.healthScore, read by the ticket views, in line with the rollup
+        db.execute(update(Purchase), [{"id": id_, "health_score": r["health_score"]} for id_, r in rows.items()])
+    refresh_months(db, months | {r["month"] for r in rows.values()})
+    return len(rows)
+
+
+def refresh_months(db, months: Iterable[date]) -> int:
+    """
+    Recompute these months from their purchase rollups. The caller commits.
+
+    Each month is locked until the caller's transaction ends, so a concurrent
+    refresh of the same month reads the purchase rollups after this one has
+    committed instead of overwriting it with a total that misses them. Locks
+    are taken in month order so two refreshes cannot deadlock.
+    """
+    months = set(months)
+    if not months:
+        return 0
+    for month in sorted(months):
+        db.execute(select(func.pg_advisory_xact_lock(MONTH_LOCK, month.year * 100 + month.month)))
+    columns = ["month", "spend", "scored_spend", "health_score", *SPLITS]
+    by_month = defaultdict(list)
+    stmt = select(*(getattr(PurchaseRollup, c) for c in columns)).where(PurchaseRollup.month.in_(months))
+    for row in db.execute(stmt):
+        by_month[row[0]].append(dict(zip(columns, row)))
+    rows = [monthly_rollup(month, by_month[month]) for month in sorted(by_month)]
+    if rows:
+        _upsert(db, MonthlyRollup, "month", rows)
+    empty = months - set(by_month)
+    if empty:
+        db.execute(delete(MonthlyRollup).where(MonthlyRollup.month.in_(empty)))
+    return len(rows)
+
+
+def tickets_with(db, barcodes: Iterable[str] = (), product_ids: Iterable[int] = ()) -> set[str]:
+    """Tickets containing any of these barcodes or carrefour_item ids."""
+    barcodes = {b for b in barcodes if b}
+    product_ids = set(product_ids)
+    if not barcodes and not product_ids:
+        return set()
+    stmt = select(Product.ticket_id).where(Product.code.in_(barcodes) | Product.id.in_(product_ids)).distinct()
+    return set(db.execute(stmt).scalars())
+
+
+def refresh(ticket_ids: Iterable[str] = (), barcodes: Iterable[str] = ()):
+    """Refresh the tickets given and those containing ``barcodes`` in their own transaction; errors are logged."""
+    db = SessionLocal()
+    try:
+        refreshed = refresh_purchases(db, set(ticket_ids) | tickets_with(db, barcodes))
+        db.commit()
+        if refreshed:
+            logger.info(f"Refreshed rollups of {refreshed} purchases")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to refresh purchase rollups. Error: {e}")
+    finally:
+        db.close()
+
+
+def rebuild(chunk_size: int = CHUNK_SIZE) -> int:
+    """Recompute every rollup, one committed chunk of tickets at a time."""
+    db = SessionLocal()
+    refreshed = 0
+    try:
+        ticket_ids = list(db.execute(select(Purchase.ticket_id).order_by(Purchase.ticket_id)).scalars())
+        for i in range(0, len(ticket_ids), chunk_size):
+            refreshed += refresh_purchases(db, ticket_ids[i:i + chunk_size])
+            db.commit()
+        # Months without any ticket left
+        db.execute(delete(MonthlyRollup).where(MonthlyRollup.month.not_in(select(PurchaseRollup.month))))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Rebuilt rollups of {refreshed} purchases")
+    return refreshed
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Rebuild the per-purchase and monthly rollups")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    rebuild(chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
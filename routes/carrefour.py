@@ -1,17 +1,57 @@
+import asyncio
 from datetime import datetime
+from typing import Literal, Optional
 from fastapi import HTTPException
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session, selectinload
 
-from models import Product
+from models import HealthScore, Product
 from models.carrefour_client import CarrefourClient
 from models.open_food_facts import OpenFoodFacts
 from models.purchase import Purchase
 from database import get_db
+from models.rollup import MonthlyRollup
+from pagination import after_cursor, keyset_order, next_cursor
+import enrichment
+import rollups
+from backfill import backfill_job
 
 router = APIRouter(prefix="/carrefour", tags=["carrefour"])
 
+View = Literal["full", "summary"]
+
+# Products of all loaded purchases, and their health scores, in one IN query each
+# instead of one query per purchase
+WITH_PRODUCTS = selectinload(Purchase.products).selectinload(Product.health_score)
+
+
+def purchase_aggregates(db: Session, ticket_ids: list[str]) -> dict[str, dict]:
+    """ticketId -> product counts and mean product score, for all tickets in one grouped query."""
+    if not ticket_ids:
+        return {}
+    rows = (
+        db.query(
+            Product.ticket_id,
+            func.count(Product.id),
+            func.count(Product.category),
+            func.count(HealthScore.barcode),
+            func.avg(HealthScore.total_score),
+        )
+        .outerjoin(HealthScore, HealthScore.barcode == Product.code)
+        .filter(Product.ticket_id.in_(ticket_ids))
+        .group_by(Product.ticket_id)
+        .all()
+    )
+    return {
+        ticket_id: {
+            "productCount": products,
+            "categorizedCount": categorized,
+            "scoredCount": scored,
+            "meanProductScore": round(float(mean), 2) if mean is not None else None,
+        }
+        for ticket_id, products, categorized, scored, mean in rows
+    }
 
 
 @router.get("/purchases")
@@ -19,23 +59,42 @@ def get_purchases(
     from_date: str = Query(default="2024-01-01T00:00:00.000Z", alias="from"),
     to_date: str = Query(default="2026-12-31T23:59:59.000Z", alias="to"),
     count: int = Query(default=10),
+    cursor: Optional[str] = Query(default=None),
+    view: View = Query(default="full"),
+    aggregates: bool = Query(default=True),
     db: Session = Depends(get_db),
 ):
-    """Get purchases from the database filtered by date range."""
+    """Get purchases from the database filtered by date range.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to fetch the following page.
+    ``view=summary`` returns the ticket headers without their products, plus
+    per-ticket product counts unless ``aggregates=false``. Either way the page
+    costs the same number of queries whatever ``count`` is.
+    """
     from_dt = datetime.fromisoformat(from_date.replace("Z", ""))
     to_dt = datetime.fromisoformat(to_date.replace("Z", ""))
 
+    query = db.query(Purchase).filter(Purchase.date >= from_dt, Purchase.date <= to_dt)
+    if cursor:
+        query = query.filter(after_cursor(Purchase.date, Purchase.id, cursor))
+    if view == "full":
+        query = query.options(WITH_PRODUCTS)
     purchases = (
-        db.query(Purchase)
-        .filter(Purchase.date >= from_dt, Purchase.date <= to_dt)
-        .order_by(Purchase.date.desc())
+        query
+        .order_by(*keyset_order(Purchase.date, Purchase.id))
         .limit(count)
         .all()
     )
 
+    if view == "full":
+        data = [p.to_dict() for p in purchases]
+    else:
+        totals = purchase_aggregates(db, [p.ticket_id for p in purchases]) if aggregates else {}
+        data = [{**p.to_header_dict(), **totals.get(p.ticket_id, {})} for p in purchases]
     return {
         "count": len(purchases),
-        "data": [p.to_dict() for p in purchases]
+        "next_cursor": next_cursor(purchases, count, "date"),
+        "data": data
     }
 
 @router.get("/products")
@@ -52,13 +111,13 @@ def get_products(
 def get_last_purchases(
     db: Session = Depends(get_db),
 ):
-    purchase = db.query(Purchase).limit(1).first()
+    purchase = db.query(Purchase).options(WITH_PRODUCTS).limit(1).first()
     return purchase.to_dict()
 
 @router.get("/purchase/{purchase_id}")
 def get_purchase(purchase_id: str, db: Session = Depends(get_db)):
     """Fetch a specific ticket by ID."""
-    purchase = db.query(Purchase).filter(and_(Purchase.ticket_id == purchase_id)).first()
+    purchase = db.query(Purchase).options(WITH_PRODUCTS).filter(and_(Purchase.ticket_id == purchase_id)).first()
     if not purchase:
         raise HTTPException(status_code=404, detail=f"Purchase with ID {purchase_id} not found")
     return purchase.to_dict()
@@ -68,6 +127,9 @@ def save_purchase(purchase_id: str, db: Session = Depends(get_db)):
     cc = CarrefourClient()
     purchase = cc.get_purchase(purchase_id)
     db.add(purchase)
+    db.flush()
+    rollups.refresh_purchases(db, [purchase.ticket_id])
+    enrichment.enqueue(db, [purchase.ticket_id])
     db.commit()
     db.refresh(purchase)
     return purchase.to_dict()
@@ -113,21 +175,64 @@ def search_product(
     results = CarrefourClient().search_product(query, store, page)
     return {"query": query, "count": len(results), "results": results}
 
+@router.post("/backfill", status_code=202)
+async def start_backfill(
+    from_date: str = Query(default="2024-01-01T00:00:00.000Z", alias="from"),
+    to_date: str = Query(default="2030-12-31T23:59:59.000Z", alias="to"),
+):
+    """Save every ticket of the date range that is not saved yet, in the background (resumes after a failure)."""
+    started = backfill_job.start(from_date, to_date)
+    return {"status": "success", "started": started, "job": backfill_job.to_dict()}
+
+
+@router.get("/backfill")
+async def get_backfill():
+    """Progress of the current or last backfill run."""
+    return {"status": "success", "job": backfill_job.to_dict()}
+
+
+@router.get("/enrichment")
+async def get_enrichment_queue():
+    """Enrichment queue depth per stage and status, and what this process' workers did"""
+    depth = await asyncio.to_thread(enrichment.enrichment_queue.depth)
+    return {"status": "success", "depth": depth, "workers": enrichment.enrichment_queue.to_dict()}
+
+
+@router.get("/rollups/monthly")
+def get_monthly_rollups(
+    from_date: Optional[str] = Query(default=None, alias="from"),
+    to_date: Optional[str] = Query(default=None, alias="to"),
+    db: Session = Depends(get_db),
+):
+    """Spend, spend-weighted health score and spend splits per calendar month, oldest first."""
+    query = db.query(MonthlyRollup)
+    if from_date:
+        query = query.filter(MonthlyRollup.month >= rollups.month_of(datetime.fromisoformat(from_date.replace("Z", ""))))
+    if to_date:
+        query = query.filter(MonthlyRollup.month <= datetime.fromisoformat(to_date.replace("Z", "")).date())
+    months = query.order_by(MonthlyRollup.month).all()
+    return {"count": len(months), "data": [m.to_dict() for m in months]}
+
+
 @router.get("/purchase/score/{ticket_id}")
-def purchase_mean_health_score(
+async def purchase_mean_health_score(
     ticket_id: str,
     db: Session = Depends(get_db)
 ):
-    purchase = db.query(Purchase).where(and_(Purchase.ticket_id == ticket_id)).first()
-    score = 0
-    count = 0
-    for p in purchase.products:
-        off_item = OpenFoodFacts().get_product(p.code)
-        if off_item:
-            score += off_item.total_score
-            count += 1
-    purchase.health_score = score / count
-    db.merge(purchase)
-    db.commit()
-    return purchase
-    return {"query": query, "count": len(results), "results": results}
\ No newline at end of file
+    """Fetch missing health scores of a ticket, then refresh its rollup and spend-weighted score."""
+    # The session is blocking: only the Open Food Facts fetch runs on the event loop
+    def load():
+        purchase = db.query(Purchase).options(selectinload(Purchase.products)).where(and_(Purchase.ticket_id == ticket_id)).first()
+        return purchase, [p.code for p in purchase.products] if purchase else []
+
+    def refresh():
+        rollups.refresh_purchases(db, [ticket_id])
+        db.commit()
+        db.refresh(purchase)
+        return purchase.to_header_dict()
+
+    purchase, codes = await asyncio.to_thread(load)
+    if not purchase:
+        raise HTTPException(status_code=404, detail=f"Purchase with ID {ticket_id} not found")
+    await OpenFoodFacts().get_products(codes)
+    return await asyncio.to_thread(refresh)
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import Expense
+
+router = APIRouter(prefix="/expenses/geo", tags=["expenses"])
+
+# Below this zoom level points are grouped into grid clusters
+CLUSTER_BELOW_ZOOM = 14
+# Grid cells per map tile side when clustering
+CELLS_PER_TILE = 4
+
+
+def _parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minLon,minLat,maxLon,maxLat")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox min values must not exceed max values")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _location():
+    # Must match the GiST expression index ix_expenses_location
+    return func.point(Expense.longitude, Expense.latitude)
+
+
+def _in_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float):
+    box = func.box(func.point(min_lon, min_lat), func.point(max_lon, max_lat))
+    return _location().op("<@")(box)
+
+
+def cell_size(zoom: int) -> float:
+    """Grid cell side in degrees for a zoom level (a tile spans 360 / 2^zoom degrees)."""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+@router.get("")
+def get_expenses_in_bbox(
+    bbox: str = Query(..., description="minLon,minLat,maxLon,maxLat"),
+    zoom: int = Query(default=CLUSTER_BELOW_ZOOM, ge=0, le=22),
+    limit: int = Query(default=1000, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    """Expenses inside the map viewport: raw points, or grid clusters below CLUSTER_BELOW_ZOOM"""
+    in_bbox = _in_bbox(*_parse_bbox(bbox))
+    try:
+        if zoom >= CLUSTER_BELOW_ZOOM:
+            expenses = (
+                db.query(Expense)
+                .filter(in_bbox)
+                .order_by(Expense.post_time.desc())
+                .limit(limit)
+                .all()
+            )
+            return {
+                "status": "success",
+                "mode": "points",
+                "count": len(expenses),
+                "data": [e.to_dict() for e in expenses],
+            }
+
+        # Inline the cell size so SELECT and GROUP BY share one expression
+        cell = literal_column(repr(cell_size(zoom)))
+        cell_x = func.floor(Expense.longitude / cell)
+        cell_y = func.floor(Expense.latitude / cell)
+        size = func.count(Expense.id)
+        rows = (
+            db.query(
+                size,
+                func.sum(Expense.amount),
+                func.avg(Expense.latitude),
+                func.avg(Expense.longitude),
+            )
+            .filter(in_bbox)
+            .group_by(cell_x, cell_y)
+            # The biggest clusters survive the limit, in a stable order
+            .order_by(size.desc(), cell_x, cell_y)
+            .limit(limit)
+            .all()
+        )
+        return {
+            "status": "success",
+            "mode": "clusters",
+            "count": len(rows),
+            "data": [
+                {
+                    "count": count,
+                    "amount": round(float(amount), 2) if amount is not None else 0.0,
+                    "latitude": float(lat),
+                    "longitude": float(lon),
+                }
+                for count, amount, lat, lon in rows
+            ],
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch expenses: {str(e)}")
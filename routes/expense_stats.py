@@ -0,0 +1,190 @@
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import Expense
+
+router = APIRouter(prefix="/expenses/stats", tags=["expenses"])
+
+Period = Literal["day", "week", "month"]
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+
+class StatsFilter:
+    """Common query parameters: date range on post_time and optional currency."""
+
+    def __init__(
+        self,
+        from_date: Optional[str] = Query(default=None, alias="from"),
+        to_date: Optional[str] = Query(default=None, alias="to"),
+        currency: Optional[str] = Query(default=None),
+    ):
+        self.from_dt = _parse_date(from_date)
+        self.to_dt = _parse_date(to_date)
+        self.currency = currency
+
+    def conditions(self) -> list:
+        """Only positive amounts count, as on the dashboard."""
+        conditions = [Expense.amount > 0]
+        if self.from_dt:
+            conditions.append(Expense.post_time >= self.from_dt)
+        if self.to_dt:
+            conditions.append(Expense.post_time <= self.to_dt)
+        if self.currency:
+            conditions.append(Expense.currency == self.currency)
+        return conditions
+
+
+def _money(value) -> float:
+    return round(float(value), 2) if value is not None else 0.0
+
+
+def _summary(db: Session, filters: StatsFilter) -> dict:
+    month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    total, count, month = (
+        db.query(
+            func.sum(Expense.amount),
+            func.count(Expense.id),
+            func.sum(Expense.amount).filter(Expense.post_time >= month_start),
+        )
+        .filter(*filters.conditions())
+        .one()
+    )
+    return {
+        "total": _money(total),
+        "count": count or 0,
+        "avg": _money(total / count) if count else 0.0,
+        "month": _money(month),
+    }
+
+
+def _by_category(db: Session, filters: StatsFilter) -> list[dict]:
+    category = func.coalesce(Expense.category, literal_column("'other'"))
+    total = func.sum(Expense.amount)
+    rows = (
+        db.query(category, total, func.count(Expense.id))
+        .filter(*filters.conditions())
+        .group_by(category)
+        .order_by(total.desc())
+        .all()
+    )
+    return [{"name": name, "total": _money(t), "count": c} for name, t, c in rows]
+
+
+def _by_currency(db: Session, filters: StatsFilter) -> list[dict]:
+    total = func.sum(Expense.amount)
+    rows = (
+        db.query(Expense.currency, total, func.count(Expense.id))
+        .filter(*filters.conditions())
+        .group_by(Expense.currency)
+        .order_by(func.count(Expense.id).desc())
+        .all()
+    )
+    return [{"currency": currency, "total": _money(t), "count": c} for currency, t, c in rows]
+
+
+def _by_shop(db: Session, filters: StatsFilter, limit: int) -> list[dict]:
+    total = func.sum(Expense.amount)
+    rows = (
+        db.query(Expense.shop_name, total, func.count(Expense.id))
+        .filter(*filters.conditions(), Expense.shop_name.isnot(None))
+        .group_by(Expense.shop_name)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{"name": name, "total": _money(t), "count": c} for name, t, c in rows]
+
+
+def _timeseries(db: Session, filters: StatsFilter, period: Period, limit: int) -> list[dict]:
+    # Inline the (validated) period so SELECT and GROUP BY share one expression
+    bucket = func.date_trunc(literal_column(f"'{period}'"), Expense.post_time)
+    rows = (
+        db.query(bucket, func.sum(Expense.amount), func.count(Expense.id))
+        .filter(*filters.conditions(), Expense.post_time.isnot(None))
+        .group_by(bucket)
+        .order_by(bucket.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {"period": b.isoformat() if b else None, "total": _money(t), "count": c}
+        for b, t, c in reversed(rows)
+    ]
+
+
+@router.get("")
+def get_stats(filters: StatsFilter = Depends(), db: Session = Depends(get_db)):
+    """Dashboard overview: summary, categories, currencies, top shops and last 12 months"""
+    try:
+        currencies = _by_currency(db, filters)
+        return {
+            "status": "success",
+            "summary": {
+                **_summary(db, filters),
+                "currency": currencies[0]["currency"] if currencies else None,
+            },
+            "categories": _by_category(db, filters),
+            "currencies": currencies,
+            "shops": _by_shop(db, filters, 8),
+            "monthly": _timeseries(db, filters, "month", 12),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
+
+
+@router.get("/categories")
+def get_category_stats(filters: StatsFilter = Depends(), db: Session = Depends(get_db)):
+    """Totals by category"""
+    try:
+        return {"status": "success", "data": _by_category(db, filters)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
+
+
+@router.get("/currencies")
+def get_currency_stats(filters: StatsFilter = Depends(), db: Session = Depends(get_db)):
+    """Totals by currency"""
+    try:
+        return {"status": "success", "data": _by_currency(db, filters)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
+
+
+@router.get("/shops")
+def get_shop_stats(
+    limit: int = Query(default=8, ge=1, le=100),
+    filters: StatsFilter = Depends(),
+    db: Session = Depends(get_db),
+):
+    """Top shops by total spent"""
+    try:
+        return {"status": "success", "data": _by_shop(db, filters, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
+
+
+@router.get("/timeseries")
+def get_timeseries_stats(
+    period: Period = Query(default="month"),
+    limit: int = Query(default=12, ge=1, le=400),
+    filters: StatsFilter = Depends(),
+    db: Session = Depends(get_db),
+):
+    """Totals per day/week/month, oldest first, for the last ``limit`` periods"""
+    try:
+        return {"status": "success", "period": period, "data": _timeseries(db, filters, period, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute stats: {str(e)}")
@@ -1,21 +1,34 @@
+import itertools
+import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional
 
-from sqlalchemy import and_
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 
 from expense_classifier import detect_expense_type, classify_by_emoji
 from models import NotificationRequest, Expense
-from models.carrefour_client import CarrefourClient
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-from database import get_db
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from events import broadcaster
+from pagination import after_cursor, keyset_order, next_cursor
+from ticket_watcher import ticket_watcher
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/expenses", tags=["expenses"])
 
+# Ids are assigned at insert but become visible at commit, so a row with a lower id can
+# still appear after a higher one. Watermarks only move past rows older than this
+# (seconds), and past the most recent WATERMARK_WINDOW rows at most.
+WATERMARK_LAG = float(os.getenv("EXPENSES_WATERMARK_LAG", "5"))
+WATERMARK_WINDOW = 100
+
 # Amount/currency extraction regex (shared)
 AMOUNT_SYMBOLS = r"€|\$|£|¥|₹|元|₽|₪|₩|฿|₫|₱|₭|₮|₦|₼|G|kf|S/|R\$|CHF|kr"
 AMOUNT_REGEX = rf"Paid\s+(?P<symbol>{AMOUNT_SYMBOLS})\s?(?P<amount>\d{{1,3}}(?:[.,]\d{{3}})*(?:[.,]\d{{2}})?)"
@@ -38,168 +51,348 @@ def extract_shop_name(text: str):
     return match.group(1).strip() if match else None
 
 
+def _filter_reason(notification: NotificationRequest):
+    """Return the filter message for a notification that must be ignored, or None."""
+    if "paid" not in (notification.text or "").lower():
+        logger.warning(f"FILTERED: Not Paid notification blocked - {notification.packageName} - {notification.title}")
+        return "Notification not about paying ignored (filtered)"
+    if "wallet" in notification.packageName.lower():
+        logger.warning(f"FILTERED: Wallet notification blocked - {notification.packageName} - {notification.title}")
+        return "Notification with wallet package ignored (filtered)"
+    return None
+
+
+def _build_expense_values(notification: NotificationRequest) -> dict:
+    """Classify the notification and extract the column values for a new Expense row."""
+    category = notification.expenseType
+    if not category:
+        category = classify_by_emoji(notification.text or "")
+        if not category:
+            category = detect_expense_type(notification.title or "", notification.text or "")
+        if category:
+            logger.info(f"AUTO-DETECTED category: {category} for '{notification.title}'")
+        else:
+            logger.warning(f"Could not detect category for: {notification.title}")
+
+    amount, currency = extract_amount(notification.text or "")
+    if amount is None and notification.amount:
+        amount, currency = notification.amount, notification.currency
+
+    return {
+        "text": notification.text,
+        "latitude": notification.latitude,
+        "longitude": notification.longitude,
+        "post_time": datetime.fromtimestamp(notification.postTime / 1000),
+        "category": category,
+        "amount": amount,
+        "currency": currency,
+        "shop_name": extract_shop_name(notification.text),
+    }
+
+
+def dedup_key(post_time: datetime, amount) -> str:
+    """
+    Idempotency key of a notification: its post time and amount in cents.
+
+    Built from stored columns only, so existing rows can be keyed in SQL
+    (see README).
+    """
+    cents = f"{float(amount):.2f}" if amount is not None else ""
+    return f"{post_time.strftime('%Y-%m-%dT%H:%M:%S.%f')}|{cents}"
+
+
+def _insert_new():
+    """INSERT that skips the rows whose dedup_key is already stored and returns the others."""
+    return (
+        insert(Expense)
+        .on_conflict_do_nothing(index_elements=[Expense.dedup_key])
+        .returning(Expense.id, Expense.created_at, Expense.dedup_key)
+    )
+
+
+async def _stored_with(db: AsyncSession, column, value):
+    """id and created_at of the row whose ``column`` equals ``value``, or None."""
+    return (await db.execute(select(Expense.id, Expense.created_at).where(column == value))).first()
+
+
+def _already_stored(row) -> dict:
+    return {"status": "success", "message": "Notification already stored", "data": _stored(row)}
+
+
+def _stored(row) -> dict:
+    """id and created_at of a stored row, as returned to the client."""
+    return {"id": row.id, "created_at": row.created_at.isoformat() if row.created_at else None}
+
+
+def _settled():
+    """True for rows old enough that no lower id can still be uncommitted."""
+    cutoff = func.now() - timedelta(seconds=WATERMARK_LAG)
+    return or_(Expense.created_at.is_(None), Expense.created_at <= cutoff).label("settled")
+
+
+def _is_carrefour(notification: NotificationRequest) -> bool:
+    return "carrefour" in (notification.title or "").lower()
+
+
 @router.post("")
 async def insert_expenses(
     notification: NotificationRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Insert a new notification into the database"""
+    """Insert a new notification into the database
 
-    logger.info(f"Received notification from: {notification.packageName} - Title: {notification.title}")
+    Retries are answered with the stored row: the notification is keyed on its
+    post time and amount, and also on its ``Idempotency-Key`` header when sent.
+    """
 
-    if "paid" not in (notification.text or "").lower():
-        logger.warning(f"FILTERED: Not Paid notification blocked - {notification.packageName} - {notification.title}")
-        return {
-            "status": "filtered",
-            "message": "Notification not about paying ignored (filtered)",
-            "package_name": notification.packageName
-        }
+    logger.info(f"Received notification from: {notification.packageName} - Title: {notification.title}")
 
-    if "wallet" in notification.packageName.lower():
-        logger.warning(f"FILTERED: Wallet notification blocked - {notification.packageName} - {notification.title}")
+    reason = _filter_reason(notification)
+    if reason:
         return {
             "status": "filtered",
-            "message": "Notification with wallet package ignored (filtered)",
+            "message": reason,
             "package_name": notification.packageName
         }
 
     try:
-        category = notification.expenseType
-        if not category:
-            category = classify_by_emoji(notification.text or "")
-            if not category:
-                category = detect_expense_type(notification.title or "", notification.text or "")
-            if category:
-                logger.info(f"AUTO-DETECTED category: {category} for '{notification.title}'")
-            else:
-                logger.warning(f"Could not detect category for: {notification.title}")
-
-        amount, currency = extract_amount(notification.text or "")
-        if amount is None and notification.amount:
-            amount, currency = notification.amount, notification.currency
-
-        post_time = datetime.fromtimestamp(notification.postTime / 1000)
-        same_item = db.query(Expense).where(and_(Expense.post_time == post_time, Expense.amount == amount)).first()
-        if same_item:
-            return {
-                "status": "success",
-                "message": "Notification with same post time and amount already exist",
-                "data": {
-                    "id": same_item.id,
-                    "created_at": same_item.created_at.isoformat() if same_item.created_at else None,
-                },
-            }
-
-        expense = Expense(
-            text=notification.text,
-            latitude=notification.latitude,
-            longitude=notification.longitude,
-            post_time=post_time,
-            category=category,
-            amount=amount,
-            currency=currency,
-            shop_name=extract_shop_name(notification.text),
-        )
-
-        db.add(expense)
-        db.commit()
-        db.refresh(expense)
-
+        values = _build_expense_values(notification)
+        values["dedup_key"] = dedup_key(values["post_time"], values["amount"])
+        if idempotency_key:
+            values["idempotency_key"] = idempotency_key
+            same_item = await _stored_with(db, Expense.idempotency_key, idempotency_key)
+            if same_item:
+                return _already_stored(same_item)
+        try:
+            inserted = (await db.execute(_insert_new(), [values])).first()
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # A concurrent request with the same Idempotency-Key may have committed first
+            await db.rollback()
+            same_item = await _stored_with(db, Expense.idempotency_key, idempotency_key)
+            if same_item is None:
+                raise
+            return _already_stored(same_item)
+        if inserted is None:
+            return _already_stored(await _stored_with(db, Expense.dedup_key, values["dedup_key"]))
+        await db.commit()
+
+        expense = Expense(**values, id=inserted.id, created_at=inserted.created_at)
         logger.info(f"INSERTED: Notification saved - {notification.packageName} - {notification.title} - ID: {expense.id}")
+        broadcaster.publish("expense", expense.to_dict())
 
-        if "carrefour" in (notification.title or "").lower():
-            background_tasks.add_task(CarrefourClient.save_last_ticket)
+        if _is_carrefour(notification):
+            ticket_watcher.trigger()
 
         return {
             "status": "success",
             "message": "Notification inserted successfully",
-            "data": {
-                "id": expense.id,
-                "created_at": expense.created_at.isoformat() if expense.created_at else None,
-            },
+            "data": _stored(expense),
         }
 
     except IntegrityError:
-        db.rollback()
+        # Unique violations the ON CONFLICT target does not cover
+        await db.rollback()
         raise HTTPException(status_code=409, detail="Duplicate notification")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to insert notification: {str(e)}")
 
 
+@router.post("/batch")
+async def insert_expenses_batch(
+    notifications: List[NotificationRequest],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Insert a batch of queued notifications with one multi-row INSERT ... ON CONFLICT DO NOTHING.
+
+    Returns one status entry per input item, in the same order:
+    ``filtered``, ``duplicate`` or ``inserted``.
+    """
+    logger.info(f"Received batch of {len(notifications)} notifications")
+
+    results: list[dict] = [{"index": i} for i in range(len(notifications))]
+    pending: list[tuple[int, dict]] = []
+    for i, notification in enumerate(notifications):
+        reason = _filter_reason(notification)
+        if reason:
+            results[i].update(status="filtered", message=reason, package_name=notification.packageName)
+        else:
+            pending.append((i, _build_expense_values(notification)))
+
+    try:
+        to_insert: list[tuple[int, dict]] = []
+        seen_in_batch: dict[str, int] = {}
+        for i, values in pending:
+            key = values["dedup_key"] = dedup_key(values["post_time"], values["amount"])
+            if key in seen_in_batch:
+                results[i].update(status="duplicate", duplicate_of=seen_in_batch[key])
+            else:
+                seen_in_batch[key] = i
+                to_insert.append((i, values))
+
+        if to_insert:
+            inserted = {row.dedup_key: row for row in (await db.execute(
+                _insert_new(), [values for _, values in to_insert],
+            )).all()}
+            # The skipped rows are already stored: read their ids back
+            stored = {}
+            skipped = [values["dedup_key"] for _, values in to_insert if values["dedup_key"] not in inserted]
+            if skipped:
+                stored = {row.dedup_key: row for row in (await db.execute(
+                    select(Expense.id, Expense.created_at, Expense.dedup_key).where(Expense.dedup_key.in_(skipped))
+                )).all()}
+            await db.commit()
+            for i, values in to_insert:
+                row = inserted.get(values["dedup_key"])
+                if row is None:
+                    results[i].update(status="duplicate", **_stored(stored[values["dedup_key"]]))
+                    continue
+                results[i].update(status="inserted", **_stored(row))
+                broadcaster.publish("expense", Expense(**values, id=row.id, created_at=row.created_at).to_dict())
+            logger.info(f"INSERTED: {len(inserted)} notifications saved from batch of {len(notifications)}")
+
+            if any(_is_carrefour(notifications[i]) for i, values in to_insert if values["dedup_key"] in inserted):
+                ticket_watcher.trigger()
+
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to insert notifications: {str(e)}")
+
+    return {
+        "status": "success",
+        "count": len(results),
+        "inserted": sum(1 for r in results if r["status"] == "inserted"),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "filtered": sum(1 for r in results if r["status"] == "filtered"),
+        "data": results,
+    }
+
+
 @router.get("")
-async def get_notifications(limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
-    """Get all notifications with pagination"""
+async def get_notifications(
+    limit: int = 100,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    since: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get all notifications with pagination
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to fetch the following page
+    with keyset pagination on ``(post_time, id)``; ``offset`` is ignored then.
+
+    Pass a previous ``watermark`` as ``since`` to get only the rows inserted
+    after it (oldest first) and the new watermark. ``has_more`` tells the
+    poller to ask again straight away. The watermark stays behind the rows
+    inserted in the last ``EXPENSES_WATERMARK_LAG`` seconds, which are
+    returned again by the next poll, so pollers must dedupe by id.
+    """
+    condition = after_cursor(Expense.post_time, Expense.id, cursor) if cursor else None
     try:
-        expenses = (
-            db.query(Expense)
-            .order_by(Expense.post_time.desc())
-            .offset(offset)
-            .limit(limit)
-            .all()
-        )
+        if since is not None:
+            rows = (await db.execute(
+                select(Expense, _settled())
+                .where(Expense.id > since)
+                .order_by(Expense.id.asc())
+                .limit(limit)
+            )).all()
+            settled = [expense for expense, _ in itertools.takewhile(lambda row: row.settled, rows)]
+            return {
+                "status": "success",
+                "count": len(rows),
+                "watermark": settled[-1].id if settled else since,
+                "has_more": len(rows) == limit and len(settled) == len(rows),
+                "data": [expense.to_dict() for expense, _ in rows],
+            }
+
+        # Read the watermark before the page so no row can fall between the two
+        recent = (await db.execute(
+            select(Expense.id, _settled()).order_by(Expense.id.desc()).limit(WATERMARK_WINDOW)
+        )).all()
+        unsettled = [row.id for row in recent if not row.settled]
+        watermark = min(unsettled) - 1 if unsettled else (recent[0].id if recent else 0)
+
+        query = select(Expense)
+        if condition is not None:
+            query = query.where(condition)
+        query = query.order_by(*keyset_order(Expense.post_time, Expense.id))
+        if condition is None:
+            query = query.offset(offset)
+        expenses = (await db.execute(query.limit(limit))).scalars().all()
 
         return {
             "status": "success",
             "count": len(expenses),
-            "data": [
-                {
-                    "id": e.id,
-                    "text": e.text,
-                    "latitude": e.latitude,
-                    "longitude": e.longitude,
-                    "postTime": e.post_time.isoformat() if e.post_time else None,
-                    "category": e.category,
-                    "amount": float(e.amount) if e.amount is not None else None,
-                    "currency": e.currency,
-                    "shopName": e.shop_name,
-                    "createdAt": e.created_at.isoformat() if e.created_at else None,
-                }
-                for e in expenses
-            ],
+            "next_cursor": next_cursor(expenses, limit, "post_time"),
+            "watermark": watermark,
+            "data": [e.to_dict() for e in expenses],
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch notifications: {str(e)}")
 
 
+@router.get("/stream")
+async def stream_expenses(request: Request):
+    """Server-Sent Events stream: ``expense`` on every inserted notification, ``purchase`` on every saved Carrefour ticket"""
+    return StreamingResponse(
+        broadcaster.stream(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.put("")
-async def update_notifications(limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
-    """Re-calculate and update amount/currency for existing rows"""
+async def update_notifications(limit: int = 100, offset: int = 0, db: AsyncSession = Depends(get_async_db)):
+    """Re-calculate and update amount/currency for existing rows
+
+    The dedup key follows the corrected amount. A row whose new key already
+    belongs to another row would duplicate it, so it is left as is and reported
+    under ``skipped``.
+    """
     try:
-        expenses = (
-            db.query(Expense)
+        rows = (await db.execute(
+            select(Expense.id, Expense.text, Expense.post_time, Expense.dedup_key)
             .order_by(Expense.post_time.desc())
             .offset(offset)
             .limit(limit)
-            .all()
-        )
-
-        updated = []
-        for expense in expenses:
-            amount, currency = extract_amount(expense.text or "")
-            if amount is not None and amount > 0:
-                expense.amount = amount
-                expense.currency = currency
-                updated.append({"id": expense.id, "amount": amount, "currency": currency})
-
-        db.commit()
+        )).all()
+
+        updated, skipped = [], []
+        for row in rows:
+            amount, currency = extract_amount(row.text or "")
+            if amount is None or amount <= 0:
+                continue
+            values = {"amount": amount, "currency": currency}
+            # Rows left unkeyed (duplicates found when the key was introduced) stay unkeyed
+            if row.dedup_key is not None:
+                values["dedup_key"] = dedup_key(row.post_time, amount)
+            try:
+                async with db.begin_nested():
+                    await db.execute(update(Expense).where(Expense.id == row.id).values(**values))
+            except IntegrityError:
+                skipped.append({"id": row.id, "amount": amount, "currency": currency, "reason": "duplicate"})
+                continue
+            updated.append({"id": row.id, "amount": amount, "currency": currency})
+
+        await db.commit()
 
         return {
             "status": "success",
             "updated_count": len(updated),
             "data": updated,
+            "skipped": skipped,
         }
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update expenses: {str(e)}")
 
 
 @router.post("/test/insert")
-async def test_insert_carrefour_ticket(
-    background_tasks: BackgroundTasks,
-):
-    background_tasks.add_task(CarrefourClient.save_last_ticket)
+async def test_insert_carrefour_ticket():
+    ticket_watcher.trigger()
     return "OK"
\ No newline at end of file
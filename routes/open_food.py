@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
@@ -17,14 +19,11 @@ def get_off_by_code(code: str):
 
 
 @router.get("/list")
-def get_off_list(db: Session = Depends(get_db)):
-    hs_list = []
+async def get_off_list(db: Session = Depends(get_db)):
     try:
-        products = db.query(Product).all()
-        for p in products:
-            data = OpenFoodFacts().get_product(p.code)
-            hs_list.append(data)
-        return hs_list
+        codes = await asyncio.to_thread(lambda: [p.code for p in db.query(Product).all()])
+        scores = await OpenFoodFacts().get_products(codes)
+        return [scores.get(code) for code in codes]
     except Exception as e:
-        db.rollback()
+        await asyncio.to_thread(db.rollback)
         raise HTTPException(status_code=500, detail=f"Failed to update expenses: {str(e)}")
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
 from database import get_db
+from categorization import categorization_job
 from models import Product
 
 
@@ -16,11 +17,23 @@ def get_off_by_code(code: str, db: Session = Depends(get_db)):
 
 
 @router.get("/category/list")
-def get_category_by_list(db: Session = Depends(get_db)):
-    products = db.query(Product).where(and_(Product.category.is_(None))).all()
-    for idx, p in enumerate(products):
-        p.get_category()
-    return "OK"
+async def get_category_by_list():
+    """Start categorizing every uncategorized product in the background (see /category/job)"""
+    categorization_job.start()
+    return categorization_job.to_dict()
+
+
+@router.post("/category/job", status_code=202)
+async def start_category_job():
+    """Start a background categorization run; returns its progress"""
+    started = categorization_job.start()
+    return {"status": "success", "started": started, "job": categorization_job.to_dict()}
+
+
+@router.get("/category/job")
+async def get_category_job():
+    """Progress of the current or last categorization run"""
+    return {"status": "success", "job": categorization_job.to_dict()}
 
 @router.get("/category/{code}")
 def get_category_by_code(code: str, db: Session = Depends(get_db)):
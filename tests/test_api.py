@@ -1,16 +1,33 @@
 """Tests for FastAPI endpoints in main.py"""
+import threading
+from collections import namedtuple
 from datetime import datetime
-from unittest.mock import MagicMock
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from main import app
-from database import get_db
+from database import Base, get_async_db, get_db
+from models import Expense, HealthScore, Product, Purchase
+from pagination import decode_cursor, encode_cursor
+from routes.expenses import dedup_key
 
 client = TestClient(app)
 
 
 # ─── Helpers ─────────────────────────────────────────────────────────────────
 
+# Row of a ``GET /expenses?since=`` query: the expense and whether it is settled
+SinceRow = namedtuple("SinceRow", "Expense settled")
+
+
 def _override_db(db):
     """Return a FastAPI dependency override that yields the given mock session."""
     def _override():
@@ -18,6 +35,38 @@ def _override_db(db):
     return _override
 
 
+def _override_async_db(db):
+    """Return a FastAPI dependency override that yields the given mock async session."""
+    async def _override():
+        yield db
+    return _override
+
+
+def _result(rows=(), scalar=None):
+    """Mock Result of ``await db.execute(...)``: rows for all()/scalars(), or one scalar()."""
+    result = MagicMock()
+    result.all.return_value = list(rows)
+    result.first.return_value = result.one.return_value = rows[0] if rows else None
+    result.scalars.return_value.all.return_value = list(rows)
+    result.scalars.return_value.first.return_value = rows[0] if rows else None
+    result.scalar.return_value = scalar
+    return result
+
+
+def _async_db(*results):
+    """Mock AsyncSession whose execute() calls return ``results`` in order."""
+    db = MagicMock()
+    db.execute = AsyncMock(side_effect=list(results) or None, return_value=_result())
+    db.commit = AsyncMock()
+    db.refresh = AsyncMock()
+    db.rollback = AsyncMock()
+    return db
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(compile_kwargs={"literal_binds": True}))
+
+
 # ─── Fixtures ───────────────────────────────────────────────────────────────
 
 VALID_NOTIFICATION = {
@@ -48,8 +97,8 @@ class TestRoot:
 
 class TestHealth:
     def test_health_connected(self):
-        mock_db = MagicMock()
-        app.dependency_overrides[get_db] = _override_db(mock_db)
+        mock_db = _async_db()
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
             response = client.get("/health")
         finally:
@@ -59,11 +108,12 @@ class TestHealth:
         data = response.json()
         assert data["status"] == "healthy"
         assert data["database"] == "connected"
+        mock_db.execute.assert_awaited_once()
 
     def test_health_disconnected(self):
-        mock_db = MagicMock()
+        mock_db = _async_db()
         mock_db.execute.side_effect = Exception("connection refused")
-        app.dependency_overrides[get_db] = _override_db(mock_db)
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
             response = client.get("/health")
         finally:
@@ -78,21 +128,23 @@ class TestHealth:
 # ─── POST /expenses ──────────────────────────────────────────────────────
 
 class TestPostNotification:
-    def _make_insert_db(self, expense_id=42):
-        """Return a mock session that simulates a successful insert."""
-        mock_db = MagicMock()
-
-        def _refresh(obj):
-            obj.id = expense_id
-            obj.created_at = datetime(2024, 1, 1)
-
-        mock_db.refresh.side_effect = _refresh
-        return mock_db
+    def _make_insert_db(self, expense_id=42, existing=None):
+        """Return a mock async session whose INSERT returns the new row, or nothing and then the ``existing`` one."""
+        if existing:
+            return _async_db(_result([]), _result([existing]))
+        return _async_db(_result([MagicMock(id=expense_id, created_at=datetime(2024, 1, 1))]))
+
+    def _post(self, mock_db, payload):
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
+        try:
+            return client.post("/expenses", json=payload)
+        finally:
+            app.dependency_overrides.clear()
 
     def test_filtered_when_not_paid(self):
         """Notifications without 'paid' in text should be filtered."""
         payload = {**VALID_NOTIFICATION, "text": "New message from John"}
-        response = client.post("/expenses", json=payload)
+        response = self._post(_async_db(), payload)
         assert response.status_code == 200
         assert response.json()["status"] == "filtered"
 
@@ -103,22 +155,117 @@ class TestPostNotification:
             "packageName": "com.wallet.app",
             "text": "Paid €10.00 something",
         }
-        response = client.post("/expenses", json=payload)
+        response = self._post(_async_db(), payload)
         assert response.status_code == 200
         assert response.json()["status"] == "filtered"
 
     def test_successful_insert(self):
         """Valid paid expenses should be inserted and return success."""
         mock_db = self._make_insert_db(42)
-        app.dependency_overrides[get_db] = _override_db(mock_db)
+        response = self._post(mock_db, VALID_NOTIFICATION)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "success"
+        assert data["data"] == {"id": 42, "created_at": "2024-01-01T00:00:00"}
+        mock_db.execute.assert_awaited_once()
+        mock_db.commit.assert_awaited_once()
+
+    def test_insert_is_one_statement_keyed_on_the_dedup_key(self):
+        mock_db = self._make_insert_db()
+        self._post(mock_db, VALID_NOTIFICATION)
+
+        stmt, rows = mock_db.execute.call_args.args
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert "ON CONFLICT (dedup_key) DO NOTHING RETURNING" in sql
+        assert rows[0]["dedup_key"] == dedup_key(datetime.fromtimestamp(1700000000), 25.0)
+
+    def test_existing_notification_is_not_inserted_again(self):
+        stored = MagicMock(id=7, created_at=datetime(2024, 1, 1))
+        mock_db = self._make_insert_db(existing=stored)
+        with patch("routes.expenses.broadcaster") as mock_broadcaster:
+            response = self._post(mock_db, VALID_NOTIFICATION)
+
+        assert response.json()["data"]["id"] == 7
+        assert response.json()["message"] == "Notification already stored"
+        mock_db.commit.assert_not_awaited()
+        mock_broadcaster.publish.assert_not_called()
+
+    def _post_with_key(self, mock_db, key="retry-abc"):
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
-            response = client.post("/expenses", json=VALID_NOTIFICATION)
+            return client.post("/expenses", json=VALID_NOTIFICATION, headers={"Idempotency-Key": key})
         finally:
             app.dependency_overrides.clear()
 
+    def test_idempotency_key_header_is_checked_besides_the_derived_key(self):
+        mock_db = _async_db(_result([]), _result([MagicMock(id=42, created_at=datetime(2024, 1, 1))]))
+        response = self._post_with_key(mock_db)
+
+        assert response.json()["data"]["id"] == 42
+        lookup, (insert_stmt, rows) = (c.args for c in mock_db.execute.call_args_list)
+        assert "WHERE expenses.idempotency_key = 'retry-abc'" in _sql(lookup[0])
+        assert "ON CONFLICT (dedup_key) DO NOTHING" in str(insert_stmt.compile(dialect=postgresql.dialect()))
+        assert rows[0]["dedup_key"] == dedup_key(datetime.fromtimestamp(1700000000), 25.0)
+        assert rows[0]["idempotency_key"] == "retry-abc"
+
+    def test_retry_with_a_stored_idempotency_key_is_not_inserted(self):
+        mock_db = _async_db(_result([MagicMock(id=7, created_at=datetime(2024, 1, 1))]))
+        response = self._post_with_key(mock_db)
+
+        assert response.json()["message"] == "Notification already stored"
+        assert response.json()["data"]["id"] == 7
+        mock_db.execute.assert_awaited_once()
+        mock_db.commit.assert_not_awaited()
+
+    def test_derived_key_still_catches_a_retry_with_a_new_idempotency_key(self):
+        mock_db = _async_db(_result([]), _result([]), _result([MagicMock(id=7, created_at=datetime(2024, 1, 1))]))
+        response = self._post_with_key(mock_db, "second-try")
+
+        assert response.json()["data"]["id"] == 7
+        assert "WHERE expenses.dedup_key = " in _sql(mock_db.execute.call_args.args[0])
+        mock_db.commit.assert_not_awaited()
+
+    def test_concurrent_request_with_the_same_idempotency_key(self):
+        conflict = IntegrityError("INSERT", {}, Exception("ux_expenses_idempotency_key"))
+        mock_db = _async_db(_result([]), conflict, _result([MagicMock(id=7, created_at=datetime(2024, 1, 1))]))
+        response = self._post_with_key(mock_db)
+
         assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "success"
+        assert response.json()["data"]["id"] == 7
+        mock_db.rollback.assert_awaited_once()
+
+    def test_unique_violation_outside_the_dedup_key_is_a_409(self):
+        mock_db = _async_db(IntegrityError("INSERT", {}, Exception("expenses_pkey")))
+        response = self._post(mock_db, VALID_NOTIFICATION)
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Duplicate notification"
+        mock_db.rollback.assert_awaited()
+
+    def test_unique_violation_with_an_unknown_idempotency_key_is_a_409(self):
+        conflict = IntegrityError("INSERT", {}, Exception("expenses_pkey"))
+        response = self._post_with_key(_async_db(_result([]), conflict, _result([])))
+        assert response.status_code == 409
+
+    def test_insert_publishes_event(self):
+        mock_db = self._make_insert_db(42)
+        with patch("routes.expenses.broadcaster") as mock_broadcaster:
+            response = self._post(mock_db, VALID_NOTIFICATION)
+
+        assert response.json()["data"]["id"] == 42
+        event, data = mock_broadcaster.publish.call_args.args
+        assert event == "expense"
+        assert data["id"] == 42
+        assert data["amount"] == 25.0
+
+    def test_db_error_rolls_back(self):
+        mock_db = self._make_insert_db()
+        mock_db.commit.side_effect = Exception("db down")
+        response = self._post(mock_db, VALID_NOTIFICATION)
+
+        assert response.status_code == 500
+        mock_db.rollback.assert_awaited_once()
 
     def test_missing_required_field_returns_422(self):
         """Omitting required fields should return validation error."""
@@ -128,54 +275,134 @@ class TestPostNotification:
     def test_case_insensitive_paid_filter(self):
         """'PAID' in uppercase should also pass the filter."""
         mock_db = self._make_insert_db(2)
-        app.dependency_overrides[get_db] = _override_db(mock_db)
         payload = {**VALID_NOTIFICATION, "text": "PAID €5.00 coffee"}
+        response = self._post(mock_db, payload)
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "success"
+
+
+class TestDedupKey:
+    def test_post_time_to_the_microsecond_and_amount_in_cents(self):
+        assert dedup_key(datetime(2024, 1, 1, 12, 0, 0, 500), Decimal("25")) == "2024-01-01T12:00:00.000500|25.00"
+        assert dedup_key(datetime(2024, 1, 1), 3.2) == dedup_key(datetime(2024, 1, 1), Decimal("3.20"))
+
+    def test_missing_amount(self):
+        assert dedup_key(datetime(2024, 1, 1), None) == "2024-01-01T00:00:00.000000|"
+
+
+# ─── POST /expenses/batch ────────────────────────────────────────────────
+
+class TestPostNotificationBatch:
+    def _make_batch_db(self, inserted=(), existing=()):
+        """Return a mock async session whose INSERT returns ``inserted`` and whose lookup returns ``existing``.
+
+        Both are (id, dedup key) pairs.
+        """
+        def rows(pairs):
+            return _result([MagicMock(id=i, dedup_key=key, created_at=datetime(2024, 1, 1)) for i, key in pairs])
+        return _async_db(rows(inserted), rows(existing))
+
+    def _post(self, mock_db, payload):
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
-            response = client.post("/expenses", json=payload)
+            return client.post("/expenses/batch", json=payload)
         finally:
             app.dependency_overrides.clear()
 
+    def test_statuses_per_item(self):
+        stored_key = dedup_key(datetime.fromtimestamp(1700000000), 25.0)
+        new_key = dedup_key(datetime.fromtimestamp(1700000060), 3.2)
+        mock_db = self._make_batch_db(inserted=[(100, new_key)], existing=[(7, stored_key)])
+        payload = [
+            VALID_NOTIFICATION,
+            {**VALID_NOTIFICATION, "text": "New message from John"},
+            {**VALID_NOTIFICATION, "postTime": 1700000060000, "text": "Paid €3.20 at Cafe Zurich\n"},
+        ]
+        response = self._post(mock_db, payload)
+
         assert response.status_code == 200
-        assert response.json()["status"] == "success"
+        data = response.json()
+        assert [r["status"] for r in data["data"]] == ["duplicate", "filtered", "inserted"]
+        assert data["data"][0]["id"] == 7
+        assert data["data"][2]["id"] == 100
+        assert (data["inserted"], data["duplicates"], data["filtered"]) == (1, 1, 1)
+        # One INSERT, and one lookup of the rows it skipped
+        assert mock_db.execute.await_count == 2
+        assert [r["dedup_key"] for r in mock_db.execute.call_args_list[0].args[1]] == [stored_key, new_key]
+        mock_db.commit.assert_awaited_once()
+
+    def test_duplicates_within_batch_inserted_once(self):
+        key = dedup_key(datetime.fromtimestamp(1700000000), 25.0)
+        mock_db = self._make_batch_db(inserted=[(100, key)])
+        response = self._post(mock_db, [VALID_NOTIFICATION, VALID_NOTIFICATION])
+
+        data = response.json()
+        assert [r["status"] for r in data["data"]] == ["inserted", "duplicate"]
+        assert data["data"][1]["duplicate_of"] == 0
+        # Nothing was skipped, so there is no lookup
+        mock_db.execute.assert_awaited_once()
+        rows = mock_db.execute.call_args.args[1]
+        assert len(rows) == 1
+        assert rows[0]["amount"] == 25.0
+        assert rows[0]["category"] == "grocery"
+
+    def test_all_filtered_skips_db(self):
+        mock_db = self._make_batch_db()
+        payload = [{**VALID_NOTIFICATION, "packageName": "com.wallet.app"}]
+        response = self._post(mock_db, payload)
+
+        assert response.json()["filtered"] == 1
+        mock_db.execute.assert_not_called()
+
+    def test_db_error_returns_500(self):
+        mock_db = self._make_batch_db()
+        mock_db.execute.side_effect = Exception("db down")
+        response = self._post(mock_db, [VALID_NOTIFICATION])
+
+        assert response.status_code == 500
+        mock_db.rollback.assert_awaited_once()
 
 
 # ─── GET /expenses ────────────────────────────────────────────────────
 
 class TestGetNotifications:
     def _make_expense(self, id=1):
-        e = MagicMock()
-        e.id = id
-        e.text = "Paid €10.00 at Shop"
-        e.latitude = 41.38
-        e.longitude = 2.17
-        e.post_time = datetime(2024, 1, 1)
-        e.category = "grocery"
-        e.amount = 10.0
-        e.currency = "€"
-        e.shop_name = "Shop"
-        e.created_at = datetime(2024, 1, 1)
-        return e
-
-    def _make_query_db(self, expenses):
-        mock_db = MagicMock()
-        (
-            mock_db.query.return_value
-            .order_by.return_value
-            .offset.return_value
-            .limit.return_value
-            .all.return_value
-        ) = expenses
-        return mock_db
-
-    def test_get_notifications_success(self):
-        expenses = [self._make_expense(1), self._make_expense(2)]
-        mock_db = self._make_query_db(expenses)
-        app.dependency_overrides[get_db] = _override_db(mock_db)
+        return Expense(
+            id=id,
+            text="Paid €10.00 at Shop",
+            latitude=41.38,
+            longitude=2.17,
+            post_time=datetime(2024, 1, 1),
+            category="grocery",
+            amount=10.0,
+            currency="€",
+            shop_name="Shop",
+            created_at=datetime(2024, 1, 1),
+        )
+
+    def _make_query_db(self, expenses, watermark=7):
+        """Mock async session answering the watermark (from one settled row), then the page."""
+        return _async_db(_result([MagicMock(id=watermark, settled=True)]), _result(expenses))
+
+    def _since_rows(self, *rows):
+        """(expense, settled) rows of a ``since`` poll."""
+        return _result([SinceRow(e, settled) for e, settled in rows])
+
+    def _get(self, mock_db, url):
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
-            response = client.get("/expenses")
+            return client.get(url)
         finally:
             app.dependency_overrides.clear()
 
+    def _page_query(self, mock_db):
+        return mock_db.execute.call_args_list[-1].args[0]
+
+    def test_get_notifications_success(self):
+        expenses = [self._make_expense(1), self._make_expense(2)]
+        response = self._get(self._make_query_db(expenses), "/expenses")
+
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "success"
@@ -183,35 +410,408 @@ class TestGetNotifications:
         assert len(data["data"]) == 2
 
     def test_get_notifications_empty(self):
+        response = self._get(self._make_query_db([]), "/expenses")
+
+        assert response.status_code == 200
+        assert response.json()["count"] == 0
+
+    def test_get_notifications_pagination_params(self):
         mock_db = self._make_query_db([])
-        app.dependency_overrides[get_db] = _override_db(mock_db)
+        response = self._get(mock_db, "/expenses?limit=10&offset=5")
+
+        assert response.status_code == 200
+        assert "LIMIT 10 OFFSET 5" in _sql(self._page_query(mock_db))
+
+    def test_get_notifications_next_cursor(self):
+        expenses = [self._make_expense(1), self._make_expense(2)]
+        response = self._get(self._make_query_db(expenses), "/expenses?limit=2")
+
+        cursor = response.json()["next_cursor"]
+        assert decode_cursor(cursor) == (datetime(2024, 1, 1), 2)
+
+    def test_get_notifications_cursor_after_a_row_without_post_time(self):
+        undated = self._make_expense(5)
+        undated.post_time = None
+        mock_db = self._make_query_db([self._make_expense(6), undated])
+        response = self._get(mock_db, "/expenses?limit=2")
+
+        cursor = response.json()["next_cursor"]
+        assert decode_cursor(cursor) == (None, 5)
+        # The next page: the remaining undated rows, then every dated one
+        mock_db = self._make_query_db([])
+        self._get(mock_db, f"/expenses?limit=2&cursor={cursor}")
+        where = _sql(self._page_query(mock_db).whereclause)
+        assert "expenses.post_time IS NOT NULL OR expenses.post_time IS NULL AND expenses.id < 5" in where
+
+    def test_get_notifications_last_page_has_no_cursor(self):
+        response = self._get(self._make_query_db([self._make_expense(1)]), "/expenses?limit=2")
+
+        assert response.json()["next_cursor"] is None
+
+    def test_get_notifications_with_cursor_skips_offset(self):
+        mock_db = self._make_query_db([self._make_expense(3)], watermark=3)
+        cursor = encode_cursor(datetime(2024, 1, 1), 2)
+        response = self._get(mock_db, f"/expenses?limit=10&offset=5&cursor={cursor}")
+
+        assert response.status_code == 200
+        assert response.json()["count"] == 1
+        query = self._page_query(mock_db)
+        assert "OFFSET" not in _sql(query)
+        assert "LIMIT 10" in _sql(query)
+        assert query.whereclause.compile().params == {"param_1": datetime(2024, 1, 1), "param_2": 2}
+
+    def test_get_notifications_invalid_cursor(self):
+        response = client.get("/expenses?cursor=not-a-cursor")
+        assert response.status_code == 400
+
+    def test_get_notifications_returns_watermark(self):
+        response = self._get(self._make_query_db([self._make_expense(1)]), "/expenses")
+
+        assert response.json()["watermark"] == 7
+
+    def test_get_notifications_since_watermark(self):
+        mock_db = _async_db(self._since_rows((self._make_expense(8), True), (self._make_expense(9), True)))
+        response = self._get(mock_db, "/expenses?since=7&limit=2")
+
+        data = response.json()
+        assert [e["id"] for e in data["data"]] == [8, 9]
+        assert data["watermark"] == 9
+        assert data["has_more"] is True
+        assert self._page_query(mock_db).whereclause.compile().params == {"id_1": 7}
+
+    def test_watermark_stops_before_recent_rows(self):
+        """Row 9 may still have a lower-id neighbour in flight: it is returned, but not passed."""
+        rows = [(self._make_expense(8), True), (self._make_expense(9), False), (self._make_expense(10), True)]
+        response = self._get(_async_db(self._since_rows(*rows)), "/expenses?since=7&limit=3")
+
+        data = response.json()
+        assert [e["id"] for e in data["data"]] == [8, 9, 10]
+        assert data["watermark"] == 8
+        assert data["has_more"] is False
+
+    def test_listing_watermark_stops_before_recent_rows(self):
+        recent = _result([MagicMock(id=12, settled=False), MagicMock(id=11, settled=False), MagicMock(id=10, settled=True)])
+        response = self._get(_async_db(recent, _result([])), "/expenses")
+
+        assert response.json()["watermark"] == 10
+
+    def test_get_notifications_since_no_changes(self):
+        response = self._get(_async_db(_result([])), "/expenses?since=9")
+
+        data = response.json()
+        assert data["count"] == 0
+        assert data["watermark"] == 9
+        assert data["has_more"] is False
+
+    def test_get_notifications_db_error(self):
+        mock_db = _async_db()
+        mock_db.execute.side_effect = Exception("db down")
+        response = self._get(mock_db, "/expenses")
+
+        assert response.status_code == 500
+
+# ─── PUT /expenses ───────────────────────────────────────────────────────
+
+class TestUpdateNotifications:
+    Row = namedtuple("Row", "id text post_time dedup_key")
+
+    def _put(self, mock_db):
+        app.dependency_overrides[get_async_db] = _override_async_db(mock_db)
         try:
-            response = client.get("/expenses")
+            return client.put("/expenses")
         finally:
             app.dependency_overrides.clear()
 
+    def test_dedup_key_follows_the_corrected_amount(self):
+        post_time = datetime(2024, 1, 1, 12)
+        rows = [
+            self.Row(1, "Paid €12,50 at Bar", post_time, dedup_key(post_time, 1250)),
+            self.Row(2, "Paid €3.00 at Shop", post_time, None),
+            self.Row(3, "No amount here", post_time, "k3"),
+        ]
+        mock_db = _async_db(_result(rows), _result(), _result())
+        response = self._put(mock_db)
+
+        assert response.json()["data"] == [
+            {"id": 1, "amount": 12.5, "currency": "€"},
+            {"id": 2, "amount": 3.0, "currency": "€"},
+        ]
+        updates = [c.args[0].compile().params for c in mock_db.execute.call_args_list[1:]]
+        assert updates[0]["dedup_key"] == dedup_key(post_time, 12.5)
+        # Unkeyed duplicates stay unkeyed
+        assert "dedup_key" not in updates[1]
+        mock_db.commit.assert_awaited_once()
+
+    def test_row_whose_new_key_is_taken_is_skipped(self):
+        post_time = datetime(2024, 1, 1, 12)
+        rows = [self.Row(1, "Paid €12,50 at Bar", post_time, "old"), self.Row(2, "Paid €4.00 at Shop", post_time, "k2")]
+        conflict = IntegrityError("UPDATE", {}, Exception("ux_expenses_dedup_key"))
+        mock_db = _async_db(_result(rows), conflict, _result())
+        response = self._put(mock_db)
+
+        data = response.json()
         assert response.status_code == 200
-        assert response.json()["count"] == 0
+        assert [r["id"] for r in data["data"]] == [2]
+        assert data["skipped"] == [{"id": 1, "amount": 12.5, "currency": "€", "reason": "duplicate"}]
+        mock_db.commit.assert_awaited_once()
 
-    def test_get_notifications_pagination_params(self):
-        mock_db = self._make_query_db([])
+
+# ─── GET /expenses/stats ─────────────────────────────────────────────────
+
+class TestExpenseStats:
+    def _get(self, mock_db, url):
         app.dependency_overrides[get_db] = _override_db(mock_db)
         try:
-            response = client.get("/expenses?limit=10&offset=5")
+            return client.get(url)
         finally:
             app.dependency_overrides.clear()
 
+    def test_overview(self):
+        mock_db = MagicMock()
+        filtered = mock_db.query.return_value.filter.return_value
+        filtered.one.return_value = (Decimal("101.00"), 4, Decimal("20.00"))
+        filtered.group_by.return_value.order_by.return_value.all.return_value = [("€", Decimal("100.50"), 4)]
+        filtered.group_by.return_value.order_by.return_value.limit.return_value.all.return_value = []
+        response = self._get(mock_db, "/expenses/stats?from=2024-01-01T00:00:00.000Z")
+
         assert response.status_code == 200
-        mock_db.query.return_value.order_by.return_value.offset.assert_called_once_with(5)
-        mock_db.query.return_value.order_by.return_value.offset.return_value.limit.assert_called_once_with(10)
+        data = response.json()
+        assert data["summary"] == {"total": 101.0, "count": 4, "avg": 25.25, "month": 20.0, "currency": "€"}
+        assert data["currencies"] == [{"currency": "€", "total": 100.5, "count": 4}]
+        assert data["shops"] == []
+        assert data["monthly"] == []
 
-    def test_get_notifications_db_error(self):
+    def test_overview_empty(self):
+        mock_db = MagicMock()
+        filtered = mock_db.query.return_value.filter.return_value
+        filtered.one.return_value = (None, 0, None)
+        filtered.group_by.return_value.order_by.return_value.all.return_value = []
+        filtered.group_by.return_value.order_by.return_value.limit.return_value.all.return_value = []
+        response = self._get(mock_db, "/expenses/stats")
+
+        assert response.json()["summary"] == {"total": 0.0, "count": 0, "avg": 0.0, "month": 0.0, "currency": None}
+
+    def test_categories(self):
+        mock_db = MagicMock()
+        (
+            mock_db.query.return_value.filter.return_value
+            .group_by.return_value.order_by.return_value.all.return_value
+        ) = [("grocery", Decimal("80.00"), 3), ("other", Decimal("5.25"), 1)]
+        response = self._get(mock_db, "/expenses/stats/categories")
+
+        assert response.json()["data"] == [
+            {"name": "grocery", "total": 80.0, "count": 3},
+            {"name": "other", "total": 5.25, "count": 1},
+        ]
+
+    def test_timeseries_oldest_first(self):
+        mock_db = MagicMock()
+        (
+            mock_db.query.return_value.filter.return_value
+            .group_by.return_value.order_by.return_value.limit.return_value.all.return_value
+        ) = [(datetime(2024, 2, 1), Decimal("10"), 1), (datetime(2024, 1, 1), Decimal("20"), 2)]
+        response = self._get(mock_db, "/expenses/stats/timeseries?period=month&limit=2")
+
+        data = response.json()["data"]
+        assert [d["period"] for d in data] == ["2024-01-01T00:00:00", "2024-02-01T00:00:00"]
+        mock_db.query.return_value.filter.return_value.group_by.return_value.order_by.return_value.limit.assert_called_once_with(2)
+
+    def test_timeseries_rejects_unknown_period(self):
+        response = client.get("/expenses/stats/timeseries?period=year")
+        assert response.status_code == 422
+
+    def test_invalid_date_returns_400(self):
+        response = client.get("/expenses/stats/shops?from=yesterday")
+        assert response.status_code == 400
+
+    def test_db_error_returns_500(self):
         mock_db = MagicMock()
         mock_db.query.side_effect = Exception("db down")
+        response = self._get(mock_db, "/expenses/stats/currencies")
+        assert response.status_code == 500
+
+
+# ─── GET /expenses/geo ───────────────────────────────────────────────────
+
+class TestExpenseGeo:
+    def _get(self, mock_db, url):
         app.dependency_overrides[get_db] = _override_db(mock_db)
         try:
-            response = client.get("/expenses")
+            return client.get(url)
         finally:
             app.dependency_overrides.clear()
 
-        assert response.status_code == 500
\ No newline at end of file
+    def test_points_at_high_zoom(self):
+        mock_db = MagicMock()
+        (
+            mock_db.query.return_value.filter.return_value
+            .order_by.return_value.limit.return_value.all.return_value
+        ) = [Expense(id=1, latitude=41.38, longitude=2.17, amount=10.0)]
+        response = self._get(mock_db, "/expenses/geo?bbox=2.0,41.0,2.5,41.5&zoom=15")
+
+        data = response.json()
+        assert data["mode"] == "points"
+        assert data["data"][0]["id"] == 1
+        condition = mock_db.query.return_value.filter.call_args.args[0]
+        assert condition.compile().params == {"point_1": 2.0, "point_2": 41.0, "point_3": 2.5, "point_4": 41.5}
+
+    def test_clusters_at_low_zoom(self):
+        mock_db = MagicMock()
+        (
+            mock_db.query.return_value.filter.return_value
+            .group_by.return_value.order_by.return_value.limit.return_value.all.return_value
+        ) = [(3, Decimal("30.50"), 41.38, 2.17)]
+        response = self._get(mock_db, "/expenses/geo?bbox=-10,35,5,44&zoom=6&limit=50")
+
+        data = response.json()
+        assert data["mode"] == "clusters"
+        assert data["data"] == [{"count": 3, "amount": 30.5, "latitude": 41.38, "longitude": 2.17}]
+        grouped = mock_db.query.return_value.filter.return_value.group_by.return_value
+        order = [str(c) for c in grouped.order_by.call_args.args]
+        assert order[0] == "count(expenses.id) DESC"
+        grouped.order_by.return_value.limit.assert_called_once_with(50)
+
+    def test_invalid_bbox(self):
+        assert client.get("/expenses/geo?bbox=1,2,3").status_code == 400
+        assert client.get("/expenses/geo?bbox=5,2,3,4").status_code == 400
+
+    def test_bbox_required(self):
+        assert client.get("/expenses/geo").status_code == 422
+
+
+# ─── GET /carrefour/purchases ────────────────────────────────────────────────
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+class TestCarrefourPurchases:
+    """Runs against an in-memory SQLite copy of the Carrefour tables to count queries."""
+
+    def _db(self, purchases: int):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine, tables=[Purchase.__table__, Product.__table__, HealthScore.__table__])
+        db = sessionmaker(bind=engine)()
+        for n in range(purchases):
+            purchase = Purchase(ticket_id=f"T{n}", date=datetime(2025, 1, 1 + n), name="Carrefour",
+                                net_amount=Decimal("10.00"), number_items=2)
+            purchase.products = [
+                Product(ticket_id=f"T{n}", code=f"84{n}1", description="LECHE", net_amount=Decimal("1.00"), category="Dairy & Eggs"),
+                Product(ticket_id=f"T{n}", code=f"84{n}2", description="PAN", net_amount=Decimal("9.00")),
+            ]
+            db.add(purchase)
+            db.add(HealthScore(barcode=f"84{n}1", total_score=80.0, scoring_version=1))
+        db.commit()
+        db.expunge_all()
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        return db, statements
+
+    def _get(self, db, url):
+        app.dependency_overrides[get_db] = _override_db(db)
+        try:
+            return client.get(url)
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_full_view_query_count_does_not_grow_with_count(self):
+        counts = []
+        for purchases in (2, 6):
+            db, statements = self._db(purchases)
+            response = self._get(db, f"/carrefour/purchases?count={purchases}")
+            assert response.json()["count"] == purchases
+            counts.append(len(statements))
+        assert counts[0] == counts[1] == 3
+
+        data = response.json()["data"]
+        assert [p["ticketId"] for p in data][:2] == ["T5", "T4"]
+        assert [len(p["products"]) for p in data] == [2] * 6
+        assert data[0]["products"][0]["healthScore"]["total_score"] == 80.0
+        assert data[0]["products"][1]["healthScore"] is None
+
+    def test_summary_view_returns_headers_and_aggregates(self):
+        db, statements = self._db(4)
+        response = self._get(db, "/carrefour/purchases?count=4&view=summary")
+
+        assert len(statements) == 2
+        first = response.json()["data"][0]
+        assert "products" not in first
+        assert first["ticketId"] == "T3"
+        assert first["productCount"] == 2
+        assert first["categorizedCount"] == 1
+        assert first["scoredCount"] == 1
+        assert first["meanProductScore"] == 80.0
+
+    def test_summary_view_without_aggregates(self):
+        db, statements = self._db(3)
+        response = self._get(db, "/carrefour/purchases?view=summary&aggregates=false")
+
+        assert len(statements) == 1
+        assert set(response.json()["data"][0]) == {"id", "ticketId", "date", "name", "netAmount", "numberItems", "healthScore"}
+
+    def test_cursor_walks_every_page_once(self):
+        db, _ = self._db(5)
+        seen, cursor = [], None
+        while True:
+            response = self._get(db, "/carrefour/purchases?count=2&view=summary&aggregates=false"
+                                     + (f"&cursor={cursor}" if cursor else ""))
+            seen += [p["ticketId"] for p in response.json()["data"]]
+            cursor = response.json()["next_cursor"]
+            if not cursor:
+                break
+        assert seen == ["T4", "T3", "T2", "T1", "T0"]
+
+    def test_invalid_cursor_returns_400(self):
+        assert self._get(MagicMock(), "/carrefour/purchases?cursor=garbage").status_code == 400
+
+    def test_unknown_view_returns_422(self):
+        assert self._get(MagicMock(), "/carrefour/purchases?view=nested").status_code == 422
+
+
+# ─── GET /carrefour/purchase/score/{ticket_id} ──────────────────────────────
+
+class TestPurchaseScore:
+    def _get(self, db, url):
+        app.dependency_overrides[get_db] = _override_db(db)
+        try:
+            return client.get(url)
+        finally:
+            app.dependency_overrides.clear()
+
+    def test_database_work_runs_off_the_event_loop(self):
+        threads = {}
+        purchase = MagicMock(products=[MagicMock(code="8410"), MagicMock(code="8420")])
+        purchase.to_header_dict.return_value = {"ticketId": "T1"}
+        mock_db = MagicMock()
+        mock_db.query.return_value.options.return_value.where.return_value.first.return_value = purchase
+
+        def record(name, result=None):
+            def call(*args):
+                threads[name] = threading.get_ident()
+                return result
+            return call
+
+        mock_db.query.side_effect = record("query", mock_db.query.return_value)
+        mock_db.commit.side_effect = record("commit")
+
+        async def get_products(codes):
+            threads["loop"] = threading.get_ident()
+            return {}
+
+        with patch("routes.carrefour.OpenFoodFacts") as off, patch("routes.carrefour.rollups") as rollups:
+            off.return_value.get_products = AsyncMock(side_effect=get_products)
+            response = self._get(mock_db, "/carrefour/purchase/score/T1")
+
+        assert response.json() == {"ticketId": "T1"}
+        off.return_value.get_products.assert_awaited_once_with(["8410", "8420"])
+        rollups.refresh_purchases.assert_called_once_with(mock_db, ["T1"])
+        assert threads["loop"] not in (threads["query"], threads["commit"])
+
+    def test_unknown_ticket(self):
+        mock_db = MagicMock()
+        mock_db.query.return_value.options.return_value.where.return_value.first.return_value = None
+        with patch("routes.carrefour.OpenFoodFacts") as off:
+            response = self._get(mock_db, "/carrefour/purchase/score/T9")
+        assert response.status_code == 404
+        off.assert_not_called()
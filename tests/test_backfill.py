@@ -0,0 +1,164 @@
+"""Tests for backfill.py"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+import backfill
+from backfill import BackfillJob, next_offsets
+from models.carrefour_client import CarrefourClient
+
+TICKETS = [f"T{n}" for n in range(7)]
+
+
+def _client(tickets=TICKETS, fail=()):
+    """Carrefour list paged by ticketOffset, and details of every ticket not in ``fail``."""
+    client = MagicMock()
+
+    def get_purchases(from_date, to_date, count, offsets):
+        start = int(offsets.get("ticketOffset", 0))
+        return {"purchases": [{"purchaseId": t} for t in tickets[start:start + count]]}
+
+    def get_purchase(purchase_id):
+        if purchase_id in fail:
+            raise RuntimeError("502")
+        return SimpleNamespace(ticket_id=purchase_id, products=[SimpleNamespace(code=f"84{purchase_id}")])
+
+    client.get_purchases.side_effect = get_purchases
+    client.get_purchase.side_effect = get_purchase
+    return client
+
+
+def _job(client, saved=(), checkpoint=None, page_size=3, chunk_size=2):
+    job = BackfillJob("2024-01-01", "2026-01-01", page_size=page_size, concurrency=2, rpm=60000,
+                      chunk_size=chunk_size, client_factory=lambda: client)
+    job.unsaved = MagicMock(side_effect=lambda ids: [i for i in ids if i not in saved])
+    job.save = MagicMock(side_effect=lambda purchases: len(purchases))
+    job.load_checkpoint = MagicMock(return_value=checkpoint)
+    job.save_checkpoint = MagicMock()
+    return job
+
+
+def _run(job):
+    asyncio.run(job.run())
+
+
+class TestNextOffsets:
+    def test_uses_the_offsets_returned_with_the_page(self):
+        listing = {"purchases": [], "ticketOffset": 12, "atgfOffset": 3, "unrelated": 1}
+        assert next_offsets({"ticketOffset": "0"}, listing, 10) == {"ticketOffset": "12", "atgfOffset": "3"}
+
+    def test_moves_the_ticket_offset_otherwise(self):
+        assert next_offsets({"ticketOffset": "10", "atgfOffset": "2"}, {"purchases": []}, 10) == {
+            "ticketOffset": "20", "currentTickets": "20", "atgfOffset": "2",
+        }
+
+    def test_client_sends_the_offsets(self):
+        client = CarrefourClient()
+        client._authorized_get = MagicMock()
+        client.get_purchases(count=50, offsets={"ticketOffset": 100, "bogus": 1})
+        params = client._authorized_get.call_args.kwargs["params"]
+        assert params["ticketOffset"] == "100"
+        assert params["atgfOffset"] == "0"
+        assert params["count"] == "50"
+        assert "bogus" not in params
+
+
+class TestBackfillJob:
+    def test_walks_every_page_and_saves_only_missing_tickets(self):
+        client = _client()
+        job = _job(client, saved={"T1", "T4"})
+        _run(job)
+
+        assert job.status == "done"
+        assert (job.pages, job.listed, job.skipped, job.saved, job.failed) == (3, 7, 2, 5, 0)
+        fetched = sorted(c.args[0] for c in client.get_purchase.call_args_list)
+        assert fetched == ["T0", "T2", "T3", "T5", "T6"]
+        # Chunked transactions of at most chunk_size tickets
+        assert [len(c.args[0]) for c in job.save.call_args_list] == [2, 2, 1]
+        # Checkpoint after every page, the last one marks the range as finished
+        assert [c.args for c in job.save_checkpoint.call_args_list] == [
+            ({"ticketOffset": "3", "currentTickets": "3"}, False),
+            ({"ticketOffset": "6", "currentTickets": "6"}, False),
+            ({"ticketOffset": "7", "currentTickets": "7"}, True),
+        ]
+
+    def test_empty_page_finishes_the_range(self):
+        job = _job(_client(TICKETS[:3]))
+        _run(job)
+        assert job.pages == 1
+        assert job.save_checkpoint.call_args_list[-1].args == ({"ticketOffset": "3", "currentTickets": "3"}, True)
+
+    def test_resumes_from_the_checkpoint(self):
+        client = _client()
+        checkpoint = SimpleNamespace(offsets={"ticketOffset": "6"}, pages=2, saved=6, finished_at=None)
+        job = _job(client, checkpoint=checkpoint)
+        _run(job)
+
+        assert client.get_purchases.call_args_list[0].args[3] == {"ticketOffset": "6"}
+        client.get_purchase.assert_called_once_with("T6")
+
+    def test_finished_checkpoint_starts_over(self):
+        client = _client()
+        checkpoint = SimpleNamespace(offsets={"ticketOffset": "9"}, pages=3, saved=7, finished_at="yesterday")
+        job = _job(client, saved=set(TICKETS), checkpoint=checkpoint)
+        _run(job)
+
+        assert client.get_purchases.call_args_list[0].args[3] == {}
+        client.get_purchase.assert_not_called()
+        assert job.skipped == 7
+
+    def test_failed_details_are_counted_and_skipped(self):
+        job = _job(_client(fail={"T2"}))
+        _run(job)
+        assert job.status == "done"
+        assert (job.saved, job.failed) == (6, 1)
+
+    def test_failure_keeps_the_last_checkpoint(self):
+        job = _job(_client())
+        job.save.side_effect = [2, 1, RuntimeError("db down")]
+        _run(job)
+
+        assert job.status == "failed"
+        assert job.error == "db down"
+        assert len(job.save_checkpoint.call_args_list) == 1
+
+    def test_fetches_concurrently_up_to_the_limit(self):
+        client = _client()
+        fetch = client.get_purchase.side_effect
+        lock = threading.Lock()
+        active = peak = 0
+
+        def slow_fetch(purchase_id):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+            return fetch(purchase_id)
+
+        client.get_purchase.side_effect = slow_fetch
+        job = _job(client, page_size=7)
+        _run(job)
+        assert job.saved == 7
+        assert peak == 2
+
+
+class TestBackfillRoutes:
+    def test_start_and_progress(self):
+        from main import app
+
+        client = TestClient(app)
+        with patch.object(backfill.backfill_job, "start", return_value=True) as start:
+            response = client.post("/carrefour/backfill?from=2024-01-01T00:00:00.000Z&to=2025-01-01T00:00:00.000Z")
+        assert response.status_code == 202
+        assert response.json()["started"] is True
+        start.assert_called_once_with("2024-01-01T00:00:00.000Z", "2025-01-01T00:00:00.000Z")
+
+        response = client.get("/carrefour/backfill")
+        assert response.json()["job"]["status"] == "idle"
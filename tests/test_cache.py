@@ -0,0 +1,100 @@
+"""Tests for cache.py"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import MISSING, SingleFlight, TTLCache
+
+
+class TestTTLCache:
+    def test_get_set(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        assert cache.get("a") is MISSING
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+
+    def test_none_is_a_value(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", None)
+        assert cache.get("a") is None
+
+    def test_expiry(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1, ttl=0.01)
+        time.sleep(0.02)
+        assert cache.get("a", "default") == "default"
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_delete_and_clear(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        assert cache.get("a") is MISSING
+        cache.clear()
+        assert len(cache) == 0
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "done"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do("k", work)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flights.do("k", work))) for _ in range(3)]
+        for t in followers:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in [leader, *followers]:
+            t.join(5)
+        assert calls == [1]
+        assert results == ["done"] * 4
+
+    def test_error_reaches_followers_and_key_is_released(self):
+        flights = SingleFlight()
+        flight, leader = flights.acquire("k")
+        assert leader
+        assert flights.acquire("k") == (flight, False)
+        flights.resolve("k", error=ValueError("boom"))
+        with pytest.raises(ValueError):
+            flight.wait(1)
+        assert flights.do("k", lambda: 2) == 2
+
+    def test_wait_async_wakes_on_resolve_from_thread(self):
+        flights = SingleFlight()
+        flight, _ = flights.acquire("k")
+
+        async def main():
+            threading.Timer(0.05, lambda: flights.resolve("k", 42)).start()
+            return await flight.wait_async(5)
+
+        assert asyncio.run(main()) == 42
+
+    def test_wait_timeout(self):
+        flight, _ = SingleFlight().acquire("k")
+        with pytest.raises(TimeoutError):
+            flight.wait(0.01)
@@ -0,0 +1,84 @@
+"""Tests for models/carrefour_client.py"""
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from models.carrefour_client import CarrefourClient, TokenCache
+
+
+class TestTokenCache:
+    def test_token_reused_until_refresh_margin(self):
+        cache = TokenCache(ttl=1800, refresh_margin=120)
+        fetch = MagicMock(side_effect=["t1", "t2"])
+        assert cache.get(fetch) == "t1"
+        assert cache.get(fetch) == "t1"
+        assert fetch.call_count == 1
+
+    def test_refreshes_inside_margin(self):
+        cache = TokenCache(ttl=0.05, refresh_margin=0.04)
+        fetch = MagicMock(side_effect=["t1", "t2"])
+        assert cache.get(fetch) == "t1"
+        time.sleep(0.02)
+        assert cache.get(fetch) == "t2"
+
+    def test_concurrent_callers_fetch_once(self):
+        cache = TokenCache(ttl=1800, refresh_margin=120)
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return "token"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(slow_fetch))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == ["token"] * 8
+        assert len(calls) == 1
+
+    def test_invalidate_only_matching_token(self):
+        cache = TokenCache(ttl=1800, refresh_margin=120)
+        fetch = MagicMock(side_effect=["t1", "t2"])
+        cache.get(fetch)
+        cache.invalidate("stale")
+        assert cache.get(fetch) == "t1"
+        cache.invalidate("t1")
+        assert cache.get(fetch) == "t2"
+
+
+class TestCarrefourClientAuth:
+    def _client(self, tokens):
+        client = CarrefourClient()
+        client.token_cache = TokenCache(ttl=1800, refresh_margin=120)
+        client.authenticate = MagicMock(side_effect=tokens)
+        return client
+
+    def test_constructor_does_not_log_in(self):
+        client = self._client(["t1"])
+        client.authenticate.assert_not_called()
+
+    def test_clients_share_token(self):
+        login = MagicMock(return_value={"sessionInfo": {"login_token": "lt"}})
+        get_jwt = MagicMock(return_value={"id_token": "t1"})
+        with patch.object(CarrefourClient, "token_cache", TokenCache(ttl=1800, refresh_margin=120)), \
+                patch.object(CarrefourClient, "login", login), patch.object(CarrefourClient, "get_jwt", get_jwt), \
+                patch("models.carrefour_client.http_client.get") as get:
+            get.return_value = MagicMock(status_code=200)
+            first, second = CarrefourClient(), CarrefourClient()
+            first._authorized_get("https://example.test/a")
+            second._authorized_get("https://example.test/b")
+            second._authorized_get("https://example.test/c")
+        assert login.call_count == 1
+        assert get_jwt.call_count == 1
+        assert [c.kwargs["headers"]["authorization"] for c in get.call_args_list] == ["bearer t1"] * 3
+
+    def test_401_refreshes_and_retries_once(self):
+        client = self._client(["t1", "t2"])
+        with patch("models.carrefour_client.http_client.get") as get:
+            get.side_effect = [MagicMock(status_code=401), MagicMock(status_code=200)]
+            response = client._authorized_get("https://example.test/a")
+        assert response.status_code == 200
+        assert get.call_args.kwargs["headers"]["authorization"] == "bearer t2"
@@ -0,0 +1,193 @@
+"""Tests for categorization.py"""
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi.testclient import TestClient
+import pytest
+
+import categorization
+from categorization import CategorizationJob, RateLimiter, parse_categories
+from main import app
+from models.category_cache import CategoryCache
+
+
+class FakeCache(CategoryCache):
+    """CategoryCache backed by a dict instead of the product_categories table."""
+
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+
+    def lookup(self, items):
+        found = {item: next((self.known[k] for k in keys if k in self.known), None) for item, keys in items.items()}
+        return {item: c for item, c in found.items() if c}
+
+    def remember(self, entries):
+        for keys, category in entries:
+            for key in keys:
+                self.known[key] = category
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    fake = FakeCache()
+    monkeypatch.setattr(categorization, "category_cache", fake)
+    return fake
+
+
+def _products(n):
+    return [{"id": i, "description": f"PRODUCT {i}"} for i in range(1, n + 1)]
+
+
+class TestParseCategories:
+    def test_array_keyed_by_id(self):
+        text = json.dumps([
+            {"id": 1, "category": "Fresh Food"},
+            {"id": "2", "category": "beverages"},
+            {"id": 3, "category": "Spaceships"},
+            {"id": 99, "category": "Other"},
+            "junk",
+        ])
+        assert parse_categories(text, {1, 2, 3}) == {1: "Fresh Food", 2: "Beverages"}
+
+    def test_wrapped_object_and_invalid_json(self):
+        assert parse_categories(json.dumps({"products": [{"id": 1, "category": "Pet Care"}]}), {1}) == {1: "Pet Care"}
+        assert parse_categories("not json", {1}) == {}
+
+
+class TestRateLimiter:
+    def test_spaces_calls(self):
+        async def main():
+            limiter = RateLimiter(rate=20, period=1.0)
+            start = time.monotonic()
+            for _ in range(4):
+                await limiter.acquire()
+            return time.monotonic() - start
+
+        assert 0.14 <= asyncio.run(main()) < 0.5
+
+
+def _job(products, categorize=None):
+    job = CategorizationJob(batch_size=3, concurrency=2, rpm=6000)
+    job.pending_products = MagicMock(return_value=products)
+    job.save = MagicMock()
+    job.categorize = categorize or AsyncMock(side_effect=lambda batch: {p["id"]: "Other" for p in batch})
+    return job
+
+
+class TestCategorizationJob:
+    def test_batches_and_bulk_saves(self):
+        job = _job(_products(7))
+        asyncio.run(job.run())
+
+        assert [len(c.args[0]) for c in job.categorize.call_args_list] == [3, 3, 1]
+        assert job.save.call_count == 3
+        assert sorted(i for c in job.save.call_args_list for i in c.args[0]) == list(range(1, 8))
+        assert job.to_dict()["status"] == "done"
+        assert (job.total, job.processed, job.categorized, job.failed) == (7, 7, 7, 0)
+
+    def test_failed_batch_is_counted_and_others_continue(self):
+        async def categorize(batch):
+            if batch[0]["id"] == 1:
+                raise RuntimeError("quota")
+            return {p["id"]: "Other" for p in batch}
+
+        job = _job(_products(6), categorize=categorize)
+        asyncio.run(job.run())
+
+        assert job.status == "done"
+        assert (job.categorized, job.failed) == (3, 3)
+        job.save.assert_called_once()
+
+    def test_concurrency_limit(self):
+        active = {"now": 0, "max": 0}
+
+        async def categorize(batch):
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            await asyncio.sleep(0.02)
+            active["now"] -= 1
+            return {}
+
+        asyncio.run(_job(_products(15), categorize=categorize).run())
+        assert active["max"] == 2
+
+    def test_start_only_once(self):
+        async def main():
+            release = asyncio.Event()
+
+            async def categorize(batch):
+                await release.wait()
+                return {}
+
+            job = _job(_products(1), categorize=categorize)
+            assert job.start() is True
+            assert job.start() is False
+            await asyncio.sleep(0.05)
+            assert job.to_dict()["status"] == "running"
+            release.set()
+            await job._task
+            return job.status
+
+        assert asyncio.run(main()) == "done"
+
+
+class TestCategoryCacheInJob:
+    def test_cached_products_skip_the_model(self, cache):
+        cache.known["code:111"] = "Dairy & Eggs"
+        products = [
+            {"id": 1, "code": "111", "description": "ART 111"},
+            {"id": 2, "code": "222", "description": "ART 222"},
+        ]
+        job = _job(products)
+        asyncio.run(job.run())
+
+        assert [p["id"] for c in job.categorize.call_args_list for p in c.args[0]] == [2]
+        assert job.save.call_args_list[0].args == ({1: "Dairy & Eggs"}, "cache")
+        assert job.save.call_args_list[1].args == ({2: "Other"}, "llm")
+        assert (job.cached, job.categorized, job.llm_calls) == (1, 2, 1)
+        assert cache.known["code:222"] == "Other"
+
+    def test_same_identity_is_sent_once(self, cache):
+        products = [
+            {"id": 1, "code": "111", "description": "ART 111"},
+            {"id": 2, "code": "111", "description": "ART 111"},
+            {"id": 3, "description": "Señor  Óscar", "subFamily": "F1"},
+            {"id": 4, "description": "SENOR OSCAR", "subFamily": "F1"},
+            {"id": 5},
+        ]
+        job = _job(products)
+        asyncio.run(job.run())
+
+        sent = sorted(p["id"] for c in job.categorize.call_args_list for p in c.args[0])
+        assert sent == [1, 3, 5]
+        saved = {i: c for call in job.save.call_args_list for i, c in call.args[0].items()}
+        assert sorted(saved) == [1, 2, 3, 4, 5]
+        assert job.categorized == 5
+        assert cache.known["desc:senor oscar|F1"] == "Other"
+
+    def test_confident_rules_skip_the_model(self):
+        products = [
+            {"id": 1, "description": "LECHE SEMIDESNATADA 1L"},
+            {"id": 2, "description": "CHOCOLATE CON LECHE"},
+        ]
+        job = _job(products)
+        asyncio.run(job.run())
+
+        assert job.save.call_args_list[0].args == ({1: "Dairy & Eggs"}, "rules")
+        assert [p["id"] for c in job.categorize.call_args_list for p in c.args[0]] == [2]
+        assert (job.by_rules, job.llm_calls, job.categorized) == (1, 1, 2)
+
+
+class TestCategoryJobRoutes:
+    def test_post_starts_and_get_reports(self):
+        client = TestClient(app)
+        job = MagicMock()
+        job.start.return_value = True
+        job.to_dict.return_value = {"status": "running", "total": 10}
+        with patch("routes.product.categorization_job", job):
+            response = client.post("/product/category/job")
+            assert response.status_code == 202
+            assert response.json()["started"] is True
+            assert client.get("/product/category/job").json()["job"]["total"] == 10
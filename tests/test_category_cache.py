@@ -0,0 +1,55 @@
+"""Tests for models/category_cache.py"""
+from unittest.mock import MagicMock, patch
+
+from models.category_cache import CategoryCache, normalize_description
+from models.product import Product
+
+
+def test_normalize_description():
+    assert normalize_description("  Plátanos  de CANARIAS, 1kg ") == "platanos de canarias 1kg"
+    assert normalize_description(None) == ""
+
+
+def test_keys_barcode_first_then_description():
+    assert CategoryCache.keys("841", "Leche Entera", "A1") == ["code:841", "desc:leche entera|A1"]
+    assert CategoryCache.keys(None, "Leche", None) == ["desc:leche|"]
+    assert CategoryCache.keys(None, " ", None) == []
+
+
+def test_lookup_first_matching_key_wins():
+    cache = CategoryCache()
+    db = MagicMock()
+    db.execute.return_value.all.return_value = [("code:1", "Beverages"), ("desc:agua|", "Other")]
+    with patch("models.category_cache.SessionLocal", return_value=db):
+        found = cache.lookup({"a": ["code:1", "desc:agua|"], "b": ["code:2", "desc:agua|"], "c": ["code:3"]})
+    assert found == {"a": "Beverages", "b": "Other"}
+    db.execute.assert_called_once()
+
+
+def test_lookup_without_keys_skips_db():
+    with patch("models.category_cache.SessionLocal") as session:
+        assert CategoryCache().lookup({"a": []}) == {}
+    session.assert_not_called()
+
+
+def test_apply_sets_categories_of_seen_products():
+    cache = CategoryCache()
+    seen = Product(code="1", description="Leche")
+    unseen = Product(code="2", description="Pan")
+    done = Product(code="3", category="Pet Care")
+    cache.lookup = MagicMock(side_effect=lambda items: {p: "Dairy & Eggs" for p in items if p.code == "1"})
+
+    assert cache.apply([seen, unseen, done]) == 1
+    assert (seen.category, seen.category_source) == ("Dairy & Eggs", "cache")
+    assert unseen.category is None
+    assert list(cache.lookup.call_args.args[0]) == [seen, unseen]
+
+
+def test_get_category_uses_cache_before_gemini():
+    product = Product(code="1", description="Leche")
+    product.update = MagicMock()
+    with patch("models.category_cache.category_cache.lookup", return_value={product: "Dairy & Eggs"}), \
+         patch("gemini.get_client") as get_client:
+        assert product.get_category() is True
+    assert product.category == "Dairy & Eggs"
+    get_client.assert_not_called()
@@ -0,0 +1,45 @@
+"""Tests for database.py"""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy import event
+
+import database
+
+
+def test_sync_engine_uses_the_configured_pool():
+    pool = database.engine.pool
+    assert pool.size() == database.POOL_SIZE
+    assert pool._max_overflow == database.MAX_OVERFLOW
+    assert pool._pre_ping is database.POOL_PRE_PING
+    assert pool._recycle == database.POOL_RECYCLE
+
+
+def test_async_engine_is_created_once_and_disposed():
+    pytest.importorskip("asyncpg")
+
+    async def scenario():
+        engine = database.get_async_engine()
+        assert database.get_async_engine() is engine
+        assert engine.dialect.driver == "asyncpg"
+        assert engine.pool.size() == database.POOL_SIZE
+        await database.dispose_async_engine()
+        assert database._async_engine is None
+
+    asyncio.run(scenario())
+
+
+def test_statement_timeout_applies_to_request_sessions_only():
+    request_db = next(database.get_db())
+    assert event.contains(request_db, "after_begin", database._limit_statements)
+    assert not event.contains(database.SessionLocal(), "after_begin", database._limit_statements)
+
+    connection = MagicMock()
+    database._limit_statements(request_db, None, connection)
+    connection.exec_driver_sql.assert_called_once_with(f"SET LOCAL statement_timeout = {database.STATEMENT_TIMEOUT}")
+
+
+def test_zero_statement_timeout_sets_nothing():
+    with patch.object(database, "STATEMENT_TIMEOUT", 0):
+        assert not event.contains(next(database.get_db()), "after_begin", database._limit_statements)
@@ -0,0 +1,197 @@
+"""Tests for enrichment.py"""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+
+import enrichment
+from enrichment import EnrichmentQueue, enqueue, retry_delay
+from models.open_food_facts import OpenFoodFacts
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def _queue(jobs=(), **kwargs):
+    """Queue whose claim hands out ``jobs`` ((stage, id, ticket, attempts) tuples) and records state changes."""
+    queue = EnrichmentQueue(concurrency={"score": 2, "categorize": 1}, poll_interval=0.001, **kwargs)
+    pending = list(jobs)
+
+    def claim(stage):
+        for job in pending:
+            if job[0] == stage:
+                pending.remove(job)
+                return job[1:]
+        return None
+
+    queue.claim = MagicMock(side_effect=claim)
+    queue.complete = MagicMock()
+    queue.fail = MagicMock()
+    queue.release = MagicMock()
+    return queue
+
+
+class TestEnqueue:
+    def test_upserts_one_job_per_ticket_and_stage(self):
+        db = MagicMock()
+        enqueue(db, ["T1", "T2", "T1"])
+        stmt, rows = db.execute.call_args.args
+        assert rows == [{"ticket_id": t, "stage": s} for t in ("T1", "T2") for s in ("score", "categorize")]
+        sql = _sql(stmt)
+        assert 'ON CONFLICT ("ticketId", stage) DO UPDATE' in sql
+        # Jobs still pending or running are not queued twice
+        assert "WHERE enrichment_jobs.status IN" in sql
+
+    def test_nothing_to_queue_skips_the_database(self):
+        db = MagicMock()
+        enqueue(db, [])
+        db.execute.assert_not_called()
+
+
+def test_retry_delay_doubles():
+    assert [retry_delay(n, 30) for n in (1, 2, 3, 4)] == [30, 60, 120, 240]
+
+
+class TestClaim:
+    def test_locks_the_next_due_job_skipping_locked_ones(self):
+        job = MagicMock(id=7, ticket_id="T1", attempts=1)
+        db = MagicMock()
+        db.execute.return_value.scalars.return_value.first.return_value = job
+        with patch.object(enrichment, "SessionLocal", return_value=db):
+            assert EnrichmentQueue().claim("score") == (7, "T1", 2)
+
+        sql = _sql(db.execute.call_args.args[0])
+        assert "FOR UPDATE SKIP LOCKED" in sql
+        assert "enrichment_jobs.stage = " in sql
+        assert (job.status, job.attempts) == ("running", 2)
+        db.commit.assert_called_once()
+
+    def test_empty_queue(self):
+        db = MagicMock()
+        db.execute.return_value.scalars.return_value.first.return_value = None
+        with patch.object(enrichment, "SessionLocal", return_value=db):
+            assert EnrichmentQueue().claim("score") is None
+        db.commit.assert_not_called()
+        db.close.assert_called_once()
+
+
+class TestFail:
+    def _values(self, queue, attempts):
+        queue._update = MagicMock()
+        queue.fail(7, attempts, "boom")
+        return queue._update.call_args.kwargs
+
+    def test_retries_later_until_the_last_attempt(self):
+        queue = EnrichmentQueue(max_attempts=3)
+        values = self._values(queue, 2)
+        assert values["status"] == "pending"
+        assert "run_after" in values
+        assert self._values(queue, 3) == {"status": "failed", "locked_at": None, "last_error": "boom"}
+
+
+class TestWorkers:
+    def test_runs_every_due_job_and_records_the_outcome(self):
+        queue = _queue([("score", 1, "T1", 1), ("score", 2, "T2", 5), ("categorize", 3, "T1", 1)], max_attempts=5)
+
+        async def score(ticket_id):
+            if ticket_id == "T2":
+                raise RuntimeError("OFF down")
+
+        queue.score = score
+        queue.categorize = MagicMock(side_effect=lambda t: asyncio.sleep(0))
+        asyncio.run(queue.drain())
+
+        assert sorted(c.args[0] for c in queue.complete.call_args_list) == [1, 3]
+        queue.fail.assert_called_once_with(2, 5, "OFF down")
+        assert queue.to_dict()["processed"]["score"] == {"done": 1, "retried": 0, "failed": 1}
+
+    def test_stage_concurrency_limit(self):
+        queue = _queue([("score", i, f"T{i}", 1) for i in range(6)])
+        active = peak = 0
+
+        async def score(ticket_id):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        queue.score = score
+        asyncio.run(queue.drain(["score"]))
+        assert queue.complete.call_count == 6
+        assert peak == 2
+
+    def test_stop_gives_back_the_running_job(self):
+        queue = _queue([("categorize", 9, "T1", 1)])
+        queue.score = MagicMock()
+        started = asyncio.Event()
+
+        async def categorize(ticket_id):
+            started.set()
+            await asyncio.sleep(10)
+
+        queue.categorize = categorize
+
+        async def scenario():
+            assert queue.start() is True
+            assert queue.start() is False
+            await started.wait()
+            await queue.stop()
+
+        asyncio.run(scenario())
+        queue.release.assert_called_once_with(9)
+        queue.complete.assert_not_called()
+        queue.fail.assert_not_called()
+        assert not queue.running
+
+
+class TestStages:
+    def test_categorize_fails_while_products_are_left(self):
+        queue = EnrichmentQueue()
+        job = MagicMock(status="done", failed=2, total=3)
+        job.run = MagicMock(side_effect=lambda: asyncio.sleep(0))
+        with patch.object(enrichment, "CategorizationJob", return_value=job) as factory:
+            with pytest.raises(RuntimeError, match="2 of 3"):
+                asyncio.run(queue.categorize("T1"))
+        assert factory.call_args.kwargs["ticket_ids"] == ["T1"]
+
+    def test_score_fetches_the_ticket_barcodes_then_refreshes_its_rollup(self):
+        queue = EnrichmentQueue()
+        queue.ticket_codes = MagicMock(return_value=["8410", "8420"])
+        queue.refresh_rollup = MagicMock()
+        with patch.object(enrichment, "OpenFoodFacts") as off:
+            off.return_value.resolve_products = MagicMock(side_effect=lambda codes: asyncio.sleep(0, ({}, set())))
+            asyncio.run(queue.score("T1"))
+        off.return_value.resolve_products.assert_called_once_with(["8410", "8420"])
+        queue.refresh_rollup.assert_called_once_with("T1")
+
+    def test_score_job_is_retried_when_open_food_facts_is_down(self):
+        queue = _queue([("score", 4, "T1", 1)], max_attempts=3)
+        queue.ticket_codes = MagicMock(return_value=["8410", "8420"])
+        queue.refresh_rollup = MagicMock()
+        with patch.multiple(
+            OpenFoodFacts,
+            get_many=MagicMock(return_value={}), get_local=MagicMock(return_value={}),
+            get_misses=MagicMock(return_value={}), fetch_product=MagicMock(side_effect=requests.ConnectionError()),
+        ):
+            asyncio.run(queue.drain(["score"]))
+
+        queue.fail.assert_called_once_with(4, 1, "2 of 2 products could not be fetched from Open Food Facts")
+        queue.complete.assert_not_called()
+        assert queue.to_dict()["processed"]["score"] == {"done": 0, "retried": 1, "failed": 0}
+        # Scores found so far still reach the rollup
+        queue.refresh_rollup.assert_called_once_with("T1")
+
+
+def test_queue_depth_route():
+    from main import app
+
+    depth = {"score": {"pending": 3, "running": 1, "done": 10, "failed": 0}}
+    with patch.object(enrichment.enrichment_queue, "depth", return_value=depth):
+        response = TestClient(app).get("/carrefour/enrichment")
+    assert response.status_code == 200
+    assert response.json()["depth"] == depth
@@ -0,0 +1,137 @@
+"""Tests for events.py"""
+import asyncio
+import json
+import threading
+from unittest.mock import AsyncMock, MagicMock
+
+from events import Broadcaster, PostgresBackend
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class TestBroadcaster:
+    def test_publish_reaches_every_subscriber(self):
+        async def scenario():
+            b = Broadcaster()
+            async with b.subscribe() as q1, b.subscribe() as q2:
+                b.publish("expense", {"id": 1, "amount": 2.5})
+                return q1.get_nowait(), q2.get_nowait()
+
+        frame1, frame2 = _run(scenario())
+        assert frame1 == frame2
+        assert frame1.startswith("event: expense\ndata: ")
+        assert json.loads(frame1.split("data: ", 1)[1]) == {"id": 1, "amount": 2.5}
+
+    def test_publish_without_subscribers_is_noop(self):
+        Broadcaster().publish("expense", {"id": 1})
+
+    def test_unsubscribed_after_block(self):
+        async def scenario():
+            b = Broadcaster()
+            async with b.subscribe():
+                pass
+            return b._subscribers
+
+        assert _run(scenario()) == set()
+
+    def test_publish_from_other_thread(self):
+        async def scenario():
+            b = Broadcaster()
+            async with b.subscribe() as q:
+                t = threading.Thread(target=b.publish, args=("purchase", {"ticketId": "T1"}))
+                t.start()
+                t.join()
+                return await asyncio.wait_for(q.get(), timeout=1)
+
+        assert _run(scenario()).startswith("event: purchase\n")
+
+    def test_slow_subscriber_drops_events(self, monkeypatch):
+        monkeypatch.setattr("events.SUBSCRIBER_QUEUE_SIZE", 1)
+
+        async def scenario():
+            b = Broadcaster()
+            async with b.subscribe() as q:
+                b.publish("expense", {"id": 1})
+                b.publish("expense", {"id": 2})
+                return q.qsize()
+
+        assert _run(scenario()) == 1
+
+    def test_stream_emits_events_and_keepalive(self, monkeypatch):
+        monkeypatch.setattr("events.KEEPALIVE_SECONDS", 0.01)
+
+        async def scenario():
+            b = Broadcaster()
+            disconnected = asyncio.Event()
+
+            async def is_disconnected():
+                return disconnected.is_set()
+
+            stream = b.stream(is_disconnected)
+            frames = [await stream.__anext__()]
+            b.publish("expense", {"id": 3})
+            frames.append(await stream.__anext__())
+            frames.append(await stream.__anext__())
+            disconnected.set()
+            await stream.aclose()
+            return frames, b._subscribers
+
+        frames, subscribers = _run(scenario())
+        assert frames[0] == ": connected\n\n"
+        assert frames[1].startswith("event: expense\n")
+        assert frames[2] == ": keepalive\n\n"
+        assert subscribers == set()
+
+
+class TestPostgresBackend:
+    def test_publish_from_the_loop_notifies_in_a_worker_thread(self):
+        delivered, notified = [], []
+        backend = PostgresBackend(delivered.append)
+        backend._notify = lambda message: notified.append((message, threading.get_ident()))
+
+        async def scenario():
+            backend._loop = asyncio.get_running_loop()
+            backend._conn = MagicMock()
+            backend.publish("hello")
+            await asyncio.sleep(0.05)
+
+        _run(scenario())
+        assert [m for m, _ in notified] == ["hello"]
+        assert notified[0][1] != threading.get_ident()
+        # Listening: the message comes back through LISTEN, not directly
+        assert delivered == []
+
+    def test_publish_outside_the_loop_notifies_inline(self):
+        backend = PostgresBackend(MagicMock())
+        backend._loop = MagicMock()
+        backend._conn = MagicMock()
+        backend._notify = MagicMock()
+        backend.publish("hello")
+        backend._notify.assert_called_once_with("hello")
+
+    def test_lost_connection_reconnects_with_backoff(self):
+        delivered = []
+        backend = PostgresBackend(delivered.append)
+        backend.RECONNECT_FIRST_DELAY = 0.001
+        backend._notify = MagicMock()
+        conn = MagicMock()
+        conn.poll.side_effect = RuntimeError("server closed the connection")
+
+        async def scenario():
+            backend._loop = MagicMock()
+            backend._loop.create_task.side_effect = asyncio.create_task
+            backend._conn = conn
+            backend._listen = AsyncMock(side_effect=[RuntimeError("refused"), None])
+            backend._on_readable()
+            assert backend._conn is None
+            conn.close.assert_called_once()
+            backend._loop.remove_reader.assert_called_once()
+            # Subscribers of this process still get events meanwhile
+            backend.publish("while down")
+            await backend._reconnect_task
+            return backend._listen.await_count
+
+        assert _run(scenario()) == 2
+        assert delivered == ["while down"]
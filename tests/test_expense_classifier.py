@@ -1,6 +1,21 @@
 """Tests for expense_classifier.py"""
+import re
+
 import pytest
-from expense_classifier import detect_expense_type, classify_by_emoji
+from expense_classifier import EXPENSE_PATTERNS, ExpenseClassifier, detect_expense_type, classify_by_emoji
+
+
+def _reference_detect(patterns, title, text=None):
+    """Original one-re.search-per-pattern implementation, used as the oracle."""
+    content = (title or "").lower()
+    if text:
+        content += " " + text.lower()
+    matches = {}
+    for expense_type, category_patterns in patterns.items():
+        count = sum(1 for p in category_patterns if re.search(p, content, re.IGNORECASE))
+        if count:
+            matches[expense_type] = count
+    return max(matches, key=matches.get) if matches else None
 
 
 # ─── detect_expense_type ────────────────────────────────────────────────────
@@ -86,6 +101,53 @@ class TestDetectExpenseType:
         assert detect_expense_type("Purchase #42", "supermarket weekly") == "grocery"
 
 
+# ─── ExpenseClassifier ──────────────────────────────────────────────────────
+
+EQUIVALENCE_CASES = [
+    ("Payment confirmed", "Paid €25.00 at Mercadona 🛒"),
+    ("Pizza Hut delivery", None),
+    ("Pizzeria Napoli", "Paid €12.00 at Pizzeria Napoli\n"),
+    ("YouTube Premium", "Paid €11.99 monthly"),
+    ("Booking.com", "Paid €300.00 at Booking.com hotel"),
+    ("H&M", "Paid €19.99 at H&M store"),
+    ("Pull&Bear", "Paid €29.99 at pull&bear"),
+    ("Telefónica", "Paid €45.00 internet suscripción mensual"),
+    ("Shell", "Paid €60.00 at Shell 🚗 ⛽"),
+    ("Mini Market", "Paid €4.50 at mini market bonarea"),
+    ("El Corte Ingles", "Paid €80.00 📱💻"),
+    ("Uber", "Paid €9.00 🚕 trip"),
+    ("Cafe Bar Tim", "Paid €3.20 at cafe-bar tim"),
+    ("Hostel", "inn lodge aparthotel 🏨 🛏️"),
+    ("Gas", "gas station gasolinera gas"),
+    ("subwayfan", "burgers kingdom kebabs"),
+    ("Farmacia", "dentista ⚕️ 💊 hospital"),
+    ("", ""),
+    (None, None),
+    ("Random thing", "no clue"),
+]
+
+
+class TestExpenseClassifier:
+    @pytest.mark.parametrize("title,text", EQUIVALENCE_CASES)
+    def test_matches_reference_implementation(self, title, text):
+        assert detect_expense_type(title, text) == _reference_detect(EXPENSE_PATTERNS, title, text)
+
+    def test_score_counts_patterns_once(self):
+        classifier = ExpenseClassifier(EXPENSE_PATTERNS)
+        assert classifier.score("pizza pizza pizza") == {}
+        assert classifier.score("sushi ramen 🍕") == {"restaurant": 2}
+
+    def test_ties_resolved_in_table_order(self):
+        classifier = ExpenseClassifier({"a": [r"\b(foo)\b"], "b": [r"\b(bar)\b"]})
+        assert classifier.classify("bar foo") == "a"
+
+    def test_non_literal_patterns_fall_back_to_regex(self):
+        patterns = {"numbers": [r"\b(order|ref)\s*#\d+\b"], "words": [r"\b(order)\b", r"[A-Z]x"]}
+        classifier = ExpenseClassifier(patterns)
+        for title, text in [("Order #42", None), ("order", "zx"), ("ref   #7", "")]:
+            assert classifier.classify(title, text) == _reference_detect(patterns, title, text)
+
+
 # ─── classify_by_emoji ──────────────────────────────────────────────────────
 
 class TestClassifyByEmoji:
@@ -0,0 +1,93 @@
+"""Tests for models/health_score_batch.py"""
+import copy
+import math
+import random
+
+import pytest
+
+from models.health_score import score_product
+from models.health_score_batch import score_products_batch, score_rows_batch
+
+# Every ladder bound of the scalar scorers, so random values land exactly on them
+BOUNDS = [0, 0.3, 0.5, 0.75, 1, 1.5, 2.3, 2.5, 3, 5, 8, 10, 12, 20, 22.5, 30, 35, 40, 45, 50, 60, 70, 80, 100, 160, 270, 400]
+CATEGORIES = ["en:beverages", "en:juices", "en:teas", "en:herbal-teas", "en:snacks", "en:dairies", "en:plant-based-milk"]
+KEYWORDS = ["te", "leche", "galletas", "zumo"]
+ADDITIVES = ["en:e102", "en:E211", "en:e330", "en:e407", "en:e999", "en:e102", "en:e250"]
+LABELS = ["en:organic", "en:vegan", "es:ecologico", "en:no-gluten"]
+
+
+def _value(rng):
+    choice = rng.random()
+    if choice < 0.15:
+        return None
+    if choice < 0.4:
+        return rng.choice(BOUNDS)
+    if choice < 0.45:
+        return rng.choice(["nan", "abc", str(rng.choice(BOUNDS)), -1])
+    return round(rng.uniform(0, 500) if rng.random() < 0.3 else rng.uniform(0, 50), rng.choice([0, 1, 3]))
+
+
+def _random_product(rng, n):
+    nutriments = {}
+    for key in ("energy-kcal_100g", "energy_100g", "sugars_100g", "saturated-fat_100g", "salt_100g",
+                "sodium_100g", "fiber_100g", "fibers_100g", "proteins_100g", "protein_100g",
+                "fruits-vegetables-nuts_100g", "fruits-vegetables-nuts-estimate_100g"):
+        value = _value(rng)
+        if value is not None:
+            nutriments[key] = value
+    product = {
+        "_id": str(8400000000000 + n),
+        "nutriments": nutriments,
+        "additives_tags": rng.sample(ADDITIVES, rng.randint(0, 4)),
+        "labels_tags": rng.sample(LABELS, rng.randint(0, 2)),
+        "nova_group": rng.choice([None, 1, 2, 3, 4, "4", "x"]),
+        "nutriscore_grade": rng.choice([None, "a", "c", "e", "unknown"]),
+    }
+    if rng.random() < 0.7:
+        product["categories_tags"] = rng.sample(CATEGORIES, rng.randint(0, 2))
+    if rng.random() < 0.3:
+        product["_keywords"] = rng.sample(KEYWORDS, rng.randint(1, 2))
+    if rng.random() < 0.2:
+        product["nutrition_data_per"] = rng.choice(["100g", "100ml"])
+    if rng.random() < 0.8:
+        product["product_name"] = f"Product {n}"
+    return product
+
+
+def _same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_score_product(seed):
+    rng = random.Random(seed)
+    products = [_random_product(rng, n) for n in range(400)]
+    # score_product extends categories_tags in place, so give each scorer its own copy
+    expected = [score_product(p).to_dict() for p in copy.deepcopy(products)]
+    actual = [hs.to_dict() for hs in score_products_batch(copy.deepcopy(products))]
+
+    for exp, act in zip(expected, actual):
+        assert exp.keys() == act.keys()
+        for key in exp:
+            assert _same(exp[key], act[key]), (exp["barcode"], key, exp[key], act[key])
+
+    # Stored inputs are enough to rescore (rescore.py): same result without the full product
+    batch = score_products_batch(copy.deepcopy(products))
+    assert [hs.source for hs in batch] == [score_product(p).source for p in copy.deepcopy(products)]
+    rescored = [hs.to_dict() for hs in score_products_batch([hs.source for hs in batch])]
+    assert rescored == [hs.to_dict() for hs in batch]
+
+
+def test_dry_infusion_and_beverage():
+    tea = {"_id": "1", "categories_tags": ["en:green-teas"], "nutriments": {"energy-kcal_100g": 300}}
+    juice = {"_id": "2", "categories_tags": ["en:juices"], "nutriments": {"sugars_100g": 9, "fruits-vegetables-nuts_100g": 100}}
+    rows = score_rows_batch(copy.deepcopy([tea, juice]))
+    assert rows[0]["nutriscore_points"] == 100.0
+    assert rows[0]["is_beverage"] is True
+    assert [row["total_score"] for row in rows] == [score_product(p).total_score for p in [tea, juice]]
+
+
+def test_empty_batch():
+    assert score_products_batch([]) == []
@@ -0,0 +1,73 @@
+"""Tests for http_client.py"""
+from http.client import HTTPMessage
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from requests.cookies import extract_cookies_to_jar
+
+import http_client
+
+
+@pytest.fixture(autouse=True)
+def _fresh_sessions():
+    http_client.close_all()
+    yield
+    http_client.close_all()
+
+
+class TestSessions:
+    def test_one_session_per_host(self):
+        a = http_client.get_session("https://world.openfoodfacts.net/api/v2/product/1")
+        b = http_client.get_session("https://world.openfoodfacts.net/api/v2/product/2")
+        c = http_client.get_session("https://www.carrefour.es/x")
+        assert a is b
+        assert a is not c
+
+    def test_adapter_pool_and_retry(self):
+        adapter = http_client.get_session("https://example.test").get_adapter("https://example.test")
+        assert adapter._pool_maxsize == http_client.POOL_MAXSIZE
+        retry = adapter.max_retries
+        assert retry.total == http_client.RETRIES
+        assert retry.allowed_methods == {"GET", "HEAD"}
+        assert 503 in retry.status_forcelist
+
+    def test_default_timeout_applied(self):
+        with patch("requests.Session.request") as request:
+            http_client.get("https://example.test/a", params={"q": 1})
+        assert request.call_args.kwargs["timeout"] == (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
+        assert request.call_args.kwargs["params"] == {"q": 1}
+
+    def test_explicit_timeout_kept(self):
+        with patch("requests.Session.request") as request:
+            http_client.post("https://example.test/a", data="x", timeout=1)
+        assert request.call_args.args[:2] == ("POST", "https://example.test/a")
+        assert request.call_args.kwargs["timeout"] == 1
+
+
+class TestCookies:
+    def test_shared_session_stores_no_cookies(self):
+        session = http_client.get_session("https://example.test")
+        headers = HTTPMessage()
+        headers["Set-Cookie"] = "sid=abc; Path=/"
+        response = MagicMock(_original_response=MagicMock(msg=headers))
+        extract_cookies_to_jar(session.cookies, requests.Request("GET", "https://example.test/a").prepare(), response)
+        assert not session.cookies
+
+    def test_explicit_cookies_are_still_sent(self):
+        session = http_client.get_session("https://example.test")
+        prepared = session.prepare_request(requests.Request("GET", "https://example.test/a", cookies={"sid": "abc"}))
+        assert prepared.headers["Cookie"] == "sid=abc"
+
+
+class TestImpersonated:
+    def test_session_per_thread_cleared_and_closed(self):
+        with patch.object(http_client.creq, "Session") as factory:
+            http_client.get_impersonated("https://example.test/a")
+            http_client.get_impersonated("https://example.test/b")
+            session = factory.return_value
+            assert factory.call_count == 1
+            assert session.cookies.clear.call_count == 2
+            http_client.close_all()
+        session.close.assert_called_once()
+        assert not http_client._impersonated
@@ -0,0 +1,94 @@
+"""Tests for off_import.py"""
+import csv
+import gzip
+import json
+from unittest.mock import MagicMock, patch
+
+import off_import
+from off_import import Importer, iter_products, open_dump, select_products, slim, to_csv
+
+
+def _product(code, countries=("en:france",), **extra):
+    return {
+        "code": code,
+        "_id": code,
+        "product_name": f"Product {code}",
+        "countries_tags": list(countries),
+        "nutriments": {"sugars_100g": 3, "sugars_unit": "g", "salt_100g": 0.2},
+        "packaging_text": "x" * 100,
+        **extra,
+    }
+
+
+def test_open_dump_reads_plain_and_gzip(tmp_path):
+    lines = [json.dumps(_product("1")), "", "not json", json.dumps(_product("2"))]
+    plain = tmp_path / "dump.jsonl"
+    plain.write_text("\n".join(lines), encoding="utf-8")
+    gz = tmp_path / "dump.jsonl.gz"
+    with gzip.open(gz, "wt", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+    for path in (plain, gz):
+        with open_dump(str(path)) as f:
+            assert [p["code"] for p in iter_products(f)] == ["1", "2"]
+
+
+def test_slim_keeps_scoring_fields_only():
+    kept = slim(_product("1"))
+    assert kept["_id"] == "1"
+    assert kept["nutriments"] == {"sugars_100g": 3, "salt_100g": 0.2}
+    assert "packaging_text" not in kept
+    assert "countries_tags" not in kept
+
+
+def test_select_by_barcode_or_spain():
+    products = [_product("1"), _product("2", countries=["en:spain"]), _product("3")]
+    assert [p["_id"] for p in select_products(products, {"1"}, spain=False)] == ["1"]
+    assert [p["_id"] for p in select_products(products, {"1"}, spain=True)] == ["1", "2"]
+
+
+def test_to_csv_distinguishes_null_and_empty():
+    buf = to_csv([{"a": None, "b": "", "c": True, "d": {"k": "v"}}], ["a", "b", "c", "d"])
+    assert next(csv.reader(buf)) == ["\\N", "", "true", '{"k": "v"}']
+
+
+def test_importer_flushes_in_chunks_and_scores_wanted_only():
+    conn = MagicMock()
+    products = [slim(_product(str(i))) for i in range(5)]
+    with patch.object(off_import, "copy_upsert") as copy:
+        importer = Importer(conn, wanted={"1", "4"}, chunk_size=2)
+        importer.run(iter(products))
+
+    tables = [c.args[1] for c in copy.call_args_list]
+    assert tables.count("off_products") == 3
+    assert tables.count("health_scores") == 2
+    assert importer.imported == 5
+    assert importer.scored == 2
+    scored = [row["barcode"] for c in copy.call_args_list if c.args[1] == "health_scores" for row in c.args[3]]
+    assert scored == ["1", "4"]
+
+
+def test_importer_forgets_cached_lookups_of_imported_barcodes():
+    cache = off_import.OpenFoodFacts.cache
+    cache.set("1", None)
+    cache.set("9", "kept")
+    try:
+        with patch.object(off_import, "copy_upsert"):
+            Importer(MagicMock(), wanted={"1"}).run(iter([slim(_product("1"))]))
+        assert cache.get("1", "gone") == "gone"
+        assert cache.get("9") == "kept"
+    finally:
+        cache.clear()
+
+
+def test_importer_keeps_the_last_copy_of_a_repeated_barcode():
+    products = [slim(_product("1", product_name="old")), slim(_product("2")), slim(_product("1", product_name="new"))]
+    with patch.object(off_import, "copy_upsert") as copy:
+        importer = Importer(MagicMock(), wanted={"1"}, rescore=True)
+        importer.run(iter(products))
+
+    rows = {c.args[1]: c.args[3] for c in copy.call_args_list}
+    assert [row["barcode"] for row in rows["off_products"]] == ["1", "2"]
+    assert rows["off_products"][0]["product"]["product_name"] == "new"
+    assert [row["barcode"] for row in rows["health_scores"]] == ["1"]
+    assert importer.imported == 2
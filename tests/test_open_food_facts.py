@@ -0,0 +1,248 @@
+"""Tests for models/open_food_facts.py"""
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from models.health_score import HealthScore
+from models.open_food_facts import OpenFoodFacts
+
+
+def _off_response(code):
+    return {"status": 1, "product": {"_id": code, "product_name": f"Product {code}"}}
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    OpenFoodFacts.cache.clear()
+    yield
+    OpenFoodFacts.cache.clear()
+
+
+def _off(stored=None, misses=None, local=None):
+    """OpenFoodFacts with the DB and network mocked out."""
+    off = OpenFoodFacts()
+    stored = dict(stored or {})
+    local = dict(local or {})
+    off.get_local = MagicMock(side_effect=lambda codes: {c: local[c] for c in codes if c in local})
+    off.get = MagicMock(side_effect=stored.get)
+    off.get_many = MagicMock(side_effect=lambda codes: {c: stored[c] for c in codes if c in stored})
+    off.get_misses = MagicMock(side_effect=lambda codes: {c: misses[c] for c in codes if c in (misses or {})})
+    off.save = MagicMock(side_effect=lambda hs: hs)
+    off.save_many = MagicMock()
+    off.save_misses = MagicMock(return_value=datetime.now() + timedelta(days=7))
+    off.fetch_product = MagicMock(side_effect=_off_response)
+    return off
+
+
+class TestGetProduct:
+    def test_second_call_served_from_memory(self):
+        off = _off({"1": HealthScore(barcode="1")})
+        assert off.get_product("1").barcode == "1"
+        assert off.get_product("1").barcode == "1"
+        off.get.assert_called_once_with("1")
+
+    def test_not_found_is_negative_cached(self):
+        off = _off()
+        off.fetch_product.side_effect = None
+        off.fetch_product.return_value = {"status": 0}
+        assert off.get_product("404") is None
+        assert off.get_product("404") is None
+        off.fetch_product.assert_called_once()
+        off.save_misses.assert_called_once_with(["404"])
+
+    def test_persisted_miss_skips_network(self):
+        off = _off(misses={"404": datetime.now() + timedelta(days=1)})
+        assert off.get_product("404") is None
+        off.fetch_product.assert_not_called()
+        assert OpenFoodFacts.cache.get("404") is None
+
+    def test_network_error_not_cached(self, caplog):
+        off = _off()
+        off.fetch_product.side_effect = requests.ConnectionError("unreachable")
+        assert off.get_product("1") is None
+        assert "Failed to fetch product 1 from Open Food Facts. Error: unreachable" in caplog.text
+        off.fetch_product.side_effect = _off_response
+        assert off.get_product("1").barcode == "1"
+        off.save_misses.assert_not_called()
+
+
+class TestGetProducts:
+    def test_dedupes_and_uses_cache(self):
+        cached = HealthScore(barcode="1", total_score=50)
+        off = _off({"1": cached})
+        result = asyncio.run(off.get_products(["1", "2", "2", None, "1"]))
+
+        assert list(result) == ["1", "2"]
+        assert result["1"] is cached
+        assert result["2"].barcode == "2"
+        off.get_many.assert_called_once_with(["1", "2"])
+        off.fetch_product.assert_called_once_with("2")
+        saved = off.save_many.call_args.args[0]
+        assert [hs.barcode for hs in saved] == ["2"]
+
+    def test_not_found_and_errors_return_none(self):
+        def fetch(code):
+            if code == "broken":
+                raise requests.ConnectionError()
+            return {"status": 0}
+
+        off = _off()
+        off.fetch_product.side_effect = fetch
+        result = asyncio.run(off.get_products(["missing", "broken"]))
+
+        assert result == {"missing": None, "broken": None}
+        off.save_many.assert_not_called()
+        off.save_misses.assert_called_once_with(["missing"])
+
+    def test_resolve_reports_codes_that_could_not_be_fetched(self):
+        def fetch(code):
+            if code == "broken":
+                raise requests.ConnectionError()
+            return {"status": 0}
+
+        off = _off()
+        off.fetch_product.side_effect = fetch
+        result, failed = asyncio.run(off.resolve_products(["missing", "broken"]))
+
+        assert result == {"missing": None, "broken": None}
+        assert failed == {"broken"}
+        assert OpenFoodFacts.cache.get("broken", "uncached") == "uncached"
+
+    def test_memory_and_persisted_misses_skip_lookups(self):
+        off = _off({"1": HealthScore(barcode="1")}, misses={"404": datetime.now() + timedelta(days=1)})
+        asyncio.run(off.get_products(["1", "404"]))
+        result = asyncio.run(off.get_products(["1", "404"]))
+
+        assert result["1"].barcode == "1"
+        assert result["404"] is None
+        off.get_many.assert_called_once_with(["1", "404"])
+        off.get_misses.assert_called_once_with(["404"])
+        off.fetch_product.assert_not_called()
+
+    def test_fetches_concurrently_within_limit(self):
+        off = _off()
+        lock = threading.Lock()
+        active = {"now": 0, "max": 0}
+
+        def slow_fetch(code):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.05)
+            with lock:
+                active["now"] -= 1
+            return _off_response(code)
+
+        off.fetch_product.side_effect = slow_fetch
+        start = time.monotonic()
+        result = asyncio.run(off.get_products([str(i) for i in range(6)], concurrency=3))
+        elapsed = time.monotonic() - start
+
+        assert len(result) == 6
+        assert active["max"] == 3
+        assert elapsed < 0.25
+
+    def test_empty_input(self):
+        off = _off()
+        assert asyncio.run(off.get_products([])) == {}
+        off.get_many.assert_not_called()
+
+
+class TestSingleFlight:
+    def _slow(self, off):
+        release = threading.Event()
+
+        def fetch(code):
+            release.wait(5)
+            return _off_response(code)
+
+        off.fetch_product.side_effect = fetch
+        return release
+
+    def test_concurrent_get_product_fetches_and_saves_once(self):
+        off = _off()
+        release = self._slow(off)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(off.get_product("1"))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert [hs.barcode for hs in results] == ["1"] * 4
+        off.fetch_product.assert_called_once_with("1")
+        off.save.assert_called_once()
+
+    def test_get_products_waits_for_in_flight_get_product(self):
+        off = _off()
+        release = self._slow(off)
+        single = []
+        thread = threading.Thread(target=lambda: single.append(off.get_product("1")))
+        thread.start()
+        time.sleep(0.05)
+
+        async def batch():
+            threading.Timer(0.05, release.set).start()
+            return await off.get_products(["1", "2"])
+
+        result = asyncio.run(batch())
+        thread.join(5)
+
+        assert result["1"] is single[0]
+        assert result["2"].barcode == "2"
+        assert sorted(c.args[0] for c in off.fetch_product.call_args_list) == ["1", "2"]
+        assert [hs.barcode for hs in off.save_many.call_args.args[0]] == ["2"]
+        assert not OpenFoodFacts.in_flight._flights
+
+    def test_waiting_caller_sees_the_failed_fetch(self):
+        off = _off()
+        release = threading.Event()
+
+        def fetch(code):
+            release.wait(5)
+            raise requests.ConnectionError()
+
+        off.fetch_product.side_effect = fetch
+
+        async def both():
+            threading.Timer(0.05, release.set).start()
+            return await asyncio.gather(off.resolve_products(["1"]), off.resolve_products(["1"]))
+
+        (_, leader_failed), (_, follower_failed) = asyncio.run(both())
+        assert leader_failed == follower_failed == {"1"}
+        off.fetch_product.assert_called_once_with("1")
+
+    def test_failed_batch_releases_its_codes(self):
+        off = _off()
+        off.get_many.side_effect = RuntimeError("db down")
+        with pytest.raises(RuntimeError):
+            asyncio.run(off.get_products(["1"]))
+        assert not OpenFoodFacts.in_flight._flights
+
+
+class TestLocalIndex:
+    PRODUCT = {"_id": "8410", "product_name": "Local", "nutriments": {"sugars_100g": 1}}
+
+    def test_get_product_scores_local_product_without_network(self):
+        off = _off(local={"8410": self.PRODUCT})
+        hs = off.get_product("8410")
+        assert hs.barcode == "8410"
+        assert hs.product_name == "Local"
+        off.save.assert_called_once()
+        off.fetch_product.assert_not_called()
+
+    def test_get_products_uses_local_index_before_network(self):
+        off = _off(local={"8410": self.PRODUCT})
+        result = asyncio.run(off.get_products(["8410", "2"]))
+        assert result["8410"].product_name == "Local"
+        off.get_local.assert_called_once_with(["8410", "2"])
+        off.fetch_product.assert_called_once_with("2")
+        saved = [hs.barcode for call in off.save_many.call_args_list for hs in call.args[0]]
+        assert sorted(saved) == ["2", "8410"]
@@ -0,0 +1,101 @@
+"""Tests for product_classifier.py"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from models.product import Product
+from product_classifier import (
+    ProductClassifier,
+    apply_rules,
+    categorized_rows,
+    classify_product,
+    evaluate,
+    learn_sub_families,
+)
+from prompts.product_categories import CATEGORIES
+from product_classifier import PRODUCT_PATTERNS
+
+
+def test_pattern_categories_are_the_prompt_categories():
+    assert set(PRODUCT_PATTERNS) <= set(CATEGORIES)
+
+
+@pytest.mark.parametrize("description,category", [
+    ("LECHE SEMIDESNATADA CARREFOUR 1L", "Dairy & Eggs"),
+    ("YOGUR GRIEGO NATURAL", "Dairy & Eggs"),
+    ("PLÁTANO DE CANARIAS", "Fresh Food"),
+    ("DETERGENTE LIQUIDO ARIEL", "Household & Cleaning"),
+    ("AGUA MINERAL 1,5L", "Beverages"),
+    ("CHAMPU ANTICASPA", "Personal Care & Hygiene"),
+    ("PIENSO PERRO ADULTO", "Pet Care"),
+    ("PAN DE MOLDE INTEGRAL", "Bakery & Sweets"),
+    ("MACARRONES GALLO", "Packaged & Processed Food"),
+])
+def test_obvious_descriptions_are_confident(description, category):
+    guess = classify_product(description)
+    assert guess.category == category
+    assert guess.confident
+
+
+def test_conflicting_keywords_are_not_confident():
+    guess = ProductClassifier(sub_families={}).classify("CHOCOLATE CON LECHE")
+    assert guess.category is not None
+    assert not guess.confident
+
+
+def test_unknown_description():
+    guess = ProductClassifier(sub_families={}).classify("XYZ 123")
+    assert guess.category is None
+    assert guess.confidence == 0.0
+
+
+def test_sub_family_evidence():
+    classifier = ProductClassifier(sub_families={"A1": {"category": "Dairy & Eggs", "purity": 0.9, "support": 20}})
+    assert classifier.classify("XYZ", "A1").category == "Dairy & Eggs"
+    assert classifier.classify("XYZ", "A1").source == "sub_family"
+    agreeing = classifier.classify("LECHE ENTERA", "A1")
+    assert agreeing.source == "both"
+    assert agreeing.confidence > 0.9
+    # Resolves the keyword conflict in favour of the sub-family, but not confidently enough to skip the LLM
+    assert classifier.classify("CHOCOLATE CON LECHE", "A1").category == "Dairy & Eggs"
+
+
+def test_learn_sub_families_needs_support_and_purity():
+    rows = [("x", "A1", "Dairy & Eggs")] * 9 + [("x", "A1", "Other")]
+    rows += [("x", "B2", "Beverages")] * 3
+    rows += [("x", "C3", "Beverages")] * 5 + [("x", "C3", "Other")] * 5
+    assert learn_sub_families(rows) == {"A1": {"category": "Dairy & Eggs", "purity": 0.9, "support": 10}}
+
+
+def test_evaluate_reports_hit_rate():
+    rows = [
+        ("LECHE ENTERA", None, "Dairy & Eggs"),
+        ("AGUA MINERAL", None, "Other"),
+        ("XYZ", None, "Other"),
+        ("CHOCOLATE CON LECHE", None, "Bakery & Sweets"),
+    ]
+    report = evaluate(ProductClassifier(sub_families={}), rows)
+    assert report == {
+        "rows": 4, "answered": 2, "correct": 1,
+        "coverage": 0.5, "precision": 0.5, "hit_rate": 0.25,
+    }
+
+
+def test_apply_rules_only_fills_confident_uncategorized():
+    milk = Product(description="LECHE ENTERA")
+    unknown = Product(description="XYZ")
+    done = Product(description="AGUA", category="Other")
+    assert apply_rules([milk, unknown, done]) == 1
+    assert (milk.category, milk.category_source) == ("Dairy & Eggs", "rules")
+    assert unknown.category is None
+    assert done.category == "Other"
+
+
+def test_learns_only_from_llm_and_user_categories():
+    db = MagicMock()
+    db.execute.return_value = [("LECHE", "F1", "Dairy & Eggs")]
+    with patch("database.SessionLocal", return_value=db):
+        assert categorized_rows() == [("LECHE", "F1", "Dairy & Eggs")]
+    sql = str(db.execute.call_args.args[0].compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "carrefour_item.\"categorySource\" IN ('llm', 'user')" in sql
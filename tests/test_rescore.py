@@ -0,0 +1,133 @@
+"""Tests for rescore.py"""
+import asyncio
+import copy
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import rescore
+from models.health_score import SCORING_VERSION, score_product, scoring_inputs
+from rescore import RescoreJob
+
+PRODUCT = {
+    "_id": "8410",
+    "product_name": "Galletas",
+    "categories_tags": ["en:biscuits"],
+    "additives_tags": ["en:e330"],
+    "countries_tags": ["en:spain"],
+    "nutriments": {"sugars_100g": 20, "salt_100g": 0.5, "sugars_unit": "g"},
+}
+
+
+def test_score_product_stamps_version_and_inputs():
+    hs = score_product(copy.deepcopy(PRODUCT))
+    assert hs.scoring_version == SCORING_VERSION
+    assert hs.source == scoring_inputs(PRODUCT)
+    assert "countries_tags" not in hs.source
+    assert hs.source["nutriments"] == {"sugars_100g": 20, "salt_100g": 0.5}
+    # The original categories must be stored, not the keyword-extended list
+    assert hs.source["categories_tags"] == ["en:biscuits"]
+
+
+def test_stored_inputs_reproduce_the_score():
+    original = score_product(copy.deepcopy(PRODUCT))
+    assert score_product(copy.deepcopy(original.source)).to_dict() == original.to_dict()
+
+
+def _job(chunks, chunk_size=2):
+    job = RescoreJob(chunk_size=chunk_size, version=SCORING_VERSION)
+    job.fetch_chunk = MagicMock(side_effect=chunks)
+    return job
+
+
+def test_run_rescores_chunks_until_nothing_is_stale():
+    source = scoring_inputs(PRODUCT)
+    job = _job([[("1", source), ("2", None)], [("3", source)], []])
+    db = MagicMock()
+    with patch.object(rescore, "SessionLocal", return_value=db), \
+            patch.object(rescore.rollups, "tickets_with", return_value={"T1"}) as tickets_with, \
+            patch.object(rescore.rollups, "refresh_purchases") as refresh:
+        job.run()
+
+    assert [c.args[1] for c in job.fetch_chunk.call_args_list] == ["", "2", "3"]
+    # Rollups of the tickets with rescored products are refreshed in the same transaction
+    assert [c.kwargs["barcodes"] for c in tickets_with.call_args_list] == [["1"], ["3"]]
+    assert refresh.call_args_list[0].args == (db, {"T1"})
+    assert job.rescored == 2
+    assert job.skipped == 1
+    updated = [row for c in db.execute.call_args_list for row in c.args[1]]
+    assert [row["barcode"] for row in updated] == ["1", "3"]
+    assert all(row["scoring_version"] == SCORING_VERSION for row in updated)
+    assert db.commit.call_count == 2
+
+
+def test_failed_chunk_rolls_back():
+    job = _job([[("1", scoring_inputs(PRODUCT))]])
+    db = MagicMock()
+    db.execute.side_effect = RuntimeError("db down")
+    with patch.object(rescore, "SessionLocal", return_value=db):
+        with pytest.raises(RuntimeError):
+            job.run()
+    db.rollback.assert_called_once()
+    db.close.assert_called_once()
+
+
+def test_stop_ends_after_current_chunk():
+    job = _job([[("1", None)], [("2", None)], []])
+    job.fetch_chunk.side_effect = lambda db, after: (job.stop(), [("1", None)])[1]
+    with patch.object(rescore, "SessionLocal", return_value=MagicMock()):
+        job.run()
+    assert job.fetch_chunk.call_count == 1
+
+
+def test_rescored_barcodes_leave_the_lookup_cache():
+    cache = rescore.OpenFoodFacts.cache
+    cache.set("1", "old score")
+    cache.set("2", "kept")
+    job = _job([[("1", scoring_inputs(PRODUCT)), ("2", None)], []])
+    try:
+        with patch.object(rescore, "SessionLocal", return_value=MagicMock()), \
+                patch.object(rescore.rollups, "tickets_with", return_value=set()), \
+                patch.object(rescore.rollups, "refresh_purchases"):
+            job.run()
+        assert cache.get("1", "gone") == "gone"
+        assert cache.get("2") == "kept"
+    finally:
+        cache.clear()
+
+
+def test_rows_without_stored_inputs_are_stale():
+    db = MagicMock()
+    db.execute.return_value = []
+    RescoreJob(version=SCORING_VERSION).fetch_chunk(db, "")
+    sql = str(db.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "health_scores.scoring_version < %(scoring_version_1)s OR health_scores.source IS NULL" in sql
+
+
+def test_shutdown_cancels_the_startup_task():
+    import main
+
+    cancelled = []
+
+    async def run_in_background(self):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0)
+
+    with patch.object(rescore, "ON_STARTUP", True), \
+            patch.object(RescoreJob, "run_in_background", run_in_background), \
+            patch.object(RescoreJob, "stop") as stop, \
+            patch.multiple(main, broadcaster=AsyncMock(), ticket_watcher=AsyncMock(), backfill_job=AsyncMock(),
+                           categorization_job=AsyncMock(), enrichment_queue=MagicMock(stop=AsyncMock()),
+                           http_client=MagicMock(), dispose_async_engine=AsyncMock()):
+        asyncio.run(scenario())
+
+    stop.assert_called_once()
+    assert cancelled == [True]
@@ -0,0 +1,85 @@
+"""Tests for rollups.py"""
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import rollups
+from rollups import monthly_rollup, purchase_rollup, weighted_score
+
+
+class TestWeightedScore:
+    def test_weights_by_spend(self):
+        assert weighted_score([(Decimal("3.00"), 90.0), (Decimal("1.00"), 10.0)]) == (4.0, 70.0)
+
+    def test_unscored_and_negative_amounts_carry_no_weight(self):
+        assert weighted_score([(2, 50.0), (5, None), (-1, 0.0), (None, 80.0)]) == (2.0, 50.0)
+
+    def test_nothing_scored_is_none_not_zero_division(self):
+        assert weighted_score([]) == (0.0, None)
+        assert weighted_score([(3, None)]) == (0.0, None)
+
+
+class TestPurchaseRollup:
+    def test_splits_and_score(self):
+        row = purchase_rollup("T1", datetime(2025, 3, 14, 18, 30), [
+            (Decimal("3.00"), "Dairy & Eggs", 80.0, 1, "A"),
+            (Decimal("1.00"), "Dairy & Eggs", 40.0, 4, "d"),
+            (Decimal("2.50"), None, None, None, None),
+        ])
+        assert row == {
+            "ticketId": "T1",
+            "month": date(2025, 3, 1),
+            "spend": 6.5,
+            "scored_spend": 4.0,
+            "health_score": 70.0,
+            "category_spend": {"Dairy & Eggs": 4.0, "unknown": 2.5},
+            "nova_spend": {"1": 3.0, "4": 1.0, "unknown": 2.5},
+            "nutriscore_spend": {"a": 3.0, "d": 1.0, "unknown": 2.5},
+        }
+
+    def test_empty_ticket(self):
+        row = purchase_rollup("T1", datetime(2025, 3, 1), [])
+        assert (row["spend"], row["health_score"], row["category_spend"]) == (0.0, None, {})
+
+
+class TestMonthlyRollup:
+    def test_sums_purchases_and_weights_their_scores(self):
+        first = purchase_rollup("T1", datetime(2025, 3, 1), [(Decimal("3.00"), "Beverages", 90.0, 1, "a")])
+        second = purchase_rollup("T2", datetime(2025, 3, 20), [(Decimal("1.00"), "Beverages", 10.0, 4, "e"),
+                                                                (Decimal("2.00"), "Other", None, None, None)])
+        month = monthly_rollup(date(2025, 3, 1), [first, second])
+        assert month["purchases"] == 2
+        assert month["spend"] == 6.0
+        assert month["scored_spend"] == 4.0
+        assert month["health_score"] == 70.0
+        assert month["category_spend"] == {"Beverages": 4.0, "Other": 2.0}
+        assert month["nutriscore_spend"] == {"a": 3.0, "e": 1.0, "unknown": 2.0}
+
+    def test_month_without_scores(self):
+        month = monthly_rollup(date(2025, 3, 1), [purchase_rollup("T1", datetime(2025, 3, 1), [(1, None, None, None, None)])])
+        assert (month["scored_spend"], month["health_score"]) == (0.0, None)
+
+
+class TestRefresh:
+    def test_nothing_to_refresh_skips_the_database(self):
+        db = MagicMock()
+        assert rollups.refresh_purchases(db, []) == 0
+        assert rollups.tickets_with(db, barcodes=[None]) == set()
+        db.execute.assert_not_called()
+
+    def test_refresh_logs_and_rolls_back_on_error(self):
+        db = MagicMock()
+        db.execute.side_effect = RuntimeError("db down")
+        with patch.object(rollups, "SessionLocal", return_value=db):
+            rollups.refresh(["T1"])
+        db.rollback.assert_called_once()
+        db.close.assert_called_once()
+
+    def test_months_are_locked_in_order_before_they_are_read(self):
+        db = MagicMock()
+        db.execute.return_value = []
+        rollups.refresh_months(db, {date(2025, 3, 1), date(2024, 12, 1)})
+        sql = [str(c.args[0].compile(compile_kwargs={"literal_binds": True})) for c in db.execute.call_args_list]
+        assert sql[0] == f"SELECT pg_advisory_xact_lock({rollups.MONTH_LOCK}, 202412) AS pg_advisory_xact_lock_1"
+        assert sql[1] == f"SELECT pg_advisory_xact_lock({rollups.MONTH_LOCK}, 202503) AS pg_advisory_xact_lock_1"
+        assert "FROM purchase_rollups" in sql[2]
@@ -0,0 +1,138 @@
+"""Tests for ticket_watcher.py"""
+import asyncio
+import itertools
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from ticket_watcher import TicketWatcher, backoff
+
+
+def _client(listings):
+    client = MagicMock()
+    client.email = "me@example.com"
+    client.get_purchases.side_effect = listings
+    client.get_purchase.side_effect = lambda purchase_id: SimpleNamespace(ticket_id=purchase_id)
+    return client
+
+
+def _watcher(client, window=0.05, saved=()):
+    watcher = TicketWatcher(window=window, first_delay=0.001, max_delay=0.004, client_factory=lambda: client)
+    watcher.unsaved = MagicMock(side_effect=lambda ids: [i for i in ids if i not in saved])
+    watcher.save_purchase = MagicMock(return_value=True)
+    watcher.load_watches = MagicMock(return_value=[])
+    watcher.save_watch = MagicMock()
+    watcher.delete_watch = MagicMock()
+    return watcher
+
+
+def _listing(*ids):
+    return {"purchases": [{"purchaseId": i} for i in ids]}
+
+
+async def _finish(watcher):
+    await asyncio.gather(*watcher._tasks.values())
+
+
+async def _watch_once(watcher):
+    watcher.trigger()
+    await _finish(watcher)
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    assert list(itertools.islice(backoff(5, 60), 6)) == [5, 10, 20, 40, 60, 60]
+
+
+def test_watch_saves_the_new_ticket_and_finishes():
+    client = _client([_listing("OLD"), _listing("NEW", "OLD")])
+    watcher = _watcher(client, window=10, saved={"OLD"})
+
+    async def scenario():
+        assert watcher.trigger() is True
+        await _finish(watcher)
+
+    asyncio.run(scenario())
+    assert client.get_purchases.call_count == 2
+    client.get_purchase.assert_called_once_with("NEW")
+    watcher.save_purchase.assert_called_once()
+    watcher.delete_watch.assert_called_once_with("me@example.com")
+    assert not watcher.watching("me@example.com")
+
+
+def test_repeated_triggers_share_one_watch_and_extend_it():
+    client = _client(itertools.repeat(_listing()))
+    watcher = _watcher(client, window=0.05)
+
+    async def scenario():
+        assert watcher.trigger() is True
+        first_deadline = watcher._deadlines[client.email]
+        await asyncio.sleep(0.01)
+        assert watcher.trigger() is False
+        assert watcher._deadlines[client.email] > first_deadline
+        assert len(watcher._tasks) == 1
+        await _finish(watcher)
+
+    asyncio.run(scenario())
+    client.get_purchase.assert_not_called()
+    watcher.delete_watch.assert_called_once()
+
+
+def test_failed_polls_back_off_until_the_deadline():
+    client = _client(itertools.repeat(RuntimeError("Carrefour down")))
+    watcher = _watcher(client, window=0.03)
+    asyncio.run(_watch_once(watcher))
+
+    assert client.get_purchases.call_count >= 2
+    # Progress is stored after every unsuccessful poll, then the watch is dropped
+    attempts = [c.args[3] for c in watcher.save_watch.call_args_list]
+    assert attempts[:3] == [0, 1, 2]
+    watcher.delete_watch.assert_called_once()
+
+
+def test_event_loop_stays_free_while_watching():
+    client = _client(None)
+    # A slow Carrefour answer blocks a worker thread, not the loop
+    client.get_purchases.side_effect = lambda **kwargs: time.sleep(0.2) or _listing()
+    watcher = _watcher(client, window=1)
+
+    async def scenario():
+        watcher.trigger()
+        await asyncio.sleep(0.02)
+        started = asyncio.get_running_loop().time()
+        await asyncio.sleep(0.01)
+        lag = asyncio.get_running_loop().time() - started
+        await watcher.stop()
+        return lag
+
+    assert asyncio.run(scenario()) < 0.05
+
+
+def test_stop_keeps_the_stored_watch_and_start_resumes_it():
+    watcher = _watcher(_client(itertools.repeat(_listing())), window=10)
+
+    async def interrupted():
+        watcher.trigger()
+        await asyncio.sleep(0.01)
+        await watcher.stop()
+
+    asyncio.run(interrupted())
+    watcher.delete_watch.assert_not_called()
+
+    since = datetime.now() - timedelta(hours=1)
+    stored = [
+        SimpleNamespace(account="me@example.com", since=since, deadline=datetime.now() + timedelta(minutes=5)),
+        SimpleNamespace(account="old@example.com", since=since, deadline=datetime.now()),
+    ]
+    client = _client([_listing("NEW")])
+    restarted = _watcher(client, window=10)
+    restarted.load_watches.return_value = stored
+
+    async def resumed():
+        await restarted.start()
+        assert restarted.watching("me@example.com")
+        await _finish(restarted)
+
+    asyncio.run(resumed())
+    assert client.get_purchases.call_args.kwargs["from_date"] == since.isoformat()
+    assert [c.args[0] for c in restarted.delete_watch.call_args_list] == ["old@example.com", "me@example.com"]
@@ -0,0 +1,217 @@
+"""
+Carrefour ticket watcher
+
+A Carrefour payment notification means a new ticket will show up in the
+account shortly, but not right away. ``ticket_watcher.trigger()`` starts
+watching for it in the background and returns immediately: the watch polls
+the purchase list with exponential backoff (``TICKET_WATCH_FIRST_DELAY``
+seconds, doubling up to ``TICKET_WATCH_MAX_DELAY``) until a ticket that is not
+saved yet appears or ``TICKET_WATCH_WINDOW`` seconds pass without one.
+
+There is one watch per account: triggers that arrive while it runs only push
+its deadline back. Watches are stored in ``carrefour_ticket_watches`` so that
+the ones interrupted by a restart are resumed at startup. Carrefour calls run
+in worker threads, never on the event loop. Health scores and categories of
+a saved ticket are left to the enrichment queue (enrichment.py).
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+import enrichment
+import rollups
+from database import SessionLocal
+from events import broadcaster
+from models.carrefour_client import CarrefourClient
+from models.purchase import Purchase
+from models.ticket_watch import TicketWatch
+
+logger = logging.getLogger(__name__)
+
+WINDOW = float(os.getenv("TICKET_WATCH_WINDOW", "600"))
+FIRST_DELAY = float(os.getenv("TICKET_WATCH_FIRST_DELAY", "5"))
+MAX_DELAY = float(os.getenv("TICKET_WATCH_MAX_DELAY", "60"))
+# How far back the purchase list is searched for tickets not saved yet
+LOOKBACK_MINUTES = int(os.getenv("TICKET_WATCH_LOOKBACK_MINUTES", "1000"))
+LIST_COUNT = 10
+
+
+def backoff(first: float, maximum: float, factor: float = 2.0) -> Iterator[float]:
+    """first, first * factor, ... capped at maximum, forever."""
+    delay = first
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+
+class TicketWatcher:
+    def __init__(self, window: float = WINDOW, first_delay: float = FIRST_DELAY, max_delay: float = MAX_DELAY,
+                 lookback_minutes: int = LOOKBACK_MINUTES, client_factory: Callable[[], CarrefourClient] = CarrefourClient):
+        self.window = window
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.lookback_minutes = lookback_minutes
+        self.client_factory = client_factory
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._deadlines: dict[str, datetime] = {}
+
+    def watching(self, account: str) -> bool:
+        task = self._tasks.get(account)
+        return task is not None and not task.done()
+
+    def trigger(self) -> bool:
+        """Watch for a new ticket of the configured account. Returns False if a running watch was extended."""
+        client = self.client_factory()
+        deadline = datetime.now() + timedelta(seconds=self.window)
+        if self.watching(client.email):
+            self._deadlines[client.email] = max(self._deadlines[client.email], deadline)
+            return False
+        since = datetime.now() - timedelta(minutes=self.lookback_minutes)
+        self._start(client, since, deadline)
+        return True
+
+    def _start(self, client: CarrefourClient, since: datetime, deadline: datetime):
+        self._deadlines[client.email] = deadline
+        self._tasks[client.email] = asyncio.create_task(self._watch(client, since))
+
+    async def start(self):
+        """Resume the watches a previous process left unfinished."""
+        try:
+            watches = await asyncio.to_thread(self.load_watches)
+        except Exception as e:
+            logger.error(f"Failed to load pending ticket watches. Error: {e}")
+            return
+        client = self.client_factory()
+        for watch in watches:
+            if watch.account != client.email:
+                logger.warning(f"Dropping ticket watch of unknown account {watch.account}")
+                await asyncio.to_thread(self.delete_watch, watch.account)
+            elif not self.watching(watch.account):
+                logger.info(f"Resuming ticket watch of {watch.account} until {watch.deadline.isoformat()}")
+                self._start(client, watch.since, watch.deadline)
+
+    async def stop(self):
+        """Cancel running watches; they stay stored and resume on the next start."""
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def _watch(self, client: CarrefourClient, since: datetime):
+        account = client.email
+        seen: set[str] = set()
+        attempts = 0
+        try:
+            await asyncio.to_thread(self.save_watch, account, since, self._deadlines[account], attempts)
+            for delay in backoff(self.first_delay, self.max_delay):
+                await asyncio.sleep(delay)
+                attempts += 1
+                try:
+                    saved = await self.poll(client, since, seen)
+                except Exception as e:
+                    logger.warning(f"Ticket watch poll {attempts} for {account} failed. Error: {e}")
+                    saved = []
+                if saved:
+                    logger.info(f"Ticket watch found {len(saved)} new tickets after {attempts} polls")
+                    break
+                if datetime.now() >= self._deadlines[account]:
+                    logger.info(f"No new Carrefour ticket after {attempts} polls, giving up")
+                    break
+                await asyncio.to_thread(self.save_watch, account, since, self._deadlines[account], attempts)
+            await asyncio.to_thread(self.delete_watch, account)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ticket watch for {account} failed. Error: {e}")
+        finally:
+            if self._tasks.get(account) is asyncio.current_task():
+                del self._tasks[account]
+                self._deadlines.pop(account, None)
+
+    async def poll(self, client: CarrefourClient, since: datetime, seen: set[str]) -> list[Purchase]:
+        """Save the tickets listed since ``since`` that are not saved yet."""
+        listing = await asyncio.to_thread(client.get_purchases, from_date=since.isoformat(), count=LIST_COUNT)
+        ids = [p.get("purchaseId") for p in listing.get("purchases", []) if p.get("purchaseId")]
+        ids = [i for i in ids if i not in seen]
+        saved = []
+        for purchase_id in await asyncio.to_thread(self.unsaved, ids):
+            purchase = await asyncio.to_thread(client.get_purchase, purchase_id)
+            if await asyncio.to_thread(self.save_purchase, purchase):
+                saved.append(purchase)
+        seen.update(ids)
+        return saved
+
+    def unsaved(self, purchase_ids: list[str]) -> list[str]:
+        if not purchase_ids:
+            return []
+        db = SessionLocal()
+        try:
+            known = set(db.execute(select(Purchase.ticket_id).where(Purchase.ticket_id.in_(purchase_ids))).scalars())
+        finally:
+            db.close()
+        return [i for i in purchase_ids if i not in known]
+
+    def save_purchase(self, purchase: Purchase) -> bool:
+        """Insert a ticket and its rollup, and queue its enrichment. Returns False if it was already saved."""
+        db = SessionLocal()
+        try:
+            if db.execute(select(Purchase.id).where(Purchase.ticket_id == purchase.ticket_id)).first():
+                return False
+            db.add(purchase)
+            db.flush()
+            rollups.refresh_purchases(db, [purchase.ticket_id])
+            enrichment.enqueue(db, [purchase.ticket_id])
+            db.commit()
+            logger.info(f"Saved Carrefour ticket {purchase.ticket_id} with {len(purchase.products)} products")
+            broadcaster.publish("purchase", purchase.to_header_dict())
+            return True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def load_watches(self) -> list[TicketWatch]:
+        db = SessionLocal()
+        try:
+            return list(db.execute(select(TicketWatch)).scalars())
+        finally:
+            db.close()
+
+    def save_watch(self, account: str, since: datetime, deadline: datetime, attempts: int):
+        db = SessionLocal()
+        try:
+            stmt = insert(TicketWatch).values(account=account, since=since, deadline=deadline, attempts=attempts)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[TicketWatch.account],
+                set_={"deadline": stmt.excluded.deadline, "attempts": stmt.excluded.attempts, "updated_at": func.now()},
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to store the ticket watch of {account}. Error: {e}")
+        finally:
+            db.close()
+
+    def delete_watch(self, account: str):
+        db = SessionLocal()
+        try:
+            db.execute(delete(TicketWatch).where(TicketWatch.account == account))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to delete the ticket watch of {account}. Error: {e}")
+        finally:
+            db.close()
+
+
+ticket_watcher = TicketWatcher()
@@ -1,6 +1,6 @@
 'use client';
 
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import dynamic from 'next/dynamic';
 
 export interface Expense {
@@ -37,6 +37,7 @@ export default function Map() {
   const [error, setError] = useState<string | null>(null);
   const [selectedId, setSelectedId] = useState<number | null>(null);
   const [centerTo, setCenterTo] = useState<{ lat: number; lng: number } | null>(null);
+  const watermarkRef = useRef<number | null>(null);
 
   useEffect(() => {
     async function fetchExpenses() {
@@ -45,14 +46,40 @@ export default function Map() {
         if (!res.ok) throw new Error('Failed to fetch');
         const data = await res.json();
         setExpenses(data.data || []);
+        watermarkRef.current = data.watermark ?? null;
       } catch (err) {
         setError(err instanceof Error ? err.message : 'Unknown error');
       } finally {
         setLoading(false);
       }
     }
+
+    // Only ask for rows inserted since the last poll
+    async function fetchChanges() {
+      if (watermarkRef.current === null) return fetchExpenses();
+      try {
+        let hasMore = true;
+        while (hasMore) {
+          const res = await fetch(`/api/expenses?since=${watermarkRef.current}&limit=500`);
+          if (!res.ok) throw new Error('Failed to fetch');
+          const data = await res.json();
+          const fresh: Expense[] = data.data || [];
+          if (fresh.length) {
+            setExpenses(prev => {
+              const known = new Set(prev.map(e => e.id));
+              return [...fresh.filter(e => !known.has(e.id)).reverse(), ...prev];
+            });
+          }
+          watermarkRef.current = data.watermark;
+          hasMore = data.has_more;
+        }
+      } catch (err) {
+        setError(err instanceof Error ? err.message : 'Unknown error');
+      }
+    }
+
     fetchExpenses();
-    const interval = setInterval(fetchExpenses, 30000);
+    const interval = setInterval(fetchChanges, 30000);
     return () => clearInterval(interval);
   }, []);
 